@@ -6,43 +6,24 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
-# NOTE: this example requires numpy and joblib packages. These can be installed via pip.
+# NOTE: this example requires the numpy package. This can be installed via pip.
 # e.g. pip install numpy
-#      pip install joblib
 #
 import argparse
 import os
 import time
 
 import numpy as np
-from joblib import Parallel, delayed
 
 from pymwalib.correlator_context import CorrelatorContext
 from pymwalib.errors import PymwalibNoDataForTimestepAndCoarseChannelError
+from pymwalib.parallel_reader import ProcessPoolReader
 from pymwalib.version import check_mwalib_version
 
 
-def sum_by_baseline_task(metafits_filename: str, gpubox_filenames: list, coarse_chan_index: int) -> float:
-    chan_sum = 0.
-
-    with CorrelatorContext(metafits_filename, gpubox_filenames) as context:
-        if coarse_chan_index < context.num_coarse_chans:
-            print(f"sum_by_baseline_task: Summing {context.num_timesteps} timesteps "
-                  f"and coarse channel index {coarse_chan_index}...")
-
-            for t in range(0, context.num_timesteps):
-                try:
-                    data = context.read_by_frequency(t, coarse_chan_index)
-                    chan_sum += np.sum(data, dtype=np.float64)
-
-                except PymwalibNoDataForTimestepAndCoarseChannelError:
-                    pass
-
-                except Exception as e:
-                    print(f"Error: {e}")
-                    exit(-1)
-
-    return chan_sum
+def sum_hdu_task(timestep_index: int, coarse_chan_index: int, data) -> float:
+    # Runs in a ProcessPoolReader worker, which opened its CorrelatorContext once when it started
+    return np.sum(data, dtype=np.float64)
 
 
 def sum_by_baseline_slow(metafits_filename: str, gpubox_filenames: list) -> float:
@@ -90,9 +71,13 @@ if __name__ == "__main__":
     print(f"Using {num_cores} cores to fast sum all hdus...")
 
     start_time_fast = time.time()
-    processed_list = Parallel(n_jobs=num_cores)(
-        delayed(sum_by_baseline_task)(args.metafits, args.gpuboxes, c) for c in range(24))
-    fast_sum = np.sum(processed_list)
+    with CorrelatorContext(args.metafits, args.gpuboxes) as context:
+        hdus = [(t, c) for c in context.provided_coarse_chan_indices for t in context.provided_timestep_indices]
+
+    with ProcessPoolReader(CorrelatorContext, args.metafits, args.gpuboxes, num_cores) as reader:
+        processed_list = reader.map(sum_hdu_task, hdus, read="read_by_frequency",
+                                    chunksize=max(1, len(hdus) // (num_cores * 4)))
+    fast_sum = np.sum([hdu_sum for hdu_sum in processed_list if hdu_sum is not None])
     stop_time_fast = time.time()
     print(f"Sum is: {fast_sum} in {stop_time_fast - start_time_fast} seconds.\n")
 
@@ -2,6 +2,8 @@ import argparse
 import matplotlib.pyplot as plt
 import numpy as np
 import math
+from pymwalib.analysis import POLS, compute_products, get_raw_dump_table, make_table, select_baselines, \
+    write_table
 from pymwalib.common import MWAVersion
 import pymwalib.correlator_context
 
@@ -38,6 +40,8 @@ class ViewFITSArgs:
 
         self.dumpraw = passed_args["dump_raw"]
         self.dumpplot = passed_args["dump_plot"]
+        self.dump_format = passed_args["dump_format"]
+        self.zero_flagged = passed_args["zero_flagged"]
 
         # Are we plotting?
         self.any_plotting = (
@@ -210,14 +214,48 @@ class ViewFITSArgs:
         print(self.param_string)
 
 
-def meets_criteria(i, j, a1, a2, mode):
-    # mode == RANGE | BASELINE
-    if mode == MODE_RANGE:
-        return i >= a1 and j <= a2
-    elif mode == MODE_BASELINE:
-        return i == a1 and j == a2
-    else:
-        return None
+def get_selected_baselines(program_args: ViewFITSArgs) -> np.ndarray:
+    metafits_context = program_args.context.metafits_context
+
+    if program_args.mode == MODE_BASELINE:
+        if program_args.autos_only and program_args.tile1 != program_args.tile2:
+            return np.empty(0, dtype=np.intp)
+        return np.array(
+            [metafits_context.baseline_index(program_args.tile1, program_args.tile2)]
+        )
+
+    return select_baselines(
+        metafits_context,
+        program_args.tile1,
+        program_args.tile2,
+        program_args.autos_only,
+    )
+
+
+def print_tiles(program_args: ViewFITSArgs):
+    metafits_context = program_args.context.metafits_context
+
+    print(f"Mode: {metafits_context.corr_fine_chan_width_hz/1000} kHz, {metafits_context.corr_int_time_ms/1000} s")
+
+    print(f"Timesteps: 1 - {len(program_args.context.timesteps)}")
+
+    print(
+        "QUAKTIME:"
+        f"{metafits_context.quack_time_duration_ms/1000.} s\n"
+    )
+
+    for title, flagged in (("Unflagged tiles:", False), ("Flagged tiles:", True)):
+        print(f"\n{title}")
+        print("================")
+        for i, antenna in enumerate(metafits_context.antennas):
+            if (antenna.rf_input_x.flagged or antenna.rf_input_y.flagged) == flagged:
+                print(
+                    f"Index {i}, TileID:"
+                    f" {antenna.tile_id} "
+                    f"{antenna.tile_name}"
+                    f" (rec:{antenna.rf_input_x.rec_number},"
+                    f"slot:{antenna.rf_input_x.rec_slot_number})"
+                )
 
 
 # v1 = baseline, freq, pol
@@ -229,414 +267,114 @@ def peek_fits(program_args: ViewFITSArgs):  # noqa: C901
     plot_ppd_data_y = None
     plot_ppd2_data_x = None
     plot_ppd2_data_y = None
+    plot_ppd3_data_x = None
+    plot_ppd3_data_y = None
     plot_grid_data = None
     plot_grid2_data = None
     plot_phase_data_x = None
     plot_phase_data_y = None
 
-    # ppd array will be [timestep][channel]
-    if program_args.ppd_plot:
-        plot_ppd_data_x = np.empty(
-            shape=(program_args.channel_count, program_args.time_step_count)
-        )
-        plot_ppd_data_x.fill(0)
-        plot_ppd_data_y = np.empty(
-            shape=(program_args.channel_count, program_args.time_step_count)
-        )
-        plot_ppd_data_y.fill(0)
-
-    # ppd plot 2 array will be [timestep][baseline][channel]
-    if program_args.ppd_plot2:
-        plot_ppd2_data_x = np.empty(
-            shape=(
-                program_args.time_step_count,
-                program_args.baseline_count,
-                program_args.channel_count,
-            )
-        )
-        plot_ppd2_data_x.fill(0)
-        plot_ppd2_data_y = np.empty(
-            shape=(
-                program_args.time_step_count,
-                program_args.baseline_count,
-                program_args.channel_count,
-            )
-        )
-        plot_ppd2_data_y.fill(0)
-
-    # ppd3 array will be [channel]
-    if program_args.ppd_plot3:
-        plot_ppd3_data_x = np.empty(
-            shape=(program_args.channel_count)
-        )
-        plot_ppd3_data_x.fill(0)
-        plot_ppd3_data_y = np.empty(
-            shape=(program_args.channel_count)
-        )
-        plot_ppd3_data_y.fill(0)
-
-    # Grid plot
-    if program_args.grid_plot:
-        plot_grid_data = np.empty(
-            shape=(
-                program_args.time_step_count,
-                program_args.tile_count,
-                program_args.tile_count,
-            )
-        )
-        plot_grid_data.fill(0)
-
-    # Grid plot 2 array
-    if program_args.grid_plot2:
-        plot_grid2_data = np.empty(
-            shape=(
-                program_args.time_step_count,
-                program_args.tile_count,
-                program_args.tile_count,
-            )
-        )
-        plot_grid2_data.fill(0)
-
-    # Phase plot
-    if program_args.phase_plot_all or program_args.phase_plot_one:
-        plot_phase_data_x = np.empty(
-            shape=(
-                program_args.time_step_count,
-                program_args.baseline_count,
-                program_args.channel_count,
-            )
-        )
-        plot_phase_data_x.fill(0)
-        plot_phase_data_y = np.empty(
-            shape=(
-                program_args.time_step_count,
-                program_args.baseline_count,
-                program_args.channel_count,
-            )
+    if program_args.grid_plot2 and program_args.grid_pol not in POLS:
+        print(
+            "Grid Plot requires you to specify "
+            "-gp (--gridpol) and "
+            "takes XX,XY,YX,YY as parameters"
         )
-        plot_phase_data_y.fill(0)
-
-    raw_dump_file = None
-    plot_dump_file = None
+        exit(-1)
 
     if program_args.correlator_version == MWAVersion.CorrMWAXv2.value:
-        filename = f"{program_args.context.metafits_context.obs_id}_mwax.csv"
+        filename = f"{program_args.context.metafits_context.obs_id}_mwax.{program_args.dump_format}"
     else:
-        filename = f"{program_args.context.metafits_context.obs_id}_mwa.csv"
-
-    # Open a file for dumping the plot values
-    if program_args.dumpplot:
-        plot_dump_filename = f"plot_dump_{filename}"
-        print(f"Openning {plot_dump_filename} for writing")
-        plot_dump_file = open(plot_dump_filename, "w")
-
-        # Write the csv header depending on the type of plot
-        if program_args.ppd_plot:
-            plot_dump_file.write("time_index, fine_chan, x, y\n")
-
-        elif program_args.ppd_plot2:
-            plot_dump_file.write("plot_number, time_index, fine_chan, x, y\n")
-
-        if program_args.ppd_plot3:
-            plot_dump_file.write("fine_chan, x, y\n")
-
-        elif program_args.grid_plot:
-            plot_dump_file.write(
-                "unix_time, tile1, tile2, log10_scaled_power\n"
-            )
-
-        elif program_args.grid_plot2:
-            plot_dump_file.write(
-                "unix_time, tile1, tile2, log10_scaled_power\n"
-            )
+        filename = f"{program_args.context.metafits_context.obs_id}_mwa.{program_args.dump_format}"
 
-        elif program_args.phase_plot_one:
-            plot_dump_file.write("time_index, baseline, x, y\n")
+    # Work out which products we need
+    products = []
+    if program_args.ppd_plot or program_args.ppd_plot3:
+        products.append("ppd")
+    if program_args.ppd_plot2:
+        products.append("power")
+    if program_args.grid_plot or program_args.grid_plot2:
+        products.append("grid")
+    if program_args.phase_plot_all or program_args.phase_plot_one:
+        products.append("phase")
+    if program_args.dumpraw:
+        products.append("vis")
 
-        elif program_args.phase_plot_all:
-            plot_dump_file.write("time_index, baseline, x, y\n")
+    # Print all tile info
+    print_tiles(program_args)
 
-    # print a csv header for the raw dump
-    if program_args.dumpraw:
-        raw_dump_filename = f"raw_dump_{filename}"
-        print(f"Openning {raw_dump_filename} for writing")
-        raw_dump_file = open(raw_dump_filename, "w")
+    baselines = get_selected_baselines(program_args)
+    timestep_indices = list(range(program_args.hdu_time1, program_args.hdu_time2 + 1))
 
-        raw_dump_file.write(
-            "unix_time, baseline, ant1, ant2, fine_ch, "
-            "xx_r, xx_i, xy_r, xy_i, yx_r, yx_i, yy_r, yy_i, "
-            "xx_pow, xy_pow, yx_pow, yy_pow, x_phase_deg, y_phase_deg\n"
-        )
+    print(
+        f"Processing {len(timestep_indices)} timesteps "
+        f"(timestep indices {program_args.hdu_time1}-{program_args.hdu_time2}) "
+        f"of {len(baselines)} baselines..."
+    )
 
-    for timestep_index, timestep in enumerate(program_args.context.timesteps):
-        time_index = timestep_index - program_args.hdu_time1
+    results = compute_products(
+        program_args.context,
+        timestep_indices,
+        program_args.context.provided_coarse_chan_indices[0],
+        baselines,
+        program_args.channel1,
+        program_args.channel2,
+        products,
+        flagged_baselines=(
+            program_args.context.metafits_context.baseline_flags
+            if program_args.zero_flagged
+            else None
+        ),
+    )
 
-        if (
-            timestep_index < program_args.hdu_time1
-            or timestep_index > program_args.hdu_time2
-        ):
-            # print(f"Skipping timestep index {timestep_index} (out of range)")
-            continue
-        else:
-            print(
-                f"Processing timestep: {timestep.index} "
-                f"(time index: {time_index})..."
-            )
+    for time_index in np.flatnonzero(results["missing"]):
+        print(f"No data for timestep index {timestep_indices[time_index]}")
 
-        # Read data
-        data = program_args.context.read_by_baseline(
-            timestep.index,
-            program_args.context.provided_coarse_chan_indices[0],
-        )
-        data = data.reshape(
-            program_args.context.metafits_context.num_baselines,
-            program_args.chan_x_pols_x_vals,
-        )
+    # ppd array will be [channel][timestep]
+    if program_args.ppd_plot:
+        plot_ppd_data_x = (results["ppd"][:, :, 0] / program_args.baseline_count).T.copy()
+        plot_ppd_data_y = (results["ppd"][:, :, 3] / program_args.baseline_count).T.copy()
 
-        baseline = 0
-        selected_baseline = 0
-
-        # Print all tile info but only for the first timestep we have
-        if time_index == 0:
-            print(f"Mode: {program_args.context.metafits_context.corr_fine_chan_width_hz/1000} kHz, {program_args.context.metafits_context.corr_int_time_ms/1000} s")
-            
-            print(f"Timesteps: 1 - {len(program_args.context.timesteps)}")
-            
-            print(
-                "QUAKTIME:"
-                f"{program_args.context.metafits_context.quack_time_duration_ms/1000.} s\n"
-            )
+    # ppd plot 2 array will be [timestep][baseline][channel]
+    if program_args.ppd_plot2:
+        plot_ppd2_data_x = results["power"][..., 0]
+        plot_ppd2_data_y = results["power"][..., 3]
 
-            print("\nUnflagged tiles:")
-            print("================")
-            for i in range(
-                0, len(program_args.context.metafits_context.antennas)
-            ):
-                if (
-                    program_args.context.metafits_context.antennas[
-                        i
-                    ].rf_input_x.flagged
-                    is False
-                    and program_args.context.metafits_context.antennas[
-                        i
-                    ].rf_input_y.flagged
-                    is False
-                ):
-                    print(
-                        f"Index {i}, TileID:"
-                        f" {program_args.context.metafits_context.antennas[i].tile_id} "
-                        f"{program_args.context.metafits_context.antennas[i].tile_name}"
-                        f" (rec:{program_args.context.metafits_context.antennas[i].rf_input_x.rec_number},"
-                        f"slot:{program_args.context.metafits_context.antennas[i].rf_input_x.rec_slot_number})"
-                    )
+    # ppd3 array will be [channel]
+    if program_args.ppd_plot3:
+        print(f"Averaging {program_args.time_step_count} timesteps for each channel...")
+        plot_ppd3_data_x = results["ppd"][:, :, 0].sum(axis=0) / program_args.time_step_count
+        plot_ppd3_data_y = results["ppd"][:, :, 3].sum(axis=0) / program_args.time_step_count
 
-            print("\nFlagged tiles:")
-            print("================")
-            for i in range(
-                0, len(program_args.context.metafits_context.antennas)
-            ):
-                if (
-                    program_args.context.metafits_context.antennas[
-                        i
-                    ].rf_input_x.flagged
-                    or program_args.context.metafits_context.antennas[
-                        i
-                    ].rf_input_y.flagged
-                ):
-                    print(
-                        f"Index {i}, TileID:"
-                        f" {program_args.context.metafits_context.antennas[i].tile_id} "
-                        f"{program_args.context.metafits_context.antennas[i].tile_name}"
-                        f" (rec:{program_args.context.metafits_context.antennas[i].rf_input_x.rec_number},"
-                        f"slot:{program_args.context.metafits_context.antennas[i].rf_input_x.rec_slot_number})"
-                    )
+    # Grid plot arrays will be [timestep][tile2][tile1]
+    tiles = slice(program_args.tile1, program_args.tile2 + 1)
 
-        for i in range(0, program_args.tile2 + 1):
-            for j in range(i, program_args.fits_tiles):
-                # Explaining this if:
-                # Line 1. Check for autos if that's what we asked for
-                # Line 2. OR just be True if we didn't ask for autos only.
-                # Line 3 (Applicable to cases 1 and 2 above):
-                #         Check the selected tile1 and tile2 are in range
-                if (
-                    (i == j and program_args.autos_only is True)
-                    or (program_args.autos_only is False)
-                ) and (
-                    meets_criteria(
-                        i,
-                        j,
-                        program_args.tile1,
-                        program_args.tile2,
-                        program_args.mode,
-                    )
-                ):
-                    for chan in range(
-                        program_args.channel1, program_args.channel2 + 1
-                    ):
-                        index = chan * (
-                            program_args.pols * program_args.values
-                        )
+    if program_args.grid_plot:
+        plot_grid_data = results["grid"][:, tiles, tiles, 0] + results["grid"][:, tiles, tiles, 3]
 
-                        if (
-                            program_args.context.metafits_context.antennas[
-                                i
-                            ].rf_input_x.flagged
-                            or program_args.context.metafits_context.antennas[
-                                i
-                            ].rf_input_y.flagged
-                            or program_args.context.metafits_context.antennas[
-                                j
-                            ].rf_input_x.flagged
-                            or program_args.context.metafits_context.antennas[
-                                j
-                            ].rf_input_y.flagged
-                        ) and 1 == 0:
-                            xx_r = 0
-                            xx_i = 0
-
-                            xy_r = 0
-                            xy_i = 0
-
-                            yx_r = 0
-                            yx_i = 0
-
-                            yy_r = 0
-                            yy_i = 0
-
-                            power_xx = 0
-                            power_xy = 0
-                            power_yx = 0
-                            power_yy = 0
-
-                            phase_x = 0
-                            phase_y = 0
-
-                        else:
-                            xx_r = data[baseline][index]
-                            xx_i = data[baseline][index + 1]
-
-                            xy_r = data[baseline][index + 2]
-                            xy_i = data[baseline][index + 3]
-
-                            yx_r = data[baseline][index + 4]
-                            yx_i = data[baseline][index + 5]
-
-                            yy_r = data[baseline][index + 6]
-                            yy_i = data[baseline][index + 7]
-
-                            power_xx = xx_i * xx_i + xx_r * xx_r
-                            power_xy = xy_i * xy_i + xy_r * xy_r
-                            power_yx = yx_i * yx_i + yx_r * yx_r
-                            power_yy = yy_i * yy_i + yy_r * yy_r
-
-                            phase_x = math.degrees(math.atan2(xx_i, xx_r))
-                            phase_y = math.degrees(math.atan2(yy_i, yy_r))
-
-                        if program_args.ppd_plot:
-                            plot_ppd_data_x[chan][
-                                time_index
-                            ] = plot_ppd_data_x[chan][time_index] + (
-                                power_xx / program_args.baseline_count
-                            )
-                            plot_ppd_data_y[chan][
-                                time_index
-                            ] = plot_ppd_data_y[chan][time_index] + (
-                                power_yy / program_args.baseline_count
-                            )  # noqa: E127
-
-                            # No idea, but the line above fails E127 in PEP8.
-                            # I have no idea why. The line above it
-                            # does not fail... weird
-
-                        elif program_args.ppd_plot2:
-                            plot_ppd2_data_x[time_index][selected_baseline][
-                                chan
-                            ] = power_xx
-                            plot_ppd2_data_y[time_index][selected_baseline][
-                                chan
-                            ] = power_yy
-
-                        elif program_args.ppd_plot3:                            
-                            plot_ppd3_data_x[chan] += power_xx
-                            plot_ppd3_data_y[chan] += power_yy
-
-                        elif program_args.grid_plot:
-                            plot_grid_data[time_index][j][i] = (
-                                plot_grid_data[time_index][j][i]
-                                + power_xx
-                                + power_yy
-                            )
-
-                        elif program_args.grid_plot2:
-                            # offset index by the polarisation
-                            if program_args.grid_pol == "XX":
-                                plot_grid2_data[time_index][j][i] += power_xx
-                            elif program_args.grid_pol == "XY":
-                                plot_grid2_data[time_index][j][i] += power_xy
-                            elif program_args.grid_pol == "YX":
-                                plot_grid2_data[time_index][j][i] += power_yx
-                            elif program_args.grid_pol == "YY":
-                                plot_grid2_data[time_index][j][i] += power_yy
-                            else:
-                                print(
-                                    "Grid Plot requires you to specify "
-                                    "-gp (--gridpol) and "
-                                    "takes XX,XY,YX,YY as parameters"
-                                )
-                                exit(-1)
-
-                        elif (
-                            program_args.phase_plot_all
-                            or program_args.phase_plot_one
-                        ):
-                            plot_phase_data_x[time_index][selected_baseline][
-                                chan
-                            ] = phase_x
-                            plot_phase_data_y[time_index][selected_baseline][
-                                chan
-                            ] = phase_y
-
-                        if program_args.dumpraw:
-                            raw_dump_file.write(
-                                f"{timestep.unix_time_ms / 1000.0},"
-                                f"{baseline},"
-                                f"{i},"
-                                f"{j},"
-                                f"{chan},"
-                                f"{xx_r},"
-                                f"{xx_i},"
-                                f"{xy_r},"
-                                f"{xy_i},"
-                                f"{yx_r},"
-                                f"{yx_i},"
-                                f"{yy_r},"
-                                f"{yy_i},"
-                                f"{power_xx},"
-                                f"{power_xy},"
-                                f"{power_yx},"
-                                f"{power_yy},"
-                                f"{phase_x},"
-                                f"{phase_y}\n"
-                            )
-
-                    selected_baseline = selected_baseline + 1
-
-                baseline = baseline + 1
+    if program_args.grid_plot2:
+        plot_grid2_data = results["grid"][:, tiles, tiles, POLS.index(program_args.grid_pol)].copy()
 
-    if program_args.ppd_plot3:
-        print(f"Averaging {program_args.time_step_count} timesteps for each channel...")
-        for chan in range(
-                        program_args.channel1, program_args.channel2 + 1
-                    ):
-            print(f"Channel: {chan}")
-            plot_ppd3_data_x[chan] /= program_args.time_step_count
-            plot_ppd3_data_y[chan] /= program_args.time_step_count
+    # Phase plot arrays will be [timestep][baseline][channel]
+    if program_args.phase_plot_all or program_args.phase_plot_one:
+        plot_phase_data_x = results["phase"][..., 0]
+        plot_phase_data_y = results["phase"][..., 1]
 
     print("Processing of data done!")
 
     if program_args.dumpraw:
-        if raw_dump_file:
-            raw_dump_file.close()
+        raw_dump_filename = f"raw_dump_{filename}"
+        print(f"Writing {raw_dump_filename}")
+        write_table(
+            raw_dump_filename,
+            get_raw_dump_table(
+                program_args.context,
+                timestep_indices,
+                baselines,
+                program_args.channel1,
+                results["vis"],
+            ),
+        )
 
     if program_args.ppd_plot:
         convert_to_db = False
@@ -682,13 +420,90 @@ def peek_fits(program_args: ViewFITSArgs):  # noqa: C901
             plot_phase_data_y,
         )
 
+    # Dump the plot values (after plotting, so any scaling done for the plot is included)
     if program_args.dumpplot:
-        if plot_dump_file:
-            plot_dump_file.close()
+        plot_dump_filename = f"plot_dump_{filename}"
+        print(f"Writing {plot_dump_filename}")
+        write_table(
+            plot_dump_filename,
+            get_plot_dump_table(
+                program_args,
+                timestep_indices,
+                baselines,
+                plot_ppd_data_x,
+                plot_ppd_data_y,
+                plot_ppd2_data_x,
+                plot_ppd2_data_y,
+                plot_ppd3_data_x,
+                plot_ppd3_data_y,
+                plot_grid_data if program_args.grid_plot else plot_grid2_data,
+                plot_phase_data_x,
+                plot_phase_data_y,
+            ),
+        )
 
     print("view_fits Done!\n")
 
 
+def get_plot_dump_table(
+    program_args: ViewFITSArgs,
+    timestep_indices,
+    baselines,
+    plot_ppd_data_x,
+    plot_ppd_data_y,
+    plot_ppd2_data_x,
+    plot_ppd2_data_y,
+    plot_ppd3_data_x,
+    plot_ppd3_data_y,
+    plot_grid_data,
+    plot_phase_data_x,
+    plot_phase_data_y,
+):
+    time_index = np.arange(program_args.time_step_count)
+    fine_chan = np.arange(program_args.channel1, program_args.channel2 + 1)
+
+    # Only one plot's data is dumped, in the same order of precedence as before
+    if program_args.ppd_plot:
+        return make_table({
+            "time_index": time_index[np.newaxis, :],
+            "fine_chan": fine_chan[:, np.newaxis],
+            "x": plot_ppd_data_x,
+            "y": plot_ppd_data_y,
+        })
+
+    if program_args.ppd_plot2:
+        return make_table({
+            "plot_number": time_index[:, np.newaxis, np.newaxis],
+            "baseline": baselines[np.newaxis, :, np.newaxis],
+            "fine_chan": fine_chan[np.newaxis, np.newaxis, :],
+            "x": plot_ppd2_data_x,
+            "y": plot_ppd2_data_y,
+        })
+
+    if program_args.ppd_plot3:
+        return make_table({"fine_chan": fine_chan, "x": plot_ppd3_data_x, "y": plot_ppd3_data_y})
+
+    if program_args.grid_plot or program_args.grid_plot2:
+        unix_time = np.array([program_args.context.timesteps.unix_time_ms[timestep_index]
+                              for timestep_index in timestep_indices]) / 1000.0
+        tiles = np.arange(program_args.tile1, program_args.tile2 + 1)
+        tile1, tile2 = np.triu_indices(program_args.tile_count)
+        return make_table({
+            "unix_time": unix_time[:, np.newaxis],
+            "tile1": tiles[tile1][np.newaxis, :],
+            "tile2": tiles[tile2][np.newaxis, :],
+            "log10_scaled_power": plot_grid_data[:, tile2, tile1],
+        })
+
+    return make_table({
+        "time_index": time_index[:, np.newaxis, np.newaxis],
+        "baseline": baselines[np.newaxis, :, np.newaxis],
+        "fine_chan": fine_chan[np.newaxis, np.newaxis, :],
+        "x": plot_phase_data_x,
+        "y": plot_phase_data_y,
+    })
+
+
 def do_ppd_plot(
     title,
     program_args: ViewFITSArgs,
@@ -1440,6 +1255,21 @@ if __name__ == "__main__":
         help="Dump the plot data",
         action="store_true",
     )
+    parser.add_argument(
+        "-zf",
+        "--zero-flagged",
+        required=False,
+        help="Zero the data of baselines with a flagged tile (from the metafits)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-df",
+        "--dump-format",
+        required=False,
+        help="Format of the raw and plot dumps: csv or npy. Default is 'csv'",
+        choices=["csv", "npy"],
+        default="csv",
+    )
     args = vars(parser.parse_args())
 
     parsed_args = ViewFITSArgs(args)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#
+# aio: asyncio front-ends for CorrelatorContext and VoltageContext
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import asyncio
+import collections
+import os
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from .correlator_context import CorrelatorContext
+from .errors import PymwalibNoDataForTimestepAndCoarseChannelError, PymwalibInvalidArgumentError
+from .voltage_context import VoltageContext
+
+
+class _AsyncContext:
+    """
+    Base class of the asyncio front-ends. Blocking mwalib calls run on a thread pool of max_workers threads and
+    at most max_pending calls are submitted to it at once; further calls wait (without blocking the event loop)
+    until one finishes. The wrapped context is available as .context.
+
+    """
+
+    def __init__(self, context, max_workers: typing.Optional[int] = None, max_pending: typing.Optional[int] = None,
+                 owns_context: bool = False):
+        """Wrap an open context. If owns_context is True the context is freed by close()."""
+        self.context = context
+        self.max_workers: int = max_workers if max_workers else os.cpu_count()
+        self.max_pending: int = max_pending if max_pending else self.max_workers
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pymwalib_aio")
+        self._owns_context = owns_context
+        # Created on first use so it belongs to the running event loop
+        self._semaphore: typing.Optional[asyncio.Semaphore] = None
+
+    @classmethod
+    async def _open(cls, context_class, metafits_filename: str, data_filenames: list,
+                    max_workers: typing.Optional[int], max_pending: typing.Optional[int], **kwargs):
+        async_context = cls(None, max_workers, max_pending, owns_context=True)
+        async_context.context = await async_context._run(context_class, metafits_filename, data_filenames, **kwargs)
+        return async_context
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Wait for any outstanding calls, shut down the thread pool and, if we opened it, free the context"""
+        await asyncio.get_running_loop().run_in_executor(None, partial(self._executor.shutdown, wait=True))
+
+        if self._owns_context and self.context is not None:
+            self.context.__exit__(None, None, None)
+            self.context = None
+
+    async def _run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on the thread pool once there is room for it"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def _read_or_none(self, read: str, item: tuple) -> typing.Optional[np.ndarray]:
+        """Read item with the context's read method, returning None if there is no data for it"""
+        try:
+            return await self._run(getattr(self.context, read), *item)
+        except PymwalibNoDataForTimestepAndCoarseChannelError:
+            return None
+
+    async def _iter_reads(self, read: str, items: typing.Iterable[tuple],
+                          prefetch: int) -> typing.AsyncIterator[typing.Tuple[tuple, np.ndarray]]:
+        """Yield (item, data) for each item which has data, keeping up to prefetch reads in flight while the
+           caller processes each one. No further reads are started while the caller is not asking for more."""
+        if prefetch < 1:
+            raise PymwalibInvalidArgumentError(f"prefetch must be at least 1, not {prefetch}")
+
+        pending = collections.deque()
+
+        try:
+            for item in items:
+                pending.append((item, asyncio.ensure_future(self._read_or_none(read, item))))
+
+                if len(pending) > prefetch:
+                    next_item, future = pending.popleft()
+                    data = await future
+                    if data is not None:
+                        yield next_item, data
+
+            while pending:
+                next_item, future = pending.popleft()
+                data = await future
+                if data is not None:
+                    yield next_item, data
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+class AsyncCorrelatorContext(_AsyncContext):
+    """
+    asyncio front-end to a CorrelatorContext: reads are awaitable and run on a bounded thread pool (see
+    _AsyncContext), so many concurrent requests can be served without blocking the event loop.
+
+    Either wrap an open context, AsyncCorrelatorContext(context), or open one without blocking the event loop:
+
+        async with await AsyncCorrelatorContext.open(metafits_filename, gpubox_filenames) as context:
+            data = await context.read_by_baseline(0, 0)
+
+    """
+
+    @classmethod
+    async def open(cls, metafits_filename: str, gpubox_filenames: list, max_workers: typing.Optional[int] = None,
+                   max_pending: typing.Optional[int] = None, **kwargs) -> "AsyncCorrelatorContext":
+        """Create the CorrelatorContext (passing it any kwargs) on the thread pool. It is freed by close()."""
+        return await cls._open(CorrelatorContext, metafits_filename, gpubox_filenames, max_workers, max_pending,
+                               **kwargs)
+
+    async def read_by_baseline(self, timestep_index: int, coarse_chan_index: int, out=None) -> np.ndarray:
+        """Awaitable CorrelatorContext.read_by_baseline()"""
+        return await self._run(self.context.read_by_baseline, timestep_index, coarse_chan_index, out=out)
+
+    async def read_by_frequency(self, timestep_index: int, coarse_chan_index: int, out=None) -> np.ndarray:
+        """Awaitable CorrelatorContext.read_by_frequency()"""
+        return await self._run(self.context.read_by_frequency, timestep_index, coarse_chan_index, out=out)
+
+    async def iter_hdus(self, order: str = "time", prefetch: int = 2,
+                        data_order: str = "baseline") -> typing.AsyncIterator[typing.Tuple[int, int, np.ndarray]]:
+        """async for over (timestep_index, coarse_chan_index, data) for every provided timestep and coarse channel
+           (see CorrelatorContext.iter_hdus), skipping pairs with no data. Up to prefetch HDUs are read ahead
+           of the caller. Each data array is newly allocated, so may be kept."""
+        # Raises if data_order is not valid
+        self.context.get_hdu_shape(data_order)
+        read = "read_by_baseline" if data_order == "baseline" else "read_by_frequency"
+
+        async for (timestep_index, coarse_chan_index), data in self._iter_reads(
+                read, self.context.get_provided_hdu_indices(order), prefetch):
+            yield timestep_index, coarse_chan_index, data
+
+
+class AsyncVoltageContext(_AsyncContext):
+    """
+    asyncio front-end to a VoltageContext: reads are awaitable and run on a bounded thread pool (see
+    _AsyncContext), so many concurrent requests can be served without blocking the event loop.
+
+    Either wrap an open context, AsyncVoltageContext(context), or open one without blocking the event loop with
+    await AsyncVoltageContext.open(metafits_filename, voltage_filenames).
+
+    """
+
+    @classmethod
+    async def open(cls, metafits_filename: str, voltage_filenames: list, max_workers: typing.Optional[int] = None,
+                   max_pending: typing.Optional[int] = None, **kwargs) -> "AsyncVoltageContext":
+        """Create the VoltageContext (passing it any kwargs) on the thread pool. It is freed by close()."""
+        return await cls._open(VoltageContext, metafits_filename, voltage_filenames, max_workers, max_pending,
+                               **kwargs)
+
+    async def read_file(self, timestep_index: int, coarse_chan_index: int, out=None) -> np.ndarray:
+        """Awaitable VoltageContext.read_file()"""
+        return await self._run(self.context.read_file, timestep_index, coarse_chan_index, out=out)
+
+    async def read_second(self, gps_second_start: int, gps_second_count: int, coarse_chan_index: int,
+                          out=None) -> np.ndarray:
+        """Awaitable VoltageContext.read_second()"""
+        return await self._run(self.context.read_second, gps_second_start, gps_second_count, coarse_chan_index,
+                               out=out)
+
+    async def iter_files(self, coarse_chan_index: int,
+                         prefetch: int = 2) -> typing.AsyncIterator[typing.Tuple[int, np.ndarray]]:
+        """async for over (timestep_index, data) for each provided timestep of the coarse channel, skipping
+           timesteps with no data. Up to prefetch files are read ahead of the caller."""
+        items = [(timestep_index, coarse_chan_index) for timestep_index in self.context.provided_timestep_indices]
+
+        async for (timestep_index, _), data in self._iter_reads("read_file", items, prefetch):
+            yield timestep_index, data
+
+    async def iter_seconds(self, gps_second_start: int, gps_second_end: int, coarse_chan_index: int,
+                           chunk_seconds: int = 1,
+                           prefetch: int = 2) -> typing.AsyncIterator[typing.Tuple[int, np.ndarray]]:
+        """async for over (gps_second, data) for gps_second_start <= gps_second < gps_second_end in chunks of
+           chunk_seconds (the last may be shorter), skipping chunks with no data. Up to prefetch chunks are read
+           ahead of the caller."""
+        items = self.context.get_second_chunks(gps_second_start, gps_second_end, coarse_chan_index, chunk_seconds)
+
+        async for (gps_second, _, _), data in self._iter_reads("read_second", items, prefetch):
+            yield gps_second, data
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# analysis: vectorized power, phase, PPD and grid products of correlator data, and bulk table dumps
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import typing
+
+import numpy as np
+
+from .errors import PymwalibInvalidArgumentError
+from .parallel_reader import ParallelReader
+
+# Order of the visibility pols in an HDU
+POLS = ("XX", "XY", "YX", "YY")
+
+PRODUCTS = ("vis", "power", "phase", "ppd", "grid")
+
+
+def get_power(vis: np.ndarray) -> np.ndarray:
+    """Returns the float64 power (real^2 + imag^2) of each complex visibility in vis"""
+    real = vis.real.astype(np.float64)
+    imag = vis.imag.astype(np.float64)
+    return real * real + imag * imag
+
+
+def get_phase_deg(vis: np.ndarray) -> np.ndarray:
+    """Returns the float64 phase, in degrees (-180 to 180), of each complex visibility in vis"""
+    return np.degrees(np.arctan2(vis.imag.astype(np.float64), vis.real.astype(np.float64)))
+
+
+def select_baselines(metafits_context, first_ant: int, last_ant: int, autos_only: bool = False) -> np.ndarray:
+    """Returns the indices (in baseline order) of the baselines whose antennas are both within first_ant to
+       last_ant (inclusive), only including the auto correlations if autos_only is True"""
+    ant1_index = metafits_context.baseline_ant1_index
+    ant2_index = metafits_context.baseline_ant2_index
+    mask = (ant1_index >= first_ant) & (ant2_index <= last_ant)
+
+    if autos_only:
+        mask &= metafits_context.auto_baseline_mask
+
+    return np.flatnonzero(mask)
+
+
+def compute_products(context, timestep_indices: list, coarse_chan_index: int, baselines,
+                     chan_start: int = 0, chan_end: typing.Optional[int] = None,
+                     products: typing.Iterable[str] = ("ppd",), max_workers: typing.Optional[int] = None,
+                     flagged_baselines=None) -> dict:
+    """Reads one coarse channel of a CorrelatorContext for each timestep and reduces each HDU, as a whole, to the
+       requested products, for the given baselines (an index array) and fine channels chan_start to chan_end
+       (inclusive, default is the last). Timesteps are read and reduced in parallel on a ParallelReader of
+       max_workers threads; numpy releases the GIL for the reductions, as mwalib does for the reads. If
+       flagged_baselines (a (baseline) boolean array, e.g. MetafitsMetadata.baseline_flags) is given, the
+       visibilities of flagged baselines are zeroed before the products are computed.
+
+       Returns a dict with a (timestep) boolean "missing" array, True where there was no data (those timesteps'
+       products are zero), plus an array for each product, with a leading timestep axis:
+
+         vis   : (timestep, baseline, chan, pol) complex64 copy of the selected visibilities
+         power : (timestep, baseline, chan, pol) float64 power
+         phase : (timestep, baseline, chan, 2) float64 phase in degrees of XX and YY
+         ppd   : (timestep, chan, pol) float64 power summed over the selected baselines
+         grid  : (timestep, ant2, ant1, pol) float64 power summed over the selected channels, for each baseline
+                 (ant1 <= ant2) of the selection. Other cells are zero.
+
+       pol is in POLS order."""
+    products = tuple(products)
+    for product in products:
+        if product not in PRODUCTS:
+            raise PymwalibInvalidArgumentError(f"product must be one of {PRODUCTS}, not {product!r}")
+
+    num_chans = context.metafits_context.num_corr_fine_chans_per_coarse
+    chan_end = num_chans - 1 if chan_end is None else chan_end
+    if not 0 <= chan_start <= chan_end < num_chans:
+        raise PymwalibInvalidArgumentError(f"Fine channels {chan_start} to {chan_end} are not within 0 to "
+                                           f"{num_chans - 1}")
+
+    baselines = np.asarray(baselines, dtype=np.intp)
+    selection_flags = None if flagged_baselines is None else np.asarray(flagged_baselines, dtype=bool)[baselines]
+    ant1_index = context.metafits_context.baseline_ant1_index[baselines]
+    ant2_index = context.metafits_context.baseline_ant2_index[baselines]
+    num_ants = context.metafits_context.num_ants
+    num_pols = len(POLS)
+    shape = (len(timestep_indices), len(baselines), chan_end - chan_start + 1)
+
+    results = {"missing": np.ones(len(timestep_indices), dtype=bool)}
+    if "vis" in products:
+        results["vis"] = np.zeros(shape + (num_pols,), dtype=np.complex64)
+    if "power" in products:
+        results["power"] = np.zeros(shape + (num_pols,), dtype=np.float64)
+    if "phase" in products:
+        results["phase"] = np.zeros(shape + (2,), dtype=np.float64)
+    if "ppd" in products:
+        results["ppd"] = np.zeros((shape[0], shape[2], num_pols), dtype=np.float64)
+    if "grid" in products:
+        results["grid"] = np.zeros((shape[0], num_ants, num_ants, num_pols), dtype=np.float64)
+
+    positions = {timestep_index: position for position, timestep_index in enumerate(timestep_indices)}
+
+    def reduce(timestep_index: int, _coarse_chan_index: int, data: np.ndarray):
+        position = positions[timestep_index]
+        # Fancy indexing copies the selection out of the (reused) read buffer
+        vis = context.get_complex_view(data, "baseline")[baselines, chan_start:chan_end + 1]
+        if selection_flags is not None:
+            vis[selection_flags] = 0
+
+        if "vis" in products:
+            results["vis"][position] = vis
+        if "phase" in products:
+            results["phase"][position] = get_phase_deg(vis[..., [0, 3]])
+        if "power" in products or "ppd" in products or "grid" in products:
+            power = get_power(vis)
+            if "power" in products:
+                results["power"][position] = power
+            if "ppd" in products:
+                results["ppd"][position] = power.sum(axis=0)
+            if "grid" in products:
+                results["grid"][position, ant2_index, ant1_index] = power.sum(axis=1)
+
+        results["missing"][position] = False
+
+    with ParallelReader(context, max_workers) as reader:
+        reader.map(reduce, [(timestep_index, coarse_chan_index) for timestep_index in timestep_indices])
+
+    return results
+
+
+def get_raw_dump_table(context, timestep_indices: list, baselines, chan_start: int, vis: np.ndarray) -> np.ndarray:
+    """Returns a table (see make_table) with one row per timestep, baseline and fine channel of vis (the "vis"
+       product of compute_products) with its unix time, baseline, antennas, fine channel, the real and imaginary
+       parts and power of each pol, and the phase of XX and YY"""
+    baselines = np.asarray(baselines, dtype=np.intp)
+    unix_times = np.array([context.timesteps.unix_time_ms[timestep_index]
+                           for timestep_index in timestep_indices]) / 1000.0
+    power = get_power(vis)
+    phase = get_phase_deg(vis[..., [0, 3]])
+
+    columns = {
+        "unix_time": unix_times[:, np.newaxis, np.newaxis],
+        "baseline": baselines[np.newaxis, :, np.newaxis],
+        "ant1": context.metafits_context.baseline_ant1_index[baselines][np.newaxis, :, np.newaxis],
+        "ant2": context.metafits_context.baseline_ant2_index[baselines][np.newaxis, :, np.newaxis],
+        "fine_ch": np.arange(chan_start, chan_start + vis.shape[2])[np.newaxis, np.newaxis, :],
+    }
+    for pol_index, pol in enumerate(POLS):
+        columns[f"{pol.lower()}_r"] = vis[..., pol_index].real
+        columns[f"{pol.lower()}_i"] = vis[..., pol_index].imag
+    for pol_index, pol in enumerate(POLS):
+        columns[f"{pol.lower()}_pow"] = power[..., pol_index]
+    columns["x_phase_deg"] = phase[..., 0]
+    columns["y_phase_deg"] = phase[..., 1]
+
+    return make_table(columns)
+
+
+def make_table(columns: typing.Dict[str, np.ndarray]) -> np.ndarray:
+    """Returns a 1D structured array with a field for each column. The columns are broadcast against each other
+       and flattened, so e.g. a (timestep,1,1) time column and a (timestep,baseline,chan) power column give one
+       row per timestep, baseline and channel."""
+    arrays = np.broadcast_arrays(*[np.asarray(column) for column in columns.values()])
+    table = np.empty(arrays[0].size, dtype=[(name, array.dtype) for name, array in zip(columns, arrays)])
+
+    for name, array in zip(columns, arrays):
+        table[name] = array.reshape(-1)
+
+    return table
+
+
+def _get_csv_format(dtype: np.dtype) -> str:
+    """Returns a format which writes values of dtype without losing precision"""
+    if dtype.kind in "iub":
+        return "%d"
+    if dtype == np.float32:
+        return "%.9g"
+    return "%.17g"
+
+
+def write_table(filename: str, table: np.ndarray):
+    """Writes a table from make_table to filename, as a .npy file if filename ends in .npy, otherwise as CSV
+       with a header of the field names"""
+    if filename.endswith(".npy"):
+        np.save(filename, table)
+    else:
+        np.savetxt(filename, table, delimiter=",", header=", ".join(table.dtype.names), comments="",
+                   fmt=[_get_csv_format(table.dtype[name]) for name in table.dtype.names])
@@ -6,7 +6,8 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
-from .mwalib import CAntennaS, CMetafitsMetadataS
+import numpy as np
+from .mwalib import CMetafitsMetadataS, c_struct_array_to_numpy, decode_c_strings
 from .rfinput import RFInput
 
 
@@ -61,24 +62,78 @@ class Antenna:
                f"Height: {self.height_m} m)"
 
     @staticmethod
-    def get_antennas(metafits_metadata: CMetafitsMetadataS,
-                     rf_inputs: []) -> []:
-        """Retrieve all of the antenna metadata and populate a list of antennas."""
+    def get_antenna_table(metafits_metadata: CMetafitsMetadataS) -> np.ndarray:
+        """Copy all of the antenna metadata in bulk into a numpy structured array with one row per antenna (the
+           fields of CAntennaS, with tile_name decoded)."""
+        c_table = c_struct_array_to_numpy(metafits_metadata.antennas, metafits_metadata.num_ants)
+        tile_names = decode_c_strings(c_table["tile_name"])
+
+        table = np.empty(len(c_table), dtype=[("ant", np.uint32),
+                                              ("tile_id", np.uint32),
+                                              ("tile_name", tile_names.dtype),
+                                              ("rfinput_x", np.uint64),
+                                              ("rfinput_y", np.uint64),
+                                              ("electrical_length_m", np.float64),
+                                              ("north_m", np.float64),
+                                              ("east_m", np.float64),
+                                              ("height_m", np.float64)])
+        for name in table.dtype.names:
+            table[name] = c_table[name]
+        table["tile_name"] = tile_names
+
+        return table
+
+    @staticmethod
+    def add_rf_input_columns(antenna_table: np.ndarray, rf_input_table: np.ndarray) -> np.ndarray:
+        """Returns a copy of the array from get_antenna_table() with the per antenna rf_input columns added from
+           the array returned by RFInput.get_rf_input_table(): flagged (True if either pol is flagged), rec_number,
+           rec_slot_number and, per pol, vcs_order_x/y and subfile_order_x/y."""
+        rf_inputs_x = rf_input_table[antenna_table["rfinput_x"]]
+        rf_inputs_y = rf_input_table[antenna_table["rfinput_y"]]
+
+        rf_input_columns = [("flagged", bool),
+                            ("rec_number", np.uint32),
+                            ("rec_slot_number", np.uint32),
+                            ("vcs_order_x", np.uint32),
+                            ("vcs_order_y", np.uint32),
+                            ("subfile_order_x", np.uint32),
+                            ("subfile_order_y", np.uint32)]
+        table = np.empty(len(antenna_table), dtype=antenna_table.dtype.descr + rf_input_columns)
+        for name in antenna_table.dtype.names:
+            table[name] = antenna_table[name]
+        table["flagged"] = rf_inputs_x["flagged"] | rf_inputs_y["flagged"]
+        table["rec_number"] = rf_inputs_x["rec_number"]
+        table["rec_slot_number"] = rf_inputs_x["rec_slot_number"]
+        for pol, rf_inputs in (("x", rf_inputs_x), ("y", rf_inputs_y)):
+            table[f"vcs_order_{pol}"] = rf_inputs["vcs_order"]
+            table[f"subfile_order_{pol}"] = rf_inputs["subfile_order"]
+
+        return table
+
+    @staticmethod
+    def get_antennas_from_table(antenna_table: np.ndarray, rf_inputs: []) -> []:
+        """Populate a list of antennas from the array returned by get_antenna_table()."""
         antennas = []
 
-        for i in range(0, metafits_metadata.num_ants):
-            obj: CAntennaS = metafits_metadata.antennas[i]
+        for i, obj in enumerate(antenna_table.tolist()):
+            ant, tile_id, tile_name, rfinput_x, rfinput_y, electrical_length_m, north_m, east_m, height_m = obj
 
             # Populate all the fields
             antennas.append(Antenna(i,
-                                    obj.ant,
-                                    obj.tile_id,
-                                    obj.tile_name.decode("utf-8"),
-                                    rf_inputs[obj.rfinput_x],
-                                    rf_inputs[obj.rfinput_y],
-                                    obj.electrical_length_m,
-                                    obj.north_m,
-                                    obj.east_m,
-                                    obj.height_m))
+                                    ant,
+                                    tile_id,
+                                    tile_name,
+                                    rf_inputs[rfinput_x],
+                                    rf_inputs[rfinput_y],
+                                    electrical_length_m,
+                                    north_m,
+                                    east_m,
+                                    height_m))
 
         return antennas
+
+    @staticmethod
+    def get_antennas(metafits_metadata: CMetafitsMetadataS,
+                     rf_inputs: []) -> []:
+        """Retrieve all of the antenna metadata and populate a list of antennas."""
+        return Antenna.get_antennas_from_table(Antenna.get_antenna_table(metafits_metadata), rf_inputs)
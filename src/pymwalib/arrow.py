@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# arrow: export metadata tables and visibilities as Apache Arrow record batches, IPC files or Parquet
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import os
+import typing
+
+import numpy as np
+
+from .errors import PymwalibInvalidArgumentError, PymwalibNoDataForTimestepAndCoarseChannelError
+from .prefetch import Prefetcher
+
+# File formats and the extension of each
+FILE_EXTENSIONS = {"ipc": "arrow", "parquet": "parquet"}
+
+
+def get_pyarrow():
+    """Returns the pyarrow module. pyarrow is optional (pip install pymwalib[arrow]) so is only imported when
+       first needed."""
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("pymwalib.arrow needs pyarrow: pip install pyarrow (or pymwalib[arrow])") from e
+
+    return pyarrow
+
+
+def get_file_format(filename: str, file_format: typing.Optional[str] = None) -> str:
+    """Returns file_format, or if it is None, "parquet" if filename ends in .parquet and "ipc" otherwise"""
+    if file_format is None:
+        file_format = "parquet" if filename.endswith(".parquet") else "ipc"
+    if file_format not in FILE_EXTENSIONS:
+        raise PymwalibInvalidArgumentError(f"file_format must be one of {tuple(FILE_EXTENSIONS)}, not "
+                                           f"{file_format!r}")
+
+    return file_format
+
+
+def _get_array(column: np.ndarray):
+    """Returns an Arrow array of a numpy array. Contiguous numeric arrays are wrapped without a copy; each extra
+       axis (e.g. of a subarray field) becomes a fixed size list."""
+    pa = get_pyarrow()
+
+    if column.dtype.kind in "US":
+        return pa.array(column)
+
+    column = np.ascontiguousarray(column)
+    if column.dtype.byteorder == ">" or (column.dtype.byteorder == "=" and not np.little_endian):
+        column = column.astype(column.dtype.newbyteorder("<"))
+
+    if column.dtype == bool:
+        array = pa.array(column.reshape(-1))
+    else:
+        array = pa.Array.from_buffers(pa.from_numpy_dtype(column.dtype), column.size, [None, pa.py_buffer(column)])
+
+    for axis_len in reversed(column.shape[1:]):
+        array = pa.FixedSizeListArray.from_arrays(array, axis_len)
+
+    return array
+
+
+def table_to_record_batch(table: np.ndarray, index: typing.Optional[np.ndarray] = None):
+    """Returns an Arrow record batch with a column for each field of a numpy structured array (e.g. one of
+       MetafitsMetadata's tables) and, if given, an index column first. Subarray fields (e.g. pols) become fixed
+       size list columns."""
+    pa = get_pyarrow()
+
+    names = list(table.dtype.names)
+    arrays = [_get_array(table[name]) for name in names]
+    if index is not None:
+        names.insert(0, "index")
+        arrays.insert(0, _get_array(np.asarray(index)))
+
+    return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def get_metadata_record_batches(metafits_context) -> dict:
+    """Returns a dict of Arrow record batches of the antennas, rf_inputs, baselines, metafits timesteps and
+       metafits coarse channels (see the MetafitsMetadata tables of the same names)"""
+    return {
+        "antennas": table_to_record_batch(metafits_context.antenna_table),
+        "rf_inputs": table_to_record_batch(metafits_context.rf_input_table),
+        "baselines": table_to_record_batch(metafits_context.baselines.table, metafits_context.baselines.index),
+        "timesteps": table_to_record_batch(metafits_context.metafits_timesteps.table,
+                                           metafits_context.metafits_timesteps.index),
+        "coarse_chans": table_to_record_batch(metafits_context.metafits_coarse_chans.table,
+                                              metafits_context.metafits_coarse_chans.index),
+    }
+
+
+def _open_writer(filename: str, schema, file_format: str):
+    """Returns an Arrow IPC file or Parquet writer"""
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(filename, schema)
+
+    return get_pyarrow().ipc.new_file(filename, schema)
+
+
+def write_record_batches(filename: str, batches: typing.Iterable, file_format: typing.Optional[str] = None):
+    """Writes record batches, which must all have the same schema, to filename as an Arrow IPC file or Parquet
+       (see get_file_format()). Each batch is written as it is iterated. Nothing is written if there are no
+       batches."""
+    file_format = get_file_format(filename, file_format)
+
+    writer = None
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = _open_writer(filename, batch.schema, file_format)
+            writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_metadata(path: str, metafits_context, file_format: str = "ipc"):
+    """Writes each of the record batches from get_metadata_record_batches() to its own file in the directory path,
+       e.g. antennas.arrow (IPC) or antennas.parquet"""
+    file_format = get_file_format(path, file_format)
+    os.makedirs(path, exist_ok=True)
+
+    for name, batch in get_metadata_record_batches(metafits_context).items():
+        write_record_batches(os.path.join(path, f"{name}.{FILE_EXTENSIONS[file_format]}"), [batch], file_format)
+
+
+def get_visibility_record_batch(context, timestep_index: int, coarse_chan_index: int, data: np.ndarray,
+                                baselines=None):
+    """Returns an Arrow record batch of one HDU's data (as read by CorrelatorContext.read_by_baseline()) with a
+       row per baseline: timestep_index, coarse_chan_index, unix_time_ms, baseline, ant1, ant2 and vis, a fixed
+       size list of the (freq,pol,r/i) float32 values of the baseline.
+
+       If baselines (an index array) is None, vis wraps data's buffer without a copy, so data must not be
+       modified (or reused as a read buffer) while the batch is in use; otherwise the selected rows are copied."""
+    pa = get_pyarrow()
+    metafits_context = context.metafits_context
+
+    num_baselines, num_fine_chans, num_pols, _ = context.get_hdu_shape("baseline")
+    data = data.reshape(num_baselines, num_fine_chans * num_pols * 2)
+    if baselines is None:
+        baselines = np.arange(num_baselines)
+    else:
+        baselines = np.asarray(baselines, dtype=np.intp)
+        data = data[baselines]
+
+    num_rows = len(baselines)
+    columns = {
+        "timestep_index": pa.array(np.full(num_rows, timestep_index, dtype=np.uint32)),
+        "coarse_chan_index": pa.array(np.full(num_rows, coarse_chan_index, dtype=np.uint32)),
+        "unix_time_ms": pa.array(np.full(num_rows, context.timesteps.unix_time_ms[timestep_index], dtype=np.uint64)),
+        "baseline": pa.array(baselines.astype(np.uint32)),
+        "ant1": _get_array(metafits_context.baseline_ant1_index[baselines]),
+        "ant2": _get_array(metafits_context.baseline_ant2_index[baselines]),
+        "vis": _get_array(data),
+    }
+
+    return pa.RecordBatch.from_arrays(list(columns.values()), names=list(columns))
+
+
+def write_visibilities(context, filename: str, timestep_indices: typing.Optional[list] = None,
+                       coarse_chan_indices: typing.Optional[list] = None, baselines=None,
+                       file_format: typing.Optional[str] = None, prefetch: int = 2) -> int:
+    """Writes the visibilities of a CorrelatorContext to filename as an Arrow IPC file or Parquet (see
+       get_file_format()), one record batch (see get_visibility_record_batch()) per HDU, and returns the number
+       of batches written.
+
+       timestep_indices and coarse_chan_indices default to the provided timesteps and coarse channels, and
+       baselines (an index array) to all baselines. HDUs with no data are skipped (and if none have data,
+       nothing is written). HDUs are read up to prefetch ahead into recycled buffers (see iter_hdus), and each
+       batch is written, straight from the buffer, before its buffer is reused."""
+    if timestep_indices is None:
+        timestep_indices = context.provided_timestep_indices
+    if coarse_chan_indices is None:
+        coarse_chan_indices = context.provided_coarse_chan_indices
+    items = [(timestep_index, coarse_chan_index)
+             for timestep_index in timestep_indices for coarse_chan_index in coarse_chan_indices]
+
+    def read(item: tuple, buffer: np.ndarray) -> bool:
+        try:
+            context.read_by_baseline(*item, out=buffer)
+        except PymwalibNoDataForTimestepAndCoarseChannelError:
+            return False
+        return True
+
+    num_batches = 0
+
+    def get_batches():
+        nonlocal num_batches
+        for (timestep_index, coarse_chan_index), data in Prefetcher(read, items,
+                                                                    lambda: context._get_hdu_buffer(None), prefetch):
+            yield get_visibility_record_batch(context, timestep_index, coarse_chan_index, data, baselines)
+            num_batches += 1
+
+    write_record_batches(filename, get_batches(), file_format=file_format)
+
+    return num_batches
@@ -6,7 +6,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
-from .mwalib import CBaselineS, CMetafitsMetadataS
+import numpy as np
+from .mwalib import CMetafitsMetadataS, c_struct_array_to_numpy
+from .record_list import RecordList
 
 
 class Baseline:
@@ -25,6 +27,7 @@ class Baseline:
         The index in the antenna array for the second member of the baseline
 
     """
+    __slots__ = ("index", "ant1_index", "ant2_index")
 
     def __init__(self,
                  index: int,
@@ -42,16 +45,47 @@ class Baseline:
                f"Antennas: {self.ant1_index} v {self.ant2_index})"
 
     @staticmethod
-    def get_baselines(metafits_metadata: CMetafitsMetadataS) -> []:
+    def get_baseline_index(ant1_index, ant2_index, num_ants: int):
+        """Returns the index of the baseline between ant1_index and ant2_index (ints or arrays of them) in mwalib's
+           baseline order (the upper triangle, including autos, of num_ants antennas), without searching for it.
+           The antennas may be given in either order."""
+        ant1_index = np.asarray(ant1_index, dtype=np.int64)
+        ant2_index = np.asarray(ant2_index, dtype=np.int64)
+        low = np.minimum(ant1_index, ant2_index)
+        high = np.maximum(ant1_index, ant2_index)
+
+        # Rows 0..low-1 of the triangle hold num_ants + (num_ants - 1) + ... + (num_ants - low + 1) baselines
+        return low * num_ants - low * (low - 1) // 2 + (high - low)
+
+    @staticmethod
+    def get_baseline_table(metafits_metadata: CMetafitsMetadataS) -> np.ndarray:
+        """Copy all of the baseline metadata in bulk into a numpy structured array of ant1_index and
+           ant2_index."""
+        return c_struct_array_to_numpy(metafits_metadata.baselines, metafits_metadata.num_baselines)
+
+    @staticmethod
+    def get_baselines_from_table(baseline_table: np.ndarray) -> 'BaselineList':
+        """Populate a list of baselines from the array returned by get_baseline_table()."""
+        # The return type of this function is in single quotes as it is a forward reference.
+        return BaselineList(baseline_table)
+
+    @staticmethod
+    def get_baselines(metafits_metadata: CMetafitsMetadataS) -> 'BaselineList':
         """Retrieve all of the baseline metadata and populate a list of baselines."""
-        baselines = []
+        return Baseline.get_baselines_from_table(Baseline.get_baseline_table(metafits_metadata))
 
-        for i in range(0, metafits_metadata.num_baselines):
-            obj: CBaselineS = metafits_metadata.baselines[i]
 
-            # Populate all the fields
-            baselines.append(Baseline(i,
-                                      obj.ant1_index,
-                                      obj.ant2_index))
+class BaselineList(RecordList):
+    """
+    A list of Baseline stored as numpy columns. Indexing it returns a Baseline. See RecordList.
+
+    Attributes
+    ----------
+    ant1_index : np.ndarray
+        The index in the antenna array for the first member of each baseline
+
+    ant2_index : np.ndarray
+        The index in the antenna array for the second member of each baseline
 
-        return baselines
+    """
+    _record_class = Baseline
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+#
+# chunked_store: export a correlator observation to a chunked, zlib compressed array store and read it back
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import io
+import json
+import os
+import tempfile
+import typing
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .coarse_channel import CoarseChannelList
+from .errors import PymwalibInvalidArgumentError
+from .metadata_cache import get_cache_filename, load_state, remove_prefix, save_state
+from .metafits_metadata import MetafitsMetadata
+from .timestep import TimeStepList
+
+# Bump this whenever the layout of the store changes
+STORE_FORMAT_VERSION = 1
+
+INDEX_FILENAME = "index.json"
+
+# Key of the (correlator and metafits) metadata in the store, as saved by metadata_cache.save_state()
+METADATA_KEY = "metadata"
+
+CHUNK_DIR = "chunks"
+
+
+def get_chunk_filename(path: str, timestep_chunk: int, coarse_chan_chunk: int, baseline_chunk: int) -> str:
+    """Returns the filename of a chunk, given its position along the timestep, coarse channel and baseline axes"""
+    return os.path.join(path, CHUNK_DIR, f"{timestep_chunk}.{coarse_chan_chunk}.{baseline_chunk}.npy.zlib")
+
+
+def _write_chunk(filename: str, chunk: np.ndarray, compression_level: int):
+    """Writes chunk as a zlib compressed .npy"""
+    npy = io.BytesIO()
+    np.save(npy, np.ascontiguousarray(chunk), allow_pickle=False)
+
+    with open(filename, "wb") as chunk_file:
+        chunk_file.write(zlib.compress(npy.getbuffer(), compression_level))
+
+
+def _read_chunk(filename: str) -> np.ndarray:
+    """Reads a chunk written by _write_chunk()"""
+    with open(filename, "rb") as chunk_file:
+        return np.load(io.BytesIO(zlib.decompress(chunk_file.read())), allow_pickle=False)
+
+
+def write_chunked_store(context, path: str, timestep_indices: typing.Optional[list] = None,
+                        coarse_chan_indices: typing.Optional[list] = None, chunk_timesteps: int = 8,
+                        chunk_baselines: typing.Optional[int] = None, compression_level: int = 6,
+                        max_workers: typing.Optional[int] = None) -> "ChunkedStore":
+    """Writes the visibilities of a CorrelatorContext to a chunked store in the directory path, and returns the
+       store opened for reading.
+
+       The store holds one float32 (timestep,coarse_chan,baseline,freq,pol,r/i) array, split into chunks of
+       chunk_timesteps timesteps, one coarse channel and chunk_baselines baselines (default all), each saved as a
+       zlib compressed .npy file. An index.json describes the array, its chunks and which HDUs had no data (those
+       are zero), and the context's correlator and metafits metadata is saved alongside so the store can be
+       opened and used without the gpubox files (or mwalib).
+
+       timestep_indices (default: every timestep from the first to the last provided timestep) and
+       coarse_chan_indices (default: the provided coarse channels) select what is stored. Each task reads and
+       writes chunk_timesteps HDUs of one coarse channel; tasks run on max_workers threads (default is the number
+       of cpus), since both the mwalib reads and zlib release the GIL."""
+    if timestep_indices is None:
+        timestep_indices = list(range(context.provided_timestep_indices[0], context.provided_timestep_indices[-1] + 1))
+    if coarse_chan_indices is None:
+        coarse_chan_indices = context.provided_coarse_chan_indices
+    timestep_indices = [int(timestep_index) for timestep_index in timestep_indices]
+    coarse_chan_indices = [int(coarse_chan_index) for coarse_chan_index in coarse_chan_indices]
+
+    hdu_shape = context.get_hdu_shape("baseline")
+    if chunk_baselines is None:
+        chunk_baselines = hdu_shape[0]
+    if chunk_timesteps < 1 or chunk_baselines < 1:
+        raise PymwalibInvalidArgumentError(f"chunk_timesteps and chunk_baselines must be at least 1, not "
+                                           f"{chunk_timesteps} and {chunk_baselines}")
+
+    os.makedirs(os.path.join(path, CHUNK_DIR), exist_ok=True)
+    save_state(path, METADATA_KEY, *context._get_state())
+
+    def write_task(timestep_chunk: int, coarse_chan_chunk: int) -> np.ndarray:
+        start = timestep_chunk * chunk_timesteps
+        cube, missing = context.read_cube(timestep_indices[start:start + chunk_timesteps],
+                                          [coarse_chan_indices[coarse_chan_chunk]])
+
+        for baseline_chunk, baseline_start in enumerate(range(0, hdu_shape[0], chunk_baselines)):
+            _write_chunk(get_chunk_filename(path, timestep_chunk, coarse_chan_chunk, baseline_chunk),
+                         cube[:, :, baseline_start:baseline_start + chunk_baselines], compression_level)
+
+        return missing[:, 0]
+
+    num_timestep_chunks = -(-len(timestep_indices) // chunk_timesteps)
+    timestep_chunks = [timestep_chunk
+                       for _ in coarse_chan_indices for timestep_chunk in range(num_timestep_chunks)]
+    coarse_chan_chunks = [coarse_chan_chunk
+                          for coarse_chan_chunk in range(len(coarse_chan_indices)) for _ in range(num_timestep_chunks)]
+
+    missing = np.zeros((len(timestep_indices), len(coarse_chan_indices)), dtype=bool)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pymwalib_store") as executor:
+        for timestep_chunk, coarse_chan_chunk, task_missing in zip(
+                timestep_chunks, coarse_chan_chunks, executor.map(write_task, timestep_chunks, coarse_chan_chunks)):
+            start = timestep_chunk * chunk_timesteps
+            missing[start:start + chunk_timesteps, coarse_chan_chunk] = task_missing
+
+    index = {
+        "format_version": STORE_FORMAT_VERSION,
+        "dtype": "float32",
+        "shape": [len(timestep_indices), len(coarse_chan_indices)] + list(hdu_shape),
+        "chunks": [chunk_timesteps, 1, chunk_baselines],
+        "compression": "zlib",
+        "compression_level": compression_level,
+        "timestep_indices": timestep_indices,
+        "coarse_chan_indices": coarse_chan_indices,
+        "missing": missing.tolist(),
+    }
+
+    # The index is written last, and atomically, so a store is only ever opened once it is complete
+    fd, temp_filename = tempfile.mkstemp(dir=path, suffix=".tmp")
+    with os.fdopen(fd, "w") as index_file:
+        json.dump(index, index_file)
+    os.replace(temp_filename, os.path.join(path, INDEX_FILENAME))
+
+    return ChunkedStore(path)
+
+
+class ChunkedStore:
+    """
+    A chunked store written by write_chunked_store(), opened for reading. Only the chunks covering what is read
+    are decompressed.
+
+    Attributes
+    ----------
+    path : str
+        The store's directory
+
+    dtype : np.dtype
+        Type of the stored array
+
+    shape : tuple
+        Shape of the stored (timestep,coarse_chan,baseline,freq,pol,r/i) array
+
+    chunks : tuple
+        Number of timesteps, coarse channels and baselines in each chunk
+
+    timestep_indices : list
+        The context timestep index of each stored timestep
+
+    coarse_chan_indices : list
+        The context coarse channel index of each stored coarse channel
+
+    missing : np.ndarray
+        (timestep,coarse_chan) boolean array which is True where there was no data (stored as zeros)
+
+    metadata : dict
+        The correlator context's scalar metadata (e.g. mwa_version, num_timesteps)
+
+    metafits_context : MetafitsMetadata
+        The metafits metadata of the observation
+
+    timesteps : TimeStepList
+        Every timestep of the correlator context (index with timestep_indices for the stored ones)
+
+    coarse_channels : CoarseChannelList
+        Every coarse channel of the correlator context (index with coarse_chan_indices for the stored ones)
+
+    """
+
+    def __init__(self, path: str):
+        """Open the store in the directory path"""
+        with open(os.path.join(path, INDEX_FILENAME)) as index_file:
+            index = json.load(index_file)
+
+        if index["format_version"] != STORE_FORMAT_VERSION:
+            raise PymwalibInvalidArgumentError(f"{path} is a version {index['format_version']} store, but this "
+                                               f"version of pymwalib reads version {STORE_FORMAT_VERSION}")
+
+        self.path: str = path
+        self.dtype: np.dtype = np.dtype(index["dtype"])
+        self.shape: tuple = tuple(index["shape"])
+        self.chunks: tuple = tuple(index["chunks"])
+        self.timestep_indices: list = index["timestep_indices"]
+        self.coarse_chan_indices: list = index["coarse_chan_indices"]
+        self.missing: np.ndarray = np.array(index["missing"], dtype=bool).reshape(self.shape[:2])
+
+        state = load_state(path, METADATA_KEY)
+        if state is None:
+            raise PymwalibInvalidArgumentError(f"{get_cache_filename(path, METADATA_KEY)} is missing or not "
+                                               f"readable, so {path} is not a complete store")
+        scalars, arrays = state
+        self.metadata: dict = dict(scalars)
+        self.metafits_context: MetafitsMetadata = MetafitsMetadata._from_state(
+            self.metadata.pop("metafits_context"), remove_prefix("metafits_context", arrays))
+        self.timesteps: TimeStepList = TimeStepList(arrays["timesteps"])
+        self.coarse_channels: CoarseChannelList = CoarseChannelList(arrays["coarse_channels"])
+
+    def read_chunk(self, timestep_chunk: int, coarse_chan_chunk: int, baseline_chunk: int) -> np.ndarray:
+        """Returns one chunk, given its position along the timestep, coarse channel and baseline axes"""
+        return _read_chunk(get_chunk_filename(self.path, timestep_chunk, coarse_chan_chunk, baseline_chunk))
+
+    @staticmethod
+    def _get_positions(selection, axis_len: int) -> np.ndarray:
+        """Returns the positions along an axis selected by None (all), an int, a slice or a sequence of ints"""
+        if selection is None:
+            return np.arange(axis_len)
+        if isinstance(selection, slice):
+            return np.arange(axis_len)[selection]
+
+        positions = np.atleast_1d(np.asarray(selection, dtype=np.intp))
+        if positions.ndim != 1 or ((positions < 0) | (positions >= axis_len)).any():
+            raise PymwalibInvalidArgumentError(f"Selection {selection!r} is not within 0 to {axis_len - 1}")
+
+        return positions
+
+    def read(self, timesteps=None, coarse_chans=None, baselines=None) -> np.ndarray:
+        """Returns a (timestep,coarse_chan,baseline,freq,pol,r/i) array of the selected stored timesteps, coarse
+           channels and baselines. Each is selected by position in the store (not context index) with None (all),
+           an int, a slice or a sequence of ints; every axis is kept. Only the chunks needed are read."""
+        positions = [self._get_positions(selection, axis_len)
+                     for selection, axis_len in zip((timesteps, coarse_chans, baselines), self.shape[:3])]
+        out = np.empty(tuple(len(axis_positions) for axis_positions in positions) + self.shape[3:], dtype=self.dtype)
+        chunk_numbers = [axis_positions // chunk_len for axis_positions, chunk_len in zip(positions, self.chunks)]
+
+        for timestep_chunk in np.unique(chunk_numbers[0]):
+            for coarse_chan_chunk in np.unique(chunk_numbers[1]):
+                for baseline_chunk in np.unique(chunk_numbers[2]):
+                    chunk = self.read_chunk(timestep_chunk, coarse_chan_chunk, baseline_chunk)
+
+                    # Where the selected positions in this chunk go in out, and where they are in the chunk
+                    out_index = []
+                    chunk_index = []
+                    for axis_positions, axis_chunks, chunk_number, chunk_len in zip(
+                            positions, chunk_numbers, (timestep_chunk, coarse_chan_chunk, baseline_chunk), self.chunks):
+                        in_chunk = np.flatnonzero(axis_chunks == chunk_number)
+                        out_index.append(in_chunk)
+                        chunk_index.append(axis_positions[in_chunk] - chunk_number * chunk_len)
+
+                    out[np.ix_(*out_index)] = chunk[np.ix_(*chunk_index)]
+
+        return out
+
+    def __repr__(self):
+        """Returns a representation of the class"""
+        return f"{self.__class__.__name__}(" \
+               f"Path: {self.path}, " \
+               f"Shape: {self.shape}, " \
+               f"Chunks: {self.chunks})"
@@ -6,7 +6,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
-from .mwalib import CCoarseChannelS, CMetafitsMetadataS
+import numpy as np
+from .mwalib import CMetafitsMetadataS, c_struct_array_to_numpy
+from .record_list import RecordList
 
 
 class CoarseChannel:
@@ -21,6 +23,8 @@ class CoarseChannel:
     Please see https://github.com/MWATelescope/mwalib/blob/master/src/coarse_channel.rs for remaining attributes
 
     """
+    __slots__ = ("index", "corr_chan_number", "rec_chan_number", "gpubox_number", "chan_width_hz", "chan_start_hz",
+                 "chan_centre_hz", "chan_end_hz")
 
     def __init__(self,
                  index: int,
@@ -54,41 +58,31 @@ class CoarseChannel:
                f"Channel end MHz: {float(self.chan_end_hz) / 1000000.})"
 
     @staticmethod
-    def get_metafits_coarse_channels(metafits_metadata: CMetafitsMetadataS) -> []:
-        """Retrieve all of the coarse_channel metadata and populate a list of coarse_channels."""
-        coarse_channels = []
-
-        for i in range(0, metafits_metadata.num_metafits_coarse_chans):
-            obj: CCoarseChannelS = metafits_metadata.metafits_coarse_chans[i]
+    def get_coarse_channels_from_table(coarse_channel_table: np.ndarray) -> 'CoarseChannelList':
+        """Populate a list of coarse_channels from a numpy structured array of the fields of CCoarseChannelS."""
+        # The return type of this function is in single quotes as it is a forward reference.
+        return CoarseChannelList(coarse_channel_table)
 
-            # Populate all the fields
-            coarse_channels.append(CoarseChannel(i,
-                                                 obj.corr_chan_number,
-                                                 obj.rec_chan_number,
-                                                 obj.gpubox_number,
-                                                 obj.chan_width_hz,
-                                                 obj.chan_start_hz,
-                                                 obj.chan_centre_hz,
-                                                 obj.chan_end_hz, ))
-
-        return coarse_channels
+    @staticmethod
+    def get_metafits_coarse_channels(metafits_metadata: CMetafitsMetadataS) -> 'CoarseChannelList':
+        """Retrieve all of the coarse_channel metadata and populate a list of coarse_channels."""
+        return CoarseChannel.get_coarse_channels_from_table(
+            c_struct_array_to_numpy(metafits_metadata.metafits_coarse_chans,
+                                    metafits_metadata.num_metafits_coarse_chans))
 
     @staticmethod
-    def get_correlator_or_voltage_coarse_channels(correlator_or_voltage_metadata) -> []:
+    def get_correlator_or_voltage_coarse_channels(correlator_or_voltage_metadata) -> 'CoarseChannelList':
         """Retrieve all of the coarse_channel metadata and populate a list of coarse_channels."""
-        coarse_channels = []
+        return CoarseChannel.get_coarse_channels_from_table(
+            c_struct_array_to_numpy(correlator_or_voltage_metadata.coarse_chans,
+                                    correlator_or_voltage_metadata.num_coarse_chans))
 
-        for i in range(0, correlator_or_voltage_metadata.num_coarse_chans):
-            obj: CCoarseChannelS = correlator_or_voltage_metadata.coarse_chans[i]
 
-            # Populate all the fields
-            coarse_channels.append(CoarseChannel(i,
-                                                 obj.corr_chan_number,
-                                                 obj.rec_chan_number,
-                                                 obj.gpubox_number,
-                                                 obj.chan_width_hz,
-                                                 obj.chan_start_hz,
-                                                 obj.chan_centre_hz,
-                                                 obj.chan_end_hz, ))
+class CoarseChannelList(RecordList):
+    """
+    A list of CoarseChannel stored as numpy columns (corr_chan_number, rec_chan_number, gpubox_number,
+    chan_width_hz, chan_start_hz, chan_centre_hz and chan_end_hz). Indexing it returns a CoarseChannel. See
+    RecordList.
 
-        return coarse_channels
+    """
+    _record_class = CoarseChannel
@@ -7,41 +7,96 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 import ctypes
+import threading
+import typing
 
-import numpy.ctypeslib as npct
 import ctypes as ct
+import numpy as np
 from .mwalib import CCorrelatorContextS, CCorrelatorMetadataS, mwalib_library, create_string_buffer, MWALIB_SUCCESS, \
     MWALIB_NO_DATA_FOR_TIMESTEP_COARSECHAN
-from .coarse_channel import CoarseChannel
+from .coarse_channel import CoarseChannel, CoarseChannelList
 from .common import ERROR_MESSAGE_LEN, MWAVersion
 from .errors import PymwalibCorrelatorContextNewError, PymwalibCorrelatorContextDisplayError, \
     PymwalibNoDataForTimestepAndCoarseChannelError, PymwalibCorrelatorContextReadByBaselineError, \
     PymwalibCorrelatorContextReadByFrequencyError, PymwalibCorrelatorMetadataGetError, \
-    PymwalibCorrelatorContextGetFineChanFreqsArrayError
+    PymwalibCorrelatorContextGetFineChanFreqsArrayError, PymwalibOutputBufferError, \
+    PymwalibInvalidArgumentError
+from .gpubox_mmap import MWAXGpuboxReader
+from .hdu_cache import HDUCache
+from .metadata_cache import add_prefix, get_cache_key, get_scalar_state, load_state, remove_prefix, save_state
 from .metafits_metadata import MetafitsMetadata
-from .timestep import TimeStep
+from .mmap_metadata import get_correlator_state, get_fine_chan_freqs_hz
+from .parallel_reader import ParallelReader
+from .prefetch import Prefetcher
+from .timestep import TimeStep, TimeStepList
 from .version import check_mwalib_version
 
 
 class CorrelatorContext:
-    """Main class to interface with mwalib correlator observations"""
+    """Main class to interface with mwalib correlator observations
 
-    def __init__(self, metafits_filename: str, gpubox_filenames: list):
-        """Take metafits and gpubox files, and populate this class via mwalib"""
-        #
-        # Ensure we have a compatible version of mwalib
-        #
-        check_mwalib_version()
+       The read methods may be called concurrently from multiple threads (see ParallelReader)."""
+
+    def __init__(self, metafits_filename: str, gpubox_filenames: list, cache_dir: typing.Optional[str] = None,
+                 backend: str = "mwalib", hdu_cache_bytes: typing.Optional[int] = None):
+        """Take metafits and gpubox files, and populate this class via mwalib. If cache_dir is given, the
+           metadata is read from (or on a miss, written to) the metadata cache there (see metadata_cache);
+           on a hit the mwalib context is not created until mwalib is first needed, e.g. by a read.
+
+           backend is "mwalib" to read data through mwalib, or "mmap" (MWAX only) to memory map the gpubox files
+           and read them with pymwalib's own reader (see gpubox_mmap), which get_hdu_view() needs. The "mmap"
+           backend does not use mwalib at all: the metadata comes from the metafits and gpubox headers (see
+           mmap_metadata), so it works where libmwalib is not installed. display() needs mwalib.
+
+           If hdu_cache_bytes is given, up to that many bytes of HDUs read by read_by_baseline/read_by_frequency
+           are kept in an LRU cache (see hdu_cache), so reading an HDU again does not read the gpubox files."""
+        if backend not in ("mwalib", "mmap"):
+            raise PymwalibInvalidArgumentError(f"backend must be \"mwalib\" or \"mmap\", not {backend!r}")
 
-        error_message: bytes = create_string_buffer(ERROR_MESSAGE_LEN)
         self._correlator_context_object = ct.POINTER(CCorrelatorContextS)()
+        self._correlator_context_args = (metafits_filename, gpubox_filenames)
+        self._correlator_context_lock = threading.Lock()
+        self._fine_chan_freqs_hz_cache: typing.Dict[tuple, np.ndarray] = {}
+        self.backend: str = backend
+        self._gpubox_reader: typing.Optional[MWAXGpuboxReader] = None
+        self._hdu_cache: typing.Optional[HDUCache] = None if hdu_cache_bytes is None else HDUCache(hdu_cache_bytes)
+
+        if backend == "mmap":
+            # Raises if the files are not MWAX gpubox files
+            self._gpubox_reader = MWAXGpuboxReader(gpubox_filenames)
+
+            def get_metadata():
+                self._set_state(*get_correlator_state(metafits_filename, self._gpubox_reader))
+        else:
+            #
+            # Ensure we have a compatible version of mwalib
+            #
+            check_mwalib_version()
+
+            # The context object is created by _get_correlator_metadata() on a metadata cache miss, and otherwise
+            # only when mwalib is first needed (see _get_correlator_context_object())
+            get_metadata = self._get_correlator_metadata
+
+        # Get the correlator and metafits metadata, from the cache if we can
+        if cache_dir is not None:
+            cache_key = get_cache_key("correlator" if backend == "mwalib" else f"correlator:{backend}",
+                                      metafits_filename, gpubox_filenames, uses_mwalib=backend == "mwalib")
+            state = load_state(cache_dir, cache_key)
+            if state is not None:
+                self._set_state(*state)
+            else:
+                get_metadata()
+                save_state(cache_dir, cache_key, *self._get_state())
+        else:
+            get_metadata()
 
-        # First populate the context object
-        self._get_correlator_context(metafits_filename, gpubox_filenames)
+    def _get_correlator_metadata(self):
+        """Retrieve the correlator metadata (and its metafits metadata) from mwalib and populate this class"""
+        error_message: bytes = create_string_buffer(ERROR_MESSAGE_LEN)
 
         # Get correlator metadata
         c_object_ptr = ct.POINTER(CCorrelatorMetadataS)()
-        if mwalib_library.mwalib_correlator_metadata_get(self._correlator_context_object,
+        if mwalib_library.mwalib_correlator_metadata_get(self._get_correlator_context_object(),
                                                          ct.byref(c_object_ptr),
                                                          error_message,
                                                          ERROR_MESSAGE_LEN) != 0:
@@ -115,14 +170,39 @@ class CorrelatorContext:
         self.metafits_context: MetafitsMetadata = MetafitsMetadata(None, self._correlator_context_object, None)
 
         # Populate coarse channels
-        self.coarse_channels = CoarseChannel.get_correlator_or_voltage_coarse_channels(c_object_ptr.contents)
+        self.coarse_channels: CoarseChannelList = \
+            CoarseChannel.get_correlator_or_voltage_coarse_channels(c_object_ptr.contents)
 
         # Populate timesteps
-        self.timesteps = TimeStep.get_correlator_or_voltage_timesteps(c_object_ptr.contents)
+        self.timesteps: TimeStepList = TimeStep.get_correlator_or_voltage_timesteps(c_object_ptr.contents)
 
         # We're now finished with the C memory, so free it
         mwalib_library.mwalib_correlator_metadata_free(c_object)
 
+    def _get_state(self) -> typing.Tuple[dict, typing.Dict[str, np.ndarray]]:
+        """Returns the fields of this class as a dict of json serialisable scalars and a dict of numpy arrays (see
+           metadata_cache)"""
+        scalars = get_scalar_state(self)
+        scalars["mwa_version"] = self.mwa_version.value
+        scalars["metafits_context"], metafits_arrays = self.metafits_context._get_state()
+
+        arrays = add_prefix("metafits_context", metafits_arrays)
+        arrays["coarse_channels"] = self.coarse_channels.table
+        arrays["timesteps"] = self.timesteps.table
+
+        return scalars, arrays
+
+    def _set_state(self, scalars: dict, arrays: typing.Dict[str, np.ndarray]):
+        """Populate this class from the output of _get_state(), instead of via mwalib"""
+        scalars = dict(scalars)
+        metafits_scalars = scalars.pop("metafits_context")
+        self.__dict__.update(scalars)
+        self.mwa_version = MWAVersion(scalars["mwa_version"])
+        self.metafits_context = MetafitsMetadata._from_state(metafits_scalars,
+                                                             remove_prefix("metafits_context", arrays))
+        self.coarse_channels = CoarseChannelList(arrays["coarse_channels"])
+        self.timesteps = TimeStepList(arrays["timesteps"])
+
     def __enter__(self):
         return self
 
@@ -131,6 +211,17 @@ class CorrelatorContext:
         if self._correlator_context_object:
             mwalib_library.mwalib_correlator_context_free(self._correlator_context_object)
 
+    def _get_correlator_context_object(self):
+        """Returns the mwalib correlator context, creating it on first use. A context populated from the metadata cache
+           does not create it (reading and validating the metafits and data files again) until mwalib is needed,
+           e.g. by a read through mwalib."""
+        if not self._correlator_context_object:
+            with self._correlator_context_lock:
+                if not self._correlator_context_object:
+                    self._get_correlator_context(*self._correlator_context_args)
+
+        return self._correlator_context_object
+
     def _get_correlator_context(self, metafits_filename: str, gpubox_filenames: list):
         """This method will read and validate the metafits and gpubox files. If all has worked, then
         the context object can be used in subsequent calls to populate aspects of this class."""
@@ -154,61 +245,104 @@ class CorrelatorContext:
         else:
             raise PymwalibCorrelatorContextNewError("Error creating correlator context object: mwalib is not loaded.")
 
-    def get_fine_chan_freqs_hz_array(self, corr_coarse_chan_indices) -> list:
-        """Populates a list of fine channel centre frequencies based on the input list of coarse channel
-           indices"""
+    def get_fine_chan_freqs_hz_array(self, corr_coarse_chan_indices) -> np.ndarray:
+        """Returns a read-only float64 array of the fine channel centre frequencies of the input list of coarse
+           channel indices. The result is memoized per tuple of indices, so repeated calls do not call mwalib."""
+        key = tuple(int(index) for index in corr_coarse_chan_indices)
+
+        out_frequencies = self._fine_chan_freqs_hz_cache.get(key)
+        if out_frequencies is not None:
+            return out_frequencies
+
+        if self.backend == "mmap":
+            out_frequencies = get_fine_chan_freqs_hz(self.coarse_channels.table[list(key)],
+                                                     self.metafits_context.num_corr_fine_chans_per_coarse,
+                                                     self.metafits_context.corr_fine_chan_width_hz)
+            out_frequencies.flags.writeable = False
+            self._fine_chan_freqs_hz_cache[key] = out_frequencies
+            return out_frequencies
+
         error_message = create_string_buffer(ERROR_MESSAGE_LEN)
 
-        corr_coarse_chan_indices_type = ctypes.c_ulong * len(corr_coarse_chan_indices)
-        corr_coarse_chan_indices_array = corr_coarse_chan_indices_type(*corr_coarse_chan_indices)
+        corr_coarse_chan_indices_array = np.array(key, dtype=np.uintp)
+        out_frequencies = np.empty(len(key) * self.metafits_context.num_corr_fine_chans_per_coarse, dtype=np.float64)
 
-        out_frequencies_len = len(corr_coarse_chan_indices) * self.metafits_context.num_corr_fine_chans_per_coarse
-        out_frequencies_type = ct.c_double * out_frequencies_len
-        out_frequencies = out_frequencies_type()
+        corr_coarse_chan_indices_ptr = corr_coarse_chan_indices_array.ctypes.data_as(ct.POINTER(ct.c_size_t))
+        out_frequencies_ptr = out_frequencies.ctypes.data_as(ct.POINTER(ct.c_double))
 
-        if mwalib_library.mwalib_correlator_context_get_fine_chan_freqs_hz_array(self._correlator_context_object,
-                                                                                 corr_coarse_chan_indices_array,
-                                                                                 len(corr_coarse_chan_indices),
-                                                                                 out_frequencies,
-                                                                                 out_frequencies_len,
+        if mwalib_library.mwalib_correlator_context_get_fine_chan_freqs_hz_array(self._get_correlator_context_object(),
+                                                                                 corr_coarse_chan_indices_ptr,
+                                                                                 len(key),
+                                                                                 out_frequencies_ptr,
+                                                                                 out_frequencies.size,
                                                                                  error_message,
                                                                                  ERROR_MESSAGE_LEN) != 0:
             raise PymwalibCorrelatorContextGetFineChanFreqsArrayError(
                 f"Error calling mwalib_correlator_get_fine_chan_freqs_hz_array(): "
                 f"{error_message.decode('utf-8').rstrip()}")
-        out_frequencies_list = []
 
-        for i in range(0, out_frequencies_len):
-            out_frequencies_list.append(out_frequencies[i])
+        out_frequencies.flags.writeable = False
+        self._fine_chan_freqs_hz_cache[key] = out_frequencies
 
-        return out_frequencies_list
+        return out_frequencies
 
     def display(self):
         """Displays a human readable summary of the correlator context"""
         error_message = create_string_buffer(ERROR_MESSAGE_LEN)
 
-        if mwalib_library.mwalib_correlator_context_display(self._correlator_context_object,
+        if mwalib_library.mwalib_correlator_context_display(self._get_correlator_context_object(),
                                                             error_message,
                                                             ERROR_MESSAGE_LEN) != 0:
             raise PymwalibCorrelatorContextDisplayError(f"Error calling mwalib_correlator_context_display(): "
                                                         f"{error_message.decode('utf-8').rstrip()}")
 
-    def read_by_baseline(self, timestep_index: int, coarse_chan_index: int):
-        """Retrieve one HDU (ordered baseline,freq,pol,r,i) as a numpy array."""
+    def _get_hdu_buffer(self, out) -> np.ndarray:
+        """Returns out if it can be handed to mwalib as an HDU buffer, otherwise a new HDU sized buffer if out is
+           None"""
+        if out is None:
+            return np.empty(self.num_timestep_coarse_chan_floats, dtype=np.float32)
+
+        if not isinstance(out, np.ndarray) or out.dtype != np.float32 or \
+                out.size != self.num_timestep_coarse_chan_floats or \
+                not out.flags.c_contiguous or not out.flags.writeable:
+            raise PymwalibOutputBufferError(f"out must be a writeable, C contiguous float32 array of "
+                                            f"{self.num_timestep_coarse_chan_floats} elements")
+        return out
+
+    def read_by_baseline(self, timestep_index: int, coarse_chan_index: int, out=None):
+        """Retrieve one HDU (ordered baseline,freq,pol,r,i) as a numpy array.
+
+           If out is provided (a float32 numpy array or np.memmap of num_timestep_coarse_chan_floats elements),
+           the data is written into it and out is returned, so one buffer can be reused for many reads.
+
+           With the HDU cache (see hdu_cache_bytes) and no out, the array returned is the cached, read-only,
+           array."""
+        if self._hdu_cache is not None:
+            return self._hdu_cache.read(("baseline", int(timestep_index), int(coarse_chan_index)),
+                                        lambda buffer: self._read_by_baseline(timestep_index, coarse_chan_index, buffer),
+                                        None if out is None else self._get_hdu_buffer(out))
+
+        return self._read_by_baseline(timestep_index, coarse_chan_index, out)
+
+    def _read_by_baseline(self, timestep_index: int, coarse_chan_index: int, out=None):
+        """read_by_baseline, without the HDU cache"""
         error_message = " ".encode("utf-8") * ERROR_MESSAGE_LEN
 
-        float_buffer_type = ct.c_float * self.num_timestep_coarse_chan_floats
-        buffer = float_buffer_type()
+        if self._gpubox_reader is not None:
+            return self._read_from_hdu_view(timestep_index, coarse_chan_index, "baseline", out)
+
+        buffer = self._get_hdu_buffer(out)
 
-        ret_val = mwalib_library.mwalib_correlator_context_read_by_baseline(self._correlator_context_object,
+        ret_val = mwalib_library.mwalib_correlator_context_read_by_baseline(self._get_correlator_context_object(),
                                                                             ct.c_size_t(timestep_index),
                                                                             ct.c_size_t(coarse_chan_index),
-                                                                            buffer,
+                                                                            buffer.ctypes.data_as(
+                                                                                ct.POINTER(ct.c_float)),
                                                                             self.num_timestep_coarse_chan_floats,
                                                                             error_message, ERROR_MESSAGE_LEN)
 
         if ret_val == MWALIB_SUCCESS:
-            return npct.as_array(buffer, shape=(self.num_timestep_coarse_chan_floats,))
+            return buffer
         elif ret_val == MWALIB_NO_DATA_FOR_TIMESTEP_COARSECHAN:
             raise PymwalibNoDataForTimestepAndCoarseChannelError(
                 f"No data exists for this timestep {timestep_index} and coarse channel {coarse_chan_index}")
@@ -216,21 +350,39 @@ class CorrelatorContext:
             raise PymwalibCorrelatorContextReadByBaselineError(f"Error reading data: "
                                                                f"{error_message.decode('utf-8').rstrip()}")
 
-    def read_by_frequency(self, timestep_index: int, coarse_chan_index: int):
-        """Retrieve one HDU (ordered freq,baseline,pol,r,i) as a numpy array."""
+    def read_by_frequency(self, timestep_index: int, coarse_chan_index: int, out=None):
+        """Retrieve one HDU (ordered freq,baseline,pol,r,i) as a numpy array.
+
+           If out is provided (a float32 numpy array or np.memmap of num_timestep_coarse_chan_floats elements),
+           the data is written into it and out is returned, so one buffer can be reused for many reads.
+
+           With the HDU cache (see hdu_cache_bytes) and no out, the array returned is the cached, read-only,
+           array."""
+        if self._hdu_cache is not None:
+            return self._hdu_cache.read(("frequency", int(timestep_index), int(coarse_chan_index)),
+                                        lambda buffer: self._read_by_frequency(timestep_index, coarse_chan_index, buffer),
+                                        None if out is None else self._get_hdu_buffer(out))
+
+        return self._read_by_frequency(timestep_index, coarse_chan_index, out)
+
+    def _read_by_frequency(self, timestep_index: int, coarse_chan_index: int, out=None):
+        """read_by_frequency, without the HDU cache"""
         error_message = " ".encode("utf-8") * ERROR_MESSAGE_LEN
 
-        float_buffer_type = ct.c_float * self.num_timestep_coarse_chan_floats
-        buffer = float_buffer_type()
+        if self._gpubox_reader is not None:
+            return self._read_from_hdu_view(timestep_index, coarse_chan_index, "frequency", out)
+
+        buffer = self._get_hdu_buffer(out)
 
-        ret_val = mwalib_library.mwalib_correlator_context_read_by_frequency(self._correlator_context_object,
+        ret_val = mwalib_library.mwalib_correlator_context_read_by_frequency(self._get_correlator_context_object(),
                                                                              ct.c_size_t(timestep_index),
                                                                              ct.c_size_t(coarse_chan_index),
-                                                                             buffer,
+                                                                             buffer.ctypes.data_as(
+                                                                                 ct.POINTER(ct.c_float)),
                                                                              self.num_timestep_coarse_chan_floats,
                                                                              error_message, ERROR_MESSAGE_LEN)
         if ret_val == MWALIB_SUCCESS:
-            return npct.as_array(buffer, shape=(self.num_timestep_coarse_chan_floats,))
+            return buffer
         elif ret_val == MWALIB_NO_DATA_FOR_TIMESTEP_COARSECHAN:
             raise PymwalibNoDataForTimestepAndCoarseChannelError(
                 f"No data exists for this timestep {timestep_index} and coarse channel {coarse_chan_index}")
@@ -238,6 +390,285 @@ class CorrelatorContext:
             raise PymwalibCorrelatorContextReadByFrequencyError(f"Error reading data: "
                                                                 f"{error_message.decode('utf-8').rstrip()}")
 
+    @property
+    def hdu_cache(self) -> typing.Optional[HDUCache]:
+        """The HDU cache (with its hit, miss and eviction counters), or None if hdu_cache_bytes was not given"""
+        return self._hdu_cache
+
+    def get_hdu_shape(self, order: str = "baseline") -> tuple:
+        """Returns the shape of one HDU: (baseline,freq,pol,r/i) if order is "baseline" or (freq,baseline,pol,r/i)
+           if order is "frequency"."""
+        num_baselines = self.metafits_context.num_baselines
+        num_fine_chans = self.metafits_context.num_corr_fine_chans_per_coarse
+        num_pols = self.metafits_context.num_visibility_pols
+
+        if order == "baseline":
+            return num_baselines, num_fine_chans, num_pols, 2
+        elif order == "frequency":
+            return num_fine_chans, num_baselines, num_pols, 2
+        else:
+            raise PymwalibInvalidArgumentError(f"order must be \"baseline\" or \"frequency\", not {order!r}")
+
+    def get_hdu_view(self, timestep_index: int, coarse_chan_index: int) -> np.ndarray:
+        """Returns a read-only (baseline,freq,pol,r/i) view of one HDU's visibilities in the memory mapped gpubox
+           file, without copying them. These are the raw big endian int32 values: read_by_baseline() returns them
+           converted to float32. Needs the "mmap" backend."""
+        if self._gpubox_reader is None:
+            raise PymwalibInvalidArgumentError("get_hdu_view() needs a CorrelatorContext created with "
+                                               "backend=\"mmap\"")
+
+        data = self._gpubox_reader.get_visibilities(int(self.timesteps.unix_time_ms[timestep_index]),
+                                                    int(self.coarse_channels.rec_chan_number[coarse_chan_index]))
+        if data is None:
+            raise PymwalibNoDataForTimestepAndCoarseChannelError(
+                f"No data exists for this timestep {timestep_index} and coarse channel {coarse_chan_index}")
+
+        return data.reshape(self.get_hdu_shape("baseline"))
+
+    def _read_from_hdu_view(self, timestep_index: int, coarse_chan_index: int, order: str, out) -> np.ndarray:
+        """read_by_baseline/read_by_frequency for the "mmap" backend: converts the HDU view to float32 in one pass,
+           so (unlike get_hdu_view()) this is a copy"""
+        data = self.get_hdu_view(timestep_index, coarse_chan_index)
+        buffer = self._get_hdu_buffer(out)
+
+        if order == "baseline":
+            np.copyto(buffer.reshape(data.shape), data, casting="unsafe")
+        else:
+            np.copyto(buffer.reshape(self.get_hdu_shape(order)), data.transpose(1, 0, 2, 3), casting="unsafe")
+
+        return buffer
+
+    def get_complex_view(self, data: np.ndarray, order: str = "baseline") -> np.ndarray:
+        """Returns a complex64 view (no copy) of the visibilities in data, shaped (baseline,freq,pol) if order is
+           "baseline" or (freq,baseline,pol) if order is "frequency". data is either one HDU as returned by
+           read_by_baseline/read_by_frequency or a cube from read_cube, in which case the leading
+           (timestep,coarse_chan) axes are kept. data must be a C contiguous float32 ndarray (or np.memmap), not
+           e.g. the int32 view from get_hdu_view() or a masked cube (use its .data), of one of those shapes, or
+           PymwalibInvalidArgumentError is raised."""
+        if not isinstance(data, np.ndarray) or isinstance(data, np.ma.MaskedArray) or data.dtype != np.float32 or \
+                not data.flags.c_contiguous:
+            raise PymwalibInvalidArgumentError("data must be a C contiguous float32 numpy array (not a masked "
+                                               "array) to be viewed as complex64")
+
+        hdu_shape = self.get_hdu_shape(order)
+
+        if data.shape[-4:] == hdu_shape:
+            return data.view(np.complex64)[..., 0]
+        elif data.size != np.prod(hdu_shape):
+            raise PymwalibInvalidArgumentError(f"data of shape {data.shape} is neither one HDU of {np.prod(hdu_shape)} "
+                                               f"floats nor a cube of HDUs shaped {hdu_shape}")
+        else:
+            return data.view(np.complex64).reshape(hdu_shape[:3])
+
+    def get_quack_timestep_flags(self) -> np.ndarray:
+        """Returns a (timestep) boolean array which is True for each timestep which starts before the metafits
+           good time, i.e. during the quack time at the start of the observation"""
+        return self.timesteps.unix_time_ms < self.metafits_context.good_time_unix_ms
+
+    def get_flag_cube(self, timestep_indices: list, coarse_chan_indices: list, missing=None) -> np.ndarray:
+        """Returns a (timestep,coarse_chan,baseline) boolean array which is True where the data is flagged:
+           baselines with a flagged rf_input on either antenna (MetafitsMetadata.baseline_flags), timesteps in the
+           quack time and missing HDUs. missing is the (timestep,coarse_chan) array returned by read_cube(); if it
+           is not given, HDUs whose timestep or coarse channel is not provided are treated as missing.
+
+           It is built by broadcasting the per baseline, per timestep and per HDU flags, not per HDU."""
+        timestep_indices = np.asarray(timestep_indices, dtype=np.intp)
+
+        if missing is None:
+            missing = ~(np.isin(timestep_indices, self.provided_timestep_indices)[:, np.newaxis] &
+                        np.isin(coarse_chan_indices, self.provided_coarse_chan_indices)[np.newaxis, :])
+
+        hdu_flags = np.asarray(missing, dtype=bool) | self.get_quack_timestep_flags()[timestep_indices, np.newaxis]
+
+        return hdu_flags[:, :, np.newaxis] | self.metafits_context.baseline_flags[np.newaxis, np.newaxis, :]
+
+    def read_cube(self, timestep_indices: list, coarse_chan_indices: list, order: str = "baseline", out=None,
+                  max_workers: int = 1, masked: bool = False):
+        """Read many HDUs into one (timestep,coarse_chan,...) float32 cube, where each HDU is laid out as per
+           get_hdu_shape(order). Returns a tuple of (cube, missing) where missing is a (timestep,coarse_chan)
+           boolean array which is True where there was no data (those HDUs are zero filled in the cube).
+
+           If out is provided (e.g. an np.memmap) it must be a writeable, C contiguous float32 array of the cube's
+           shape and is filled in place. If max_workers is more than 1, HDUs are read concurrently using a ParallelReader.
+
+           If masked is True the cube is returned as a numpy masked array, masked where get_flag_cube() is True.
+           Its mask is a read-only broadcast of the flag cube, so it costs no extra memory; call the masked array's
+           unshare_mask() before changing the mask."""
+        hdu_shape = self.get_hdu_shape(order)
+        cube_shape = (len(timestep_indices), len(coarse_chan_indices)) + hdu_shape
+
+        if out is None:
+            out = np.empty(cube_shape, dtype=np.float32)
+        elif not isinstance(out, np.ndarray) or out.dtype != np.float32 or out.shape != cube_shape or \
+                not out.flags.c_contiguous or not out.flags.writeable:
+            raise PymwalibOutputBufferError(f"out must be a writeable, C contiguous float32 array of shape {cube_shape}")
+
+        read = "read_by_baseline" if order == "baseline" else "read_by_frequency"
+        items = [(timestep_index, coarse_chan_index)
+                 for timestep_index in timestep_indices for coarse_chan_index in coarse_chan_indices]
+        hdu_buffers = [out[t, c] for t in range(cube_shape[0]) for c in range(cube_shape[1])]
+
+        if max_workers > 1:
+            with ParallelReader(self, max_workers) as reader:
+                found = reader.read_into(items, hdu_buffers, read)
+        else:
+            found = []
+            for item, hdu_buffer in zip(items, hdu_buffers):
+                try:
+                    getattr(self, read)(*item, out=hdu_buffer)
+                    found.append(True)
+                except PymwalibNoDataForTimestepAndCoarseChannelError:
+                    found.append(False)
+
+        missing = ~np.array(found, dtype=bool).reshape(cube_shape[:2])
+        out[missing] = 0
+
+        if masked:
+            flags = self.get_flag_cube(timestep_indices, coarse_chan_indices, missing)
+            if order == "baseline":
+                flags = flags[:, :, :, np.newaxis, np.newaxis, np.newaxis]
+            else:
+                flags = flags[:, :, np.newaxis, :, np.newaxis, np.newaxis]
+            return np.ma.masked_array(out, mask=np.broadcast_to(flags, cube_shape)), missing
+
+        return out, missing
+
+    def get_provided_hdu_indices(self, order: str = "time") -> typing.List[typing.Tuple[int, int]]:
+        """Returns (timestep_index, coarse_chan_index) for every provided timestep and provided coarse channel. If
+           order is "time" all of the coarse channels of each timestep are listed in turn, if it is "freq" all of
+           the timesteps of each coarse channel are."""
+        if order == "time":
+            return [(timestep_index, coarse_chan_index)
+                    for timestep_index in self.provided_timestep_indices
+                    for coarse_chan_index in self.provided_coarse_chan_indices]
+        elif order == "freq":
+            return [(timestep_index, coarse_chan_index)
+                    for coarse_chan_index in self.provided_coarse_chan_indices
+                    for timestep_index in self.provided_timestep_indices]
+        else:
+            raise PymwalibInvalidArgumentError(f"order must be \"time\" or \"freq\", not {order!r}")
+
+    def iter_hdus(self, order: str = "time", prefetch: int = 2, data_order: str = "baseline") \
+            -> typing.Iterator[typing.Tuple[int, int, np.ndarray]]:
+        """Iterate over (timestep_index, coarse_chan_index, data) for every provided timestep and provided coarse
+           channel (in the order given by get_provided_hdu_indices(order)), skipping any pairs with no data.
+
+           data is read by read_by_baseline (data_order "baseline") or read_by_frequency (data_order "frequency")
+           on a background thread, up to prefetch HDUs ahead of the caller, into a ring of recycled buffers. Each
+           data array is only valid until the next HDU is requested: copy it if you need to keep it."""
+        items = self.get_provided_hdu_indices(order)
+
+        # Raises if data_order is not valid
+        self.get_hdu_shape(data_order)
+        read_method = self.read_by_baseline if data_order == "baseline" else self.read_by_frequency
+
+        def read(item: tuple, buffer: np.ndarray) -> bool:
+            try:
+                read_method(*item, out=buffer)
+            except PymwalibNoDataForTimestepAndCoarseChannelError:
+                return False
+            return True
+
+        for (timestep_index, coarse_chan_index), data in Prefetcher(read, items, lambda: self._get_hdu_buffer(None),
+                                                                    prefetch):
+            yield timestep_index, coarse_chan_index, data
+
+    def read_averaged(self, time_avg: int = 1, freq_avg: int = 1, timestep_indices: typing.Optional[list] = None,
+                      coarse_chan_indices: typing.Optional[list] = None, flagged_baselines=None,
+                      flagged_fine_chans=None, prefetch: int = 2) \
+            -> typing.Iterator[typing.Tuple[list, np.ndarray, np.ndarray]]:
+        """Iterate over (timestep_indices, data, weights), averaging each time_avg consecutive timesteps and
+           freq_avg adjacent fine channels as the HDUs are read, so only one averaged timestep is ever held.
+
+           timestep_indices (default: every timestep from the first to the last provided timestep) are averaged
+           in consecutive groups of time_avg (the last group may be shorter) and each group's indices are yielded
+           with its data. coarse_chan_indices defaults to the provided coarse channels. freq_avg must divide the
+           number of fine channels per coarse channel.
+
+           data is a new float32 (coarse_chan,baseline,freq,pol,r/i) array of weighted means and weights a float32
+           (coarse_chan,baseline,freq) array of the number of samples (timesteps x fine channels) in each mean.
+           Missing HDUs, and baselines / fine channels which are True in the flagged_baselines (baseline) /
+           flagged_fine_chans (fine chan) boolean arrays, are given no weight. flagged_baselines defaults to
+           metafits_context.baseline_flags (pass an all False array to include flagged baselines); no fine channels
+           are flagged by default. Means with no weight are zero. Groups with no data at all are skipped. HDUs are
+           read up to prefetch ahead (see iter_hdus), and weighted in place in the read buffers."""
+        num_baselines, num_fine_chans, num_pols, _ = hdu_shape = self.get_hdu_shape("baseline")
+
+        if time_avg < 1:
+            raise PymwalibInvalidArgumentError(f"time_avg must be at least 1, not {time_avg}")
+        if freq_avg < 1 or num_fine_chans % freq_avg != 0:
+            raise PymwalibInvalidArgumentError(f"freq_avg must divide the {num_fine_chans} fine channels per coarse "
+                                               f"channel, not {freq_avg}")
+
+        if timestep_indices is None:
+            timestep_indices = list(range(self.provided_timestep_indices[0], self.provided_timestep_indices[-1] + 1))
+        if coarse_chan_indices is None:
+            coarse_chan_indices = self.provided_coarse_chan_indices
+        if flagged_baselines is None:
+            flagged_baselines = self.metafits_context.baseline_flags
+
+        # The weight of each (baseline, fine channel) sample of an HDU, summed over each freq_avg fine channels
+        sample_weights = np.ones((num_baselines, num_fine_chans), dtype=np.float32)
+        for flags, axis_len, name in ((flagged_baselines, num_baselines, "flagged_baselines"),
+                                      (flagged_fine_chans, num_fine_chans, "flagged_fine_chans")):
+            if flags is None:
+                continue
+            flags = np.asarray(flags, dtype=bool)
+            if flags.shape != (axis_len,):
+                raise PymwalibInvalidArgumentError(f"{name} must have shape ({axis_len},), not {flags.shape}")
+            if name == "flagged_baselines":
+                sample_weights[flags, :] = 0
+            else:
+                sample_weights[:, flags] = 0
+        num_avg_chans = num_fine_chans // freq_avg
+        hdu_weights = sample_weights.reshape(num_baselines, num_avg_chans, freq_avg).sum(axis=2)
+
+        # Accumulators for one averaged timestep, and the sum over freq_avg of one HDU
+        sums = np.zeros((len(coarse_chan_indices), num_baselines, num_avg_chans, num_pols, 2), dtype=np.float64)
+        weights = np.zeros((len(coarse_chan_indices), num_baselines, num_avg_chans), dtype=np.float64)
+        hdu_sums = np.empty(sums.shape[1:], dtype=np.float64)
+
+        groups = [timestep_indices[start:start + time_avg] for start in range(0, len(timestep_indices), time_avg)]
+        group_numbers = {timestep_index: group_number
+                         for group_number, group in enumerate(groups) for timestep_index in group}
+        chan_positions = {coarse_chan_index: position for position, coarse_chan_index in enumerate(coarse_chan_indices)}
+        items = [(timestep_index, coarse_chan_index)
+                 for timestep_index in timestep_indices for coarse_chan_index in coarse_chan_indices]
+
+        def read(item: tuple, buffer: np.ndarray) -> bool:
+            try:
+                self.read_by_baseline(*item, out=buffer)
+            except PymwalibNoDataForTimestepAndCoarseChannelError:
+                return False
+            return True
+
+        def get_group_averages() -> typing.Tuple[np.ndarray, np.ndarray]:
+            data = np.zeros(sums.shape, dtype=np.float32)
+            np.divide(sums, weights[..., np.newaxis, np.newaxis], out=data, casting="unsafe",
+                      where=weights[..., np.newaxis, np.newaxis] > 0)
+            return data, weights.astype(np.float32)
+
+        group_number = None
+
+        for (timestep_index, coarse_chan_index), buffer in Prefetcher(read, items, lambda: self._get_hdu_buffer(None),
+                                                                      prefetch):
+            if group_number is not None and group_numbers[timestep_index] != group_number:
+                yield (groups[group_number],) + get_group_averages()
+                sums.fill(0)
+                weights.fill(0)
+            group_number = group_numbers[timestep_index]
+
+            # The buffer is ours until the next read into it, so the samples are weighted in place
+            data = buffer.reshape(hdu_shape)
+            np.multiply(data, sample_weights[:, :, np.newaxis, np.newaxis], out=data)
+            np.sum(data.reshape(num_baselines, num_avg_chans, freq_avg, num_pols, 2), axis=2, out=hdu_sums)
+            position = chan_positions[coarse_chan_index]
+            sums[position] += hdu_sums
+            weights[position] += hdu_weights
+
+        if group_number is not None:
+            yield (groups[group_number],) + get_group_averages()
+
     def __repr__(self):
         """Returns a representation of the class"""
         return f"{self.__class__.__name__}(\n" \
@@ -16,6 +16,11 @@ class PymwalibMwalibVersionNotCompatibleError(PymwalibError):
     pass
 
 
+class PymwalibMwalibLoadError(PymwalibError):
+    """Raised when the mwalib shared library is needed but could not be loaded"""
+    pass
+
+
 class PymwalibMetafitsContextNewError(PymwalibError):
     """Raised when call to C mwalib_metafits_context_new fails"""
     pass
@@ -125,3 +130,18 @@ class PymwalibNoDataForTimestepAndCoarseChannelError(PymwalibError):
     """Raised when call to C mwalib functions that read data ask for data at a timestep/coarse channel where
     there is no data"""
     pass
+
+
+class PymwalibOutputBufferError(PymwalibError):
+    """Raised when a caller supplied output buffer is not the size or type mwalib needs to read into"""
+    pass
+
+
+class PymwalibInvalidArgumentError(PymwalibError):
+    """Raised when an argument passed to a pymwalib method is not valid"""
+    pass
+
+
+class PymwalibFitsError(PymwalibError):
+    """Raised when a FITS file cannot be read by pymwalib's own (memory mapped) FITS reader"""
+    pass
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+#
+# gpubox_mmap: pure python, memory mapped reader for MWAX correlator (gpubox) FITS files
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import os
+import re
+import typing
+
+import numpy as np
+
+from .errors import PymwalibFitsError
+
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+
+# numpy dtypes of the FITS BITPIX values (FITS data is big endian)
+BITPIX_DTYPES = {8: np.dtype("u1"), 16: np.dtype(">i2"), 32: np.dtype(">i4"), 64: np.dtype(">i8"),
+                 -32: np.dtype(">f4"), -64: np.dtype(">f8")}
+
+# e.g. 1297526432_20210216160014_ch117_000.fits
+MWAX_GPUBOX_FILENAME_RE = re.compile(r"_ch(?P<rec_chan_number>\d{3})_(?P<batch_number>\d{3})\.fits$")
+
+
+class FitsHdu:
+    """
+    The header of one FITS HDU and where its data is
+
+    Attributes
+    ----------
+    header : dict
+        The header keywords and their values (int, float, bool or str). COMMENT, HISTORY and blank cards are
+        skipped.
+
+    data_offset : int
+        Offset, in bytes from the start of the file, of the HDU's data
+
+    shape : tuple
+        Shape of the data, slowest varying axis first (i.e. (NAXISn, ..., NAXIS1))
+
+    dtype : np.dtype
+        Type of the data
+
+    """
+
+    def __init__(self, header: dict, data_offset: int):
+        """Initialise the class"""
+        self.header: dict = header
+        self.data_offset: int = data_offset
+        self.shape: tuple = tuple(header[f"NAXIS{axis}"] for axis in range(header["NAXIS"], 0, -1))
+        self.dtype: np.dtype = BITPIX_DTYPES[header["BITPIX"]]
+
+    @property
+    def data_size(self) -> int:
+        """Size of the data in bytes (excluding padding). This includes the parameters of random groups (whose
+           NAXIS1 is 0) and the heap of binary tables."""
+        if not self.shape:
+            return 0
+
+        axes = self.shape[:-1] if self.header.get("GROUPS", False) and self.shape[-1] == 0 else self.shape
+        num_values = self.header.get("PCOUNT", 0) + int(np.prod(axes, dtype=np.int64))
+
+        return self.header.get("GCOUNT", 1) * num_values * self.dtype.itemsize
+
+    def __repr__(self):
+        """Returns a representation of the class"""
+        return f"{self.__class__.__name__}(" \
+               f"Data offset: {self.data_offset}, " \
+               f"Shape: {self.shape}, " \
+               f"Type: {self.dtype})"
+
+
+def parse_fits_value(value: str):
+    """Converts the value part of a FITS header card to int, float, bool or str"""
+    value = value.strip()
+
+    if value.startswith("'"):
+        # Strings are quoted, with '' for a literal quote, and may be followed by a comment
+        end = 1
+        while True:
+            end = value.find("'", end)
+            if end == -1:
+                raise PymwalibFitsError(f"Unterminated string in FITS header value {value!r}")
+            if value[end + 1:end + 2] != "'":
+                break
+            end += 2
+        return value[1:end].replace("''", "'").rstrip()
+
+    value = value.split("/", 1)[0].strip()
+
+    if value == "T":
+        return True
+    if value == "F":
+        return False
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value.replace("D", "E"))
+    except ValueError:
+        return value
+
+
+def parse_fits_header(header_bytes: bytes) -> typing.Tuple[dict, bool]:
+    """Parses one or more header blocks. Returns a tuple of the keywords and their values, and whether the END
+       card was found."""
+    header = {}
+
+    for start in range(0, len(header_bytes), FITS_CARD_SIZE):
+        card = header_bytes[start:start + FITS_CARD_SIZE].decode("ascii", errors="replace")
+        keyword = card[:8].strip()
+
+        if keyword == "END":
+            return header, True
+        if card[8:10] == "= ":
+            header[keyword] = parse_fits_value(card[10:])
+
+    return header, False
+
+
+def read_fits_hdus(filename: str) -> typing.List[FitsHdu]:
+    """Reads every header in a FITS file (but none of the data), returning a FitsHdu for each HDU"""
+    hdus = []
+    file_size = os.path.getsize(filename)
+
+    with open(filename, "rb") as fits_file:
+        offset = 0
+
+        while offset < file_size:
+            header = {}
+            found_end = False
+
+            while not found_end:
+                block = fits_file.read(FITS_BLOCK_SIZE)
+                if len(block) != FITS_BLOCK_SIZE:
+                    raise PymwalibFitsError(f"{filename}: truncated FITS header at offset {offset}")
+                offset += FITS_BLOCK_SIZE
+                block_header, found_end = parse_fits_header(block)
+                header.update(block_header)
+
+            if "BITPIX" not in header or "NAXIS" not in header:
+                raise PymwalibFitsError(f"{filename}: FITS header at offset {offset} has no BITPIX or NAXIS")
+
+            hdu = FitsHdu(header, offset)
+            hdus.append(hdu)
+
+            # Data is padded to a whole number of blocks
+            offset += -(-hdu.data_size // FITS_BLOCK_SIZE) * FITS_BLOCK_SIZE
+            fits_file.seek(offset)
+
+    return hdus
+
+
+# numpy dtypes of the FITS binary table TFORM types (L is the character T or F)
+TFORM_DTYPES = {"L": "S1", "B": "u1", "I": ">i2", "J": ">i4", "K": ">i8", "E": ">f4", "D": ">f8"}
+
+TFORM_RE = re.compile(r"^\s*(?P<repeat>\d*)(?P<type>[A-Z])")
+
+
+def get_fits_table_dtype(header: dict) -> np.dtype:
+    """Returns the numpy dtype of one row of a binary table HDU, with a field per column (named by TTYPEn)"""
+    fields = []
+
+    for column in range(1, header["TFIELDS"] + 1):
+        tform = header[f"TFORM{column}"]
+        match = TFORM_RE.match(tform)
+        if match is None or (match.group("type") != "A" and match.group("type") not in TFORM_DTYPES):
+            raise PymwalibFitsError(f"Unsupported binary table column format {tform!r}")
+
+        repeat = int(match.group("repeat") or 1)
+        if match.group("type") == "A":
+            fields.append((header[f"TTYPE{column}"], f"S{repeat}"))
+        elif repeat == 1:
+            fields.append((header[f"TTYPE{column}"], TFORM_DTYPES[match.group("type")]))
+        else:
+            fields.append((header[f"TTYPE{column}"], TFORM_DTYPES[match.group("type")], (repeat,)))
+
+    dtype = np.dtype(fields)
+    if dtype.itemsize != header["NAXIS1"]:
+        raise PymwalibFitsError(f"Binary table rows are {header['NAXIS1']} bytes, but its columns add up to "
+                                f"{dtype.itemsize}")
+    return dtype
+
+
+def read_fits_table(filename: str, hdu: FitsHdu) -> np.ndarray:
+    """Reads the rows of a binary table HDU (as returned by read_fits_hdus) into a numpy structured array with a
+       field per column. Values keep their FITS (big endian) types, and strings are bytes."""
+    if hdu.header.get("XTENSION") != "BINTABLE":
+        raise PymwalibFitsError(f"{filename}: HDU at offset {hdu.data_offset} is not a binary table")
+
+    return np.fromfile(filename, dtype=get_fits_table_dtype(hdu.header), count=hdu.header["NAXIS2"],
+                       offset=hdu.data_offset)
+
+
+class MWAXGpuboxFile:
+    """
+    One MWAX gpubox file, memory mapped. Each timestep is a visibility HDU (int32, baseline x (freq,pol,r/i))
+    followed by a weights HDU (float32, baseline x pol).
+
+    Attributes
+    ----------
+    filename : str
+        The file name
+
+    rec_chan_number : int
+        The receiver channel number, from the file name
+
+    batch_number : int
+        The batch number, from the file name
+
+    primary_header : dict
+        The keywords of the primary HDU (e.g. CORR_VER, NFINECHS and NINPUTS)
+
+    unix_times_ms : list
+        The UNIX time (in milliseconds) of each timestep in the file, from each HDU's TIME and MILLITIM
+
+    """
+
+    def __init__(self, filename: str):
+        """Parse the headers of filename and memory map it"""
+        match = MWAX_GPUBOX_FILENAME_RE.search(os.path.basename(filename))
+        if match is None:
+            raise PymwalibFitsError(f"{filename} is not named like an MWAX gpubox file (*_chNNN_NNN.fits)")
+
+        self.filename: str = filename
+        self.rec_chan_number: int = int(match.group("rec_chan_number"))
+        self.batch_number: int = int(match.group("batch_number"))
+
+        hdus = read_fits_hdus(filename)
+        self.primary_header: dict = hdus[0].header
+        self._visibility_hdus: typing.List[FitsHdu] = hdus[1::2]
+        self._weights_hdus: typing.List[FitsHdu] = hdus[2::2]
+        if any(hdu.header["BITPIX"] != 32 for hdu in self._visibility_hdus):
+            raise PymwalibFitsError(f"{filename}: MWAX visibility HDUs should all be 32 bit integers")
+
+        self.unix_times_ms: typing.List[int] = [hdu.header["TIME"] * 1000 + hdu.header["MILLITIM"]
+                                                for hdu in self._visibility_hdus]
+        self._memmap = np.memmap(filename, dtype=np.uint8, mode="r")
+
+    def _get_view(self, hdu: FitsHdu) -> np.ndarray:
+        data = self._memmap[hdu.data_offset:hdu.data_offset + hdu.data_size]
+        return data.view(hdu.dtype).reshape(hdu.shape)
+
+    def get_visibilities(self, hdu_index: int) -> np.ndarray:
+        """Returns a read-only, big endian int32 (baseline, freq*pol*r/i) view of a visibility HDU"""
+        return self._get_view(self._visibility_hdus[hdu_index])
+
+    def get_weights(self, hdu_index: int) -> np.ndarray:
+        """Returns a read-only, big endian float32 (baseline, pol) view of a weights HDU"""
+        return self._get_view(self._weights_hdus[hdu_index])
+
+
+class MWAXGpuboxReader:
+    """
+    Memory mapped access to the visibilities of a set of MWAX gpubox files, looked up by UNIX time and receiver
+    channel number. The headers are parsed once, when the reader is created, after which each HDU is a view of the
+    file (backed by the page cache) rather than a copy. It does not use mwalib, so works where libmwalib.so is
+    not available.
+
+    """
+
+    def __init__(self, gpubox_filenames: list):
+        """Parse and memory map each file"""
+        self.gpubox_files: typing.List[MWAXGpuboxFile] = [MWAXGpuboxFile(filename) for filename in gpubox_filenames]
+        self._hdus: typing.Dict[typing.Tuple[int, int], typing.Tuple[MWAXGpuboxFile, int]] = {}
+
+        for gpubox_file in self.gpubox_files:
+            for hdu_index, unix_time_ms in enumerate(gpubox_file.unix_times_ms):
+                self._hdus[(unix_time_ms, gpubox_file.rec_chan_number)] = (gpubox_file, hdu_index)
+
+    def has_hdu(self, unix_time_ms: int, rec_chan_number: int) -> bool:
+        """Returns True if there is data for the UNIX time and receiver channel"""
+        return (unix_time_ms, rec_chan_number) in self._hdus
+
+    def get_visibilities(self, unix_time_ms: int, rec_chan_number: int) -> typing.Optional[np.ndarray]:
+        """Returns a read-only, big endian int32 (baseline, freq*pol*r/i) view of the visibilities for the UNIX
+           time and receiver channel, or None if there is no data for them"""
+        location = self._hdus.get((unix_time_ms, rec_chan_number))
+        if location is None:
+            return None
+        gpubox_file, hdu_index = location
+        return gpubox_file.get_visibilities(hdu_index)
+
+    def get_weights(self, unix_time_ms: int, rec_chan_number: int) -> typing.Optional[np.ndarray]:
+        """Returns a read-only, big endian float32 (baseline, pol) view of the weights for the UNIX time and
+           receiver channel, or None if there is no data for them"""
+        location = self._hdus.get((unix_time_ms, rec_chan_number))
+        if location is None:
+            return None
+        gpubox_file, hdu_index = location
+        return gpubox_file.get_weights(hdu_index)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# hdu_cache: memory bounded LRU cache of read HDUs / voltage files
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import threading
+import typing
+from collections import OrderedDict
+
+import numpy as np
+
+from .errors import PymwalibInvalidArgumentError
+
+
+class HDUCache:
+    """
+    A least recently used cache of read data (e.g. HDUs, keyed on the read order, timestep and coarse channel)
+    holding at most max_bytes of arrays. The arrays are stored read-only and returned as is (not copied) on a hit.
+    Arrays bigger than max_bytes are never stored. The cache may be used from multiple threads: while one thread
+    reads a key through read(), other threads missing on the same key wait for it rather than reading it too.
+
+    Attributes
+    ----------
+    max_bytes : int
+        The most bytes of arrays the cache holds
+
+    num_bytes : int
+        The bytes of arrays held now
+
+    hits : int
+        Number of lookups which found their key
+
+    misses : int
+        Number of lookups which did not
+
+    evictions : int
+        Number of arrays dropped to make room for new ones
+
+    """
+
+    def __init__(self, max_bytes: int):
+        """Initialise an empty cache of at most max_bytes"""
+        if max_bytes < 0:
+            raise PymwalibInvalidArgumentError(f"max_bytes must not be negative, not {max_bytes}")
+
+        self.max_bytes: int = max_bytes
+        self.num_bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._arrays: typing.OrderedDict[tuple, np.ndarray] = OrderedDict()
+        # Keys being read by read(), with the event set when the read finishes
+        self._reading: typing.Dict[tuple, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._arrays)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._arrays
+
+    def get(self, key: tuple) -> typing.Optional[np.ndarray]:
+        """Returns the read-only array for key, making it the most recently used, or None if it is not cached"""
+        with self._lock:
+            data = self._arrays.get(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._arrays.move_to_end(key)
+
+        return data
+
+    def _fits(self, data: np.ndarray) -> bool:
+        """Returns True if data is small enough to be cached"""
+        return data.nbytes <= self.max_bytes
+
+    def put(self, key: tuple, data: np.ndarray) -> np.ndarray:
+        """Stores data (which the cache takes ownership of, and makes read-only) for key, evicting the least
+           recently used arrays to make room, and returns it. Data too big to cache is returned as is (still
+           writeable) and not stored."""
+        if not self._fits(data):
+            return data
+
+        data.flags.writeable = False
+        with self._lock:
+            old_data = self._arrays.pop(key, None)
+            if old_data is not None:
+                self.num_bytes -= old_data.nbytes
+
+            while self.num_bytes + data.nbytes > self.max_bytes:
+                _, evicted_data = self._arrays.popitem(last=False)
+                self.num_bytes -= evicted_data.nbytes
+                self.evictions += 1
+
+            self._arrays[key] = data
+            self.num_bytes += data.nbytes
+
+        return data
+
+    def read(self, key: tuple, read: typing.Callable[[typing.Optional[np.ndarray]], np.ndarray],
+             out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        """Returns the data for key: from the cache on a hit, otherwise from read(out), which is then cached.
+
+           Without out the cached, read-only, array itself is returned (on a miss, the array read is cached
+           without a copy, unless it is too big to cache). With out (an already validated buffer) the data is
+           copied into out, which is returned, and on a miss a copy of it is cached if it is small enough.
+
+           Only one thread reads a key at a time: a thread which misses on a key another thread is reading waits
+           for that read and then looks again, so it is a hit unless the data could not be cached (too big, or the
+           read raised), in which case it reads the key itself."""
+        while True:
+            with self._lock:
+                data = self._arrays.get(key)
+                if data is not None:
+                    self.hits += 1
+                    self._arrays.move_to_end(key)
+                    break
+
+                reading = self._reading.get(key)
+                if reading is None:
+                    self.misses += 1
+                    reading = self._reading[key] = threading.Event()
+                    break
+
+            reading.wait()
+
+        if data is None:
+            try:
+                data = read(out)
+                if out is None:
+                    return self.put(key, data)
+
+                if self._fits(data):
+                    self.put(key, data.copy())
+                return out
+            finally:
+                with self._lock:
+                    del self._reading[key]
+                reading.set()
+
+        if out is None:
+            return data
+
+        np.copyto(out, data.reshape(out.shape))
+        return out
+
+    def clear(self):
+        """Drops every cached array (the counters are kept)"""
+        with self._lock:
+            self._arrays.clear()
+            self.num_bytes = 0
+
+    def __repr__(self):
+        """Returns a representation of the class"""
+        return f"{self.__class__.__name__}(" \
+               f"Arrays: {len(self)}, " \
+               f"Bytes: {self.num_bytes} of {self.max_bytes}, " \
+               f"Hits: {self.hits}, " \
+               f"Misses: {self.misses}, " \
+               f"Evictions: {self.evictions})"
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# metadata_cache: opt-in on-disk cache of decoded metafits, correlator and voltage metadata
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import hashlib
+import json
+import os
+import tempfile
+import typing
+import zipfile
+from functools import cached_property
+
+import numpy as np
+
+from .version import get_mwalib_version_string, get_pymwalib_version_string
+
+# Bump this whenever the fields stored by the contexts change, so older cache files are no longer used
+CACHE_FORMAT_VERSION = 1
+
+_SCALARS_KEY = "__scalars__"
+
+
+def get_cache_key(kind: str, metafits_filename: str, data_filenames: typing.Optional[list] = None,
+                  uses_mwalib: bool = True) -> str:
+    """Returns the cache key for a context of the given kind ("metafits", "correlator" or "voltage"). The key covers
+       the path, size and mtime of the metafits and each data file, plus the pymwalib and mwalib versions, so any
+       change to the files or an upgrade gives a new key. If uses_mwalib is False (metadata read without mwalib,
+       see mmap_metadata) the mwalib version is left out, so mwalib does not need to be installed."""
+    files = []
+    for filename in [metafits_filename] + sorted(data_filenames or []):
+        stat = os.stat(filename)
+        files.append([os.path.abspath(filename), stat.st_size, stat.st_mtime_ns])
+
+    mwalib_version = get_mwalib_version_string() if uses_mwalib else None
+    key = json.dumps([CACHE_FORMAT_VERSION, kind, get_pymwalib_version_string(), mwalib_version, files])
+
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def get_cache_filename(cache_dir: str, key: str) -> str:
+    """Returns the filename the state for key is stored in"""
+    return os.path.join(cache_dir, f"{key}.npz")
+
+
+def get_scalar_state(obj) -> dict:
+    """Returns the public fields of obj which are json serialisable scalars (or lists of them)"""
+    scalars = {}
+
+    for name, value in vars(obj).items():
+        if name.startswith("_") or isinstance(getattr(type(obj), name, None), cached_property):
+            continue
+        if isinstance(value, (bool, int, float, str)) or value is None:
+            scalars[name] = value
+        elif isinstance(value, list) and all(isinstance(v, (bool, int, float, str)) for v in value):
+            scalars[name] = value
+
+    return scalars
+
+
+def save_state(cache_dir: str, key: str, scalars: dict, arrays: typing.Dict[str, np.ndarray]):
+    """Stores a dict of json serialisable scalars and a dict of numpy arrays under key. The file is written to a
+       temporary name first and then renamed, so concurrent readers never see a partial file."""
+    os.makedirs(cache_dir, exist_ok=True)
+
+    contents = dict(arrays)
+    contents[_SCALARS_KEY] = np.frombuffer(json.dumps(scalars).encode("utf-8"), dtype=np.uint8)
+
+    fd, temp_filename = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            np.savez(temp_file, **contents)
+        os.replace(temp_filename, get_cache_filename(cache_dir, key))
+    except BaseException:
+        os.unlink(temp_filename)
+        raise
+
+
+def load_state(cache_dir: str, key: str) -> typing.Optional[typing.Tuple[dict, typing.Dict[str, np.ndarray]]]:
+    """Returns the (scalars, arrays) stored under key, or None if there is no (readable) entry for key"""
+    try:
+        with np.load(get_cache_filename(cache_dir, key), allow_pickle=False) as contents:
+            arrays = {name: contents[name] for name in contents.files}
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return None
+
+    scalars = json.loads(arrays.pop(_SCALARS_KEY).tobytes().decode("utf-8"))
+
+    return scalars, arrays
+
+
+def add_prefix(prefix: str, arrays: typing.Dict[str, np.ndarray]) -> typing.Dict[str, np.ndarray]:
+    """Returns arrays with each name prefixed by prefix, so the arrays of a nested object can be stored with ours"""
+    return {f"{prefix}.{name}": array for name, array in arrays.items()}
+
+
+def remove_prefix(prefix: str, arrays: typing.Dict[str, np.ndarray]) -> typing.Dict[str, np.ndarray]:
+    """Returns the arrays whose names start with prefix (see add_prefix()), with the prefix removed"""
+    return {name[len(prefix) + 1:]: array for name, array in arrays.items() if name.startswith(f"{prefix}.")}
@@ -11,6 +11,7 @@ import ctypes as ct
 from .mwalib import CMetafitsContextS, mwalib_library, create_string_buffer
 from .common import ERROR_MESSAGE_LEN, MWAVersion
 from .errors import PymwalibMetafitsContextNewError, PymwalibMetafitsContextDisplayError
+from .metadata_cache import get_cache_key, load_state, save_state
 from .metafits_metadata import MetafitsMetadata
 from .version import check_mwalib_version
 
@@ -18,20 +19,33 @@ from .version import check_mwalib_version
 class MetafitsContext(MetafitsMetadata):
     """Main class to interface with mwalib metafits infomation"""
 
-    def __init__(self, metafits_filename: str, mwa_version: typing.Optional[MWAVersion] = None):
-        """Take metafits and an MWAVersion or None, and populate this class via mwalib"""
+    def __init__(self, metafits_filename: str, mwa_version: typing.Optional[MWAVersion] = None,
+                 cache_dir: typing.Optional[str] = None):
+        """Take metafits and an MWAVersion or None, and populate this class via mwalib. If cache_dir is given, the
+           metadata is read from (or on a miss, written to) the metadata cache there (see metadata_cache);
+           on a hit the mwalib context is not created until mwalib is first needed, e.g. by display()."""
         #
         # Ensure we have a compatible version of mwalib
         #
         check_mwalib_version()
 
         self._metafits_context_object = ct.POINTER(CMetafitsContextS)()
+        self._metafits_context_args = (metafits_filename, mwa_version)
 
-        # First populate the context object
-        self._get_metafits_context(metafits_filename, mwa_version)
+        # Get metafits metadata, from the cache if we can. On a hit the context object is only created when mwalib is
+        # first needed (see _get_metafits_context_object())
+        if cache_dir is not None:
+            mwa_version_value = None if mwa_version is None else mwa_version.value
+            cache_key = get_cache_key(f"metafits:{mwa_version_value}", metafits_filename)
+            state = load_state(cache_dir, cache_key)
+            if state is not None:
+                self._set_state(*state)
+                return
 
-        # Get metafits metadata
-        super().__init__(self._metafits_context_object, None, None)
+        super().__init__(self._get_metafits_context_object(), None, None)
+
+        if cache_dir is not None:
+            save_state(cache_dir, cache_key, *self._get_state())
 
     def __enter__(self):
         return self
@@ -41,6 +55,13 @@ class MetafitsContext(MetafitsMetadata):
         if self._metafits_context_object:
             mwalib_library.mwalib_metafits_context_free(self._metafits_context_object)
 
+    def _get_metafits_context_object(self):
+        """Returns the mwalib metafits context, creating it on first use"""
+        if not self._metafits_context_object:
+            self._get_metafits_context(*self._metafits_context_args)
+
+        return self._metafits_context_object
+
     def _get_metafits_context(self, metafits_filename: str, mwa_version: typing.Optional[MWAVersion] = None):
         """This method will read and validate the metafits and mwa version"""
         if mwalib_library:
@@ -69,7 +90,7 @@ class MetafitsContext(MetafitsMetadata):
         """Displays a human readable summary of the metafits context"""
         error_message = create_string_buffer(ERROR_MESSAGE_LEN)
 
-        if mwalib_library.mwalib_metafits_context_display(self._metafits_context_object,
+        if mwalib_library.mwalib_metafits_context_display(self._get_metafits_context_object(),
                                                           error_message,
                                                           ERROR_MESSAGE_LEN) != 0:
             raise PymwalibMetafitsContextDisplayError(f"Error calling mwalib_metafits_context_display(): "
@@ -81,7 +102,7 @@ class MetafitsContext(MetafitsMetadata):
         filename_len = 64
         filename = create_string_buffer(filename_len)
 
-        if mwalib_library.mwalib_metafits_get_expected_volt_filename(self._metafits_context_object,
+        if mwalib_library.mwalib_metafits_get_expected_volt_filename(self._get_metafits_context_object(),
                                                                      metafits_timestep_index,
                                                                      metafits_coarse_chan_index,
                                                                      filename,
@@ -8,7 +8,10 @@
 #
 import ctypes as ct
 from datetime import datetime
+from functools import cached_property
+from typing import Dict, List, Tuple
 
+import numpy as np
 from numpy import double
 from .mwalib import (
     mwalib_library,
@@ -17,6 +20,8 @@ from .mwalib import (
     CCorrelatorContextS,
     CVoltageContextS,
     create_string_buffer,
+    c_array_to_numpy,
+    c_struct_array_to_numpy,
 )
 from .common import (
     ERROR_MESSAGE_LEN,
@@ -25,12 +30,27 @@ from .common import (
     GeometricDelaysApplied,
     CableDelaysApplied,
 )
-from .errors import PymwalibMetafitsMetadataGetError
+from .errors import PymwalibMetafitsMetadataGetError, PymwalibInvalidArgumentError
+from .metadata_cache import get_scalar_state
 from .antenna import Antenna
-from .baseline import Baseline
+from .baseline import Baseline, BaselineList
 from .rfinput import RFInput
-from .coarse_channel import CoarseChannel
-from .timestep import TimeStep
+from .coarse_channel import CoarseChannel, CoarseChannelList
+from .timestep import TimeStep, TimeStepList
+
+
+# The arrays which, with the scalar fields, hold all of the state of MetafitsMetadata
+_STATE_ARRAYS = (
+    "_rf_input_table",
+    "_rf_input_digital_gains",
+    "_rf_input_dipole_delays",
+    "_rf_input_dipole_gains",
+    "_antenna_table",
+    "_baseline_table",
+    "_metafits_timestep_table",
+    "_metafits_coarse_chan_table",
+    "_metafits_fine_chan_freqs_hz",
+)
 
 
 class MetafitsMetadata:
@@ -169,32 +189,193 @@ class MetafitsMetadata:
                 "utf-8"
             )
 
-            # Populate rf_inputs
-            self.rf_inputs = RFInput.get_rf_inputs(c_object)
+            # Keep a bulk copy of each collection. The python objects for each
+            # collection are only built when first accessed (see the properties
+            # below), so callers which only need the scalar fields don't pay for
+            # them
+            (
+                self._rf_input_table,
+                self._rf_input_digital_gains,
+                self._rf_input_dipole_delays,
+                self._rf_input_dipole_gains,
+            ) = RFInput.get_rf_input_table(c_object)
+            self._antenna_table = Antenna.get_antenna_table(c_object)
+            self._baseline_table = Baseline.get_baseline_table(c_object)
+            self._metafits_timestep_table = c_struct_array_to_numpy(
+                c_object.metafits_timesteps, self.num_metafits_timesteps
+            )
+            self._metafits_coarse_chan_table = c_struct_array_to_numpy(
+                c_object.metafits_coarse_chans, self.num_metafits_coarse_chans
+            )
+            self._metafits_fine_chan_freqs_hz = c_array_to_numpy(
+                c_object.metafits_fine_chan_freqs_hz,
+                self.num_metafits_fine_chan_freqs,
+            )
 
-            # Populate antennas
-            self.antennas = Antenna.get_antennas(c_object, self.rf_inputs)
+            # We're now finished with the C memory, so free it
+            mwalib_library.mwalib_metafits_metadata_free(c_object)
 
-            # Populate baselines
-            self.baselines = Baseline.get_baselines(c_object)
+    def _get_state(self) -> Tuple[dict, Dict[str, np.ndarray]]:
+        """Returns the fields of this class as a dict of json serialisable
+        scalars and a dict of numpy arrays (see metadata_cache)"""
+        scalars = get_scalar_state(self)
+        scalars["sched_start_utc"] = self.sched_start_utc.isoformat()
+        scalars["sched_end_utc"] = self.sched_end_utc.isoformat()
+        arrays = {name: getattr(self, name) for name in _STATE_ARRAYS}
 
-            # Populate timesteps
-            self.metafits_timesteps = TimeStep.get_metafits_timesteps(c_object)
+        return scalars, arrays
 
-            # Populate coarse channels
-            self.metafits_coarse_chans = (
-                CoarseChannel.get_metafits_coarse_channels(c_object)
-            )
+    def _set_state(self, scalars: dict, arrays: Dict[str, np.ndarray]):
+        """Populate this class from the output of _get_state(), instead of
+        via mwalib"""
+        self.__dict__.update(scalars)
+        self.sched_start_utc = datetime.fromisoformat(scalars["sched_start_utc"])
+        self.sched_end_utc = datetime.fromisoformat(scalars["sched_end_utc"])
+        for name in _STATE_ARRAYS:
+            setattr(self, name, arrays[name])
 
-            # fine chan frequencies
-            self.metafits_fine_chan_freqs_hz = []
-            for i in range(0, self.num_metafits_fine_chan_freqs):
-                self.metafits_fine_chan_freqs_hz.append(
-                    c_object.metafits_fine_chan_freqs_hz[i]
-                )
+    @classmethod
+    def _from_state(
+        cls, scalars: dict, arrays: Dict[str, np.ndarray]
+    ) -> "MetafitsMetadata":
+        """Create an instance from the output of _get_state(), without calling
+        mwalib"""
+        metafits_metadata = cls.__new__(cls)
+        metafits_metadata._set_state(scalars, arrays)
+        return metafits_metadata
 
-            # We're now finished with the C memory, so free it
-            mwalib_library.mwalib_metafits_metadata_free(c_object)
+    @cached_property
+    def rf_input_table(self) -> np.ndarray:
+        """Read-only numpy structured array with one row per rf_input, in the same order as rf_inputs. Fields are
+           input, ant, tile_id, tile_name, pol, electrical_length_m, north_m, east_m, height_m, vcs_order,
+           subfile_order, flagged, num_digital_gains, num_dipole_delays, num_dipole_gains, rec_number and
+           rec_slot_number"""
+        table = self._rf_input_table.view()
+        table.flags.writeable = False
+        return table
+
+    @cached_property
+    def antenna_table(self) -> np.ndarray:
+        """Read-only numpy structured array with one row per antenna, in the same order as antennas. Fields are
+           ant, tile_id, tile_name, rfinput_x, rfinput_y (indices into rf_input_table), electrical_length_m,
+           north_m, east_m, height_m, flagged (either pol flagged), rec_number, rec_slot_number, vcs_order_x,
+           vcs_order_y, subfile_order_x and subfile_order_y"""
+        table = Antenna.add_rf_input_columns(
+            self._antenna_table, self._rf_input_table
+        )
+        table.flags.writeable = False
+        return table
+
+    @cached_property
+    def rf_inputs(self) -> List[RFInput]:
+        """List of RFInput, built on first access"""
+        return RFInput.get_rf_inputs_from_table(
+            self._rf_input_table,
+            self._rf_input_digital_gains,
+            self._rf_input_dipole_delays,
+            self._rf_input_dipole_gains,
+        )
+
+    @cached_property
+    def antennas(self) -> List[Antenna]:
+        """List of Antenna, built on first access"""
+        return Antenna.get_antennas_from_table(
+            self._antenna_table, self.rf_inputs
+        )
+
+    @cached_property
+    def baselines(self) -> BaselineList:
+        """BaselineList of every baseline, built on first access"""
+        return Baseline.get_baselines_from_table(self._baseline_table)
+
+    @cached_property
+    def baseline_ant1_index(self) -> np.ndarray:
+        """Read-only int array of the first antenna index of each baseline"""
+        ant1_index = self._baseline_table["ant1_index"].astype(np.int64)
+        ant1_index.flags.writeable = False
+        return ant1_index
+
+    @cached_property
+    def baseline_ant2_index(self) -> np.ndarray:
+        """Read-only int array of the second antenna index of each baseline"""
+        ant2_index = self._baseline_table["ant2_index"].astype(np.int64)
+        ant2_index.flags.writeable = False
+        return ant2_index
+
+    @cached_property
+    def auto_baseline_mask(self) -> np.ndarray:
+        """Read-only bool array which is True for each auto correlation baseline"""
+        mask = self.baseline_ant1_index == self.baseline_ant2_index
+        mask.flags.writeable = False
+        return mask
+
+    @cached_property
+    def cross_baseline_mask(self) -> np.ndarray:
+        """Read-only bool array which is True for each cross correlation baseline"""
+        mask = ~self.auto_baseline_mask
+        mask.flags.writeable = False
+        return mask
+
+    @cached_property
+    def baseline_flags(self) -> np.ndarray:
+        """Read-only bool array which is True for each baseline with a flagged rf_input on either antenna"""
+        antenna_flagged = self.antenna_table["flagged"]
+        flags = antenna_flagged[self.baseline_ant1_index] | antenna_flagged[self.baseline_ant2_index]
+        flags.flags.writeable = False
+        return flags
+
+    def baseline_index(self, ant1_index, ant2_index):
+        """Returns the baseline index of each (ant1_index, ant2_index) pair. Takes ints or arrays of antenna
+           indices (in either order) and returns the same, computed rather than searched for."""
+        for ant_index in (ant1_index, ant2_index):
+            ant_index = np.asarray(ant_index)
+            if ant_index.size and (ant_index.min() < 0 or ant_index.max() >= self.num_ants):
+                raise PymwalibInvalidArgumentError(f"Antenna indices must be between 0 and {self.num_ants - 1}")
+
+        return Baseline.get_baseline_index(ant1_index, ant2_index, self.num_ants)
+
+    def _baselines_for_antennas(self, antenna_mask: np.ndarray) -> np.ndarray:
+        """Returns the indices of the baselines with both antennas selected by antenna_mask"""
+        return np.flatnonzero(antenna_mask[self.baseline_ant1_index] & antenna_mask[self.baseline_ant2_index])
+
+    def baselines_for_tiles(self, tile_ids) -> np.ndarray:
+        """Returns the (sorted) indices of the baselines between any two of the tiles (including each tile with
+           itself) with the given tile ids. Combine with auto_baseline_mask or cross_baseline_mask as needed."""
+        tile_ids = np.asarray(tile_ids)
+        unknown = np.setdiff1d(tile_ids, self._antenna_table["tile_id"])
+        if unknown.size:
+            raise PymwalibInvalidArgumentError(f"Unknown tile ids: {unknown.tolist()}")
+
+        return self._baselines_for_antennas(np.isin(self._antenna_table["tile_id"], tile_ids))
+
+    def baselines_for_tile_names(self, tile_names) -> np.ndarray:
+        """Returns the (sorted) indices of the baselines between any two of the tiles (including each tile with
+           itself) with the given tile names. See baselines_for_tiles()."""
+        tile_names = np.asarray(tile_names, dtype=str)
+        unknown = np.setdiff1d(tile_names, self._antenna_table["tile_name"])
+        if unknown.size:
+            raise PymwalibInvalidArgumentError(f"Unknown tile names: {unknown.tolist()}")
+
+        return self._baselines_for_antennas(np.isin(self._antenna_table["tile_name"], tile_names))
+
+    @cached_property
+    def metafits_timesteps(self) -> TimeStepList:
+        """TimeStepList of the metafits timesteps, built on first access"""
+        return TimeStep.get_timesteps_from_table(self._metafits_timestep_table)
+
+    @cached_property
+    def metafits_coarse_chans(self) -> CoarseChannelList:
+        """CoarseChannelList of the metafits coarse channels, built on first access"""
+        return CoarseChannel.get_coarse_channels_from_table(
+            self._metafits_coarse_chan_table
+        )
+
+    @cached_property
+    def metafits_fine_chan_freqs_hz(self) -> np.ndarray:
+        """Read-only float64 array of the metafits fine channel frequencies (Hz)"""
+        freqs = self._metafits_fine_chan_freqs_hz.view()
+        freqs.flags.writeable = False
+        return freqs
 
     def __repr__(self):
         return "%s(%r)" % (self.__class__, self.__dict__)
@@ -0,0 +1,501 @@
+#!/usr/bin/env python
+#
+# mmap_metadata: builds the metadata of the "mmap" backends from the metafits and data files, without mwalib
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Each function returns the (scalars, arrays) of the matching _get_state() (see metadata_cache), so the contexts
+# populate themselves with the same _set_state() they use for cache hits. The values follow mwalib's, for the MWA
+# versions the "mmap" backends support (MWAX correlator, MWAX VCS and legacy recombined VCS).
+#
+import math
+import os
+import typing
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from .common import MWAMode, MWAVersion
+from .constants import MWA_COAX_V_FACTOR
+from .errors import PymwalibFitsError, PymwalibInvalidArgumentError
+from .gpubox_mmap import MWAXGpuboxReader, read_fits_hdus, read_fits_table
+from .metadata_cache import add_prefix
+from .mwalib import CBaselineS, CCoarseChannelS, CTimeStepS, c_struct_dtype
+from .voltage_mmap import LEGACY_DAT_FILENAME_RE, MWAX_SUBFILE_FILENAME_RE
+
+COARSE_CHAN_WIDTH_HZ = 1_280_000
+
+# Voltage data layout of MWAX VCS (.sub) files: 8 second timesteps of 160 blocks of 64000 (8 bit real, 8 bit
+# imaginary) samples per rf_input, after a 4096 byte header and a delay block the size of one voltage block
+MWAX_VCS_TIMESTEP_DURATION_MS = 8000
+MWAX_VCS_NUM_VOLTAGE_BLOCKS_PER_TIMESTEP = 160
+MWAX_VCS_NUM_SAMPLES_PER_VOLTAGE_BLOCK = 64000
+MWAX_VCS_SAMPLE_SIZE_BYTES = 2
+MWAX_VCS_HEADER_SIZE_BYTES = 4096
+
+# Voltage data layout of legacy recombined VCS (.dat) files: one second of 10000 samples of 128 fine channels per
+# rf_input (4 bit real, 4 bit imaginary), with no header or delay block
+LEGACY_VCS_NUM_SAMPLES_PER_SECOND = 10000
+LEGACY_VCS_NUM_FINE_CHANS = 128
+LEGACY_VCS_FINE_CHAN_WIDTH_HZ = 10_000
+
+# Fields of the rf_input table (see RFInput.get_rf_input_table), less the ones of variable width
+_RF_INPUT_FIELDS = [("input", np.uint32),
+                    ("ant", np.uint32),
+                    ("tile_id", np.uint32),
+                    ("electrical_length_m", np.float64),
+                    ("north_m", np.float64),
+                    ("east_m", np.float64),
+                    ("height_m", np.float64),
+                    ("vcs_order", np.uint32),
+                    ("subfile_order", np.uint32),
+                    ("flagged", bool),
+                    ("num_digital_gains", np.uint64),
+                    ("num_dipole_delays", np.uint64),
+                    ("num_dipole_gains", np.uint64),
+                    ("rec_number", np.uint32),
+                    ("rec_slot_number", np.uint32)]
+
+
+def get_legacy_vcs_order(rf_input: np.ndarray) -> np.ndarray:
+    """Returns the position of each rf_input (by its metafits Input number) in legacy VCS data"""
+    return (rf_input & 0xC0) | ((rf_input & 0x30) >> 4) | ((rf_input & 0x0F) << 2)
+
+
+def get_fine_chan_freqs_hz(coarse_chan_table: np.ndarray, num_fine_chans_per_coarse: int,
+                           fine_chan_width_hz: int) -> np.ndarray:
+    """Returns a float64 array of the centre frequency of each fine channel of each coarse channel in
+       coarse_chan_table (a table of the fields of CCoarseChannelS), in the same order"""
+    offsets = (np.arange(num_fine_chans_per_coarse) - num_fine_chans_per_coarse // 2) * float(fine_chan_width_hz)
+
+    return (coarse_chan_table["chan_centre_hz"].astype(np.float64)[:, np.newaxis] + offsets).ravel()
+
+
+def _get_timestep_table(times_ms: np.ndarray, gps_to_unix_offset_ms: int) -> np.ndarray:
+    """Returns a table of the fields of CTimeStepS for the GPS times (in ms)"""
+    table = np.zeros(len(times_ms), dtype=c_struct_dtype(CTimeStepS))
+    table["gps_time_ms"] = times_ms
+    table["unix_time_ms"] = times_ms + gps_to_unix_offset_ms
+
+    return table
+
+
+def _get_rf_input_state(metafits_filename: str, tile_data: np.ndarray, channel_positions: np.ndarray,
+                        mwa_version: MWAVersion) -> typing.Dict[str, np.ndarray]:
+    """Returns the rf_input arrays of the MetafitsMetadata state from the metafits TILEDATA table. rf_inputs are
+       ordered by subfile_order (antenna, then pol), and each one's digital gains are those of the observation's
+       coarse channels (channel_positions are the positions in the metafits CHANNELS of each, in sky order)."""
+    pols = np.char.strip(tile_data["Pol"].astype(str))
+    if not np.isin(pols, ["X", "Y"]).all():
+        raise PymwalibFitsError(f"{metafits_filename}: TILEDATA Pol must be X or Y")
+
+    subfile_order = tile_data["Antenna"].astype(np.uint32) * 2 + (pols == "Y")
+    order = np.argsort(subfile_order, kind="stable")
+    tile_data = tile_data[order]
+    pols = pols[order]
+    num_rf_inputs = len(tile_data)
+
+    tile_names = np.char.strip(tile_data["TileName"].astype(str))
+    table = np.zeros(num_rf_inputs, dtype=_RF_INPUT_FIELDS[:3] + [("tile_name", tile_names.dtype),
+                                                                  ("pol", pols.dtype)] + _RF_INPUT_FIELDS[3:])
+    table["input"] = tile_data["Input"]
+    table["ant"] = tile_data["Antenna"]
+    table["tile_id"] = tile_data["Tile"]
+    table["tile_name"] = tile_names
+    table["pol"] = pols
+    table["north_m"] = tile_data["North"]
+    table["east_m"] = tile_data["East"]
+    table["height_m"] = tile_data["Height"]
+    table["subfile_order"] = subfile_order[order]
+    table["flagged"] = tile_data["Flag"] != 0
+    table["rec_number"] = tile_data["Rx"]
+    table["rec_slot_number"] = tile_data["Slot"]
+
+    # Lengths starting "EL_" are electrical lengths, others are physical lengths of coax
+    for index, length in enumerate(np.char.strip(tile_data["Length"].astype(str))):
+        if length.startswith("EL_"):
+            table["electrical_length_m"][index] = float(length[3:])
+        else:
+            table["electrical_length_m"][index] = float(length) * MWA_COAX_V_FACTOR
+
+    if "VCSOrder" in tile_data.dtype.names and mwa_version != MWAVersion.VCSLegacyRecombined:
+        table["vcs_order"] = tile_data["VCSOrder"]
+    else:
+        table["vcs_order"] = get_legacy_vcs_order(table["input"])
+
+    if channel_positions.size and channel_positions.max() >= tile_data["Gains"].shape[1]:
+        raise PymwalibFitsError(f"{metafits_filename}: TILEDATA Gains has fewer values than there are CHANNELS")
+    digital_gains = tile_data["Gains"][:, channel_positions].astype(np.float64) / 64.
+    dipole_delays = tile_data["Delays"].astype(np.uint32)
+    # A delay of 32 marks a dead dipole
+    dipole_gains = np.where(dipole_delays == 32, 0., 1.)
+
+    table["num_digital_gains"] = digital_gains.shape[1]
+    table["num_dipole_delays"] = dipole_delays.shape[1]
+    table["num_dipole_gains"] = dipole_gains.shape[1]
+
+    return {
+        "_rf_input_table": table,
+        "_rf_input_digital_gains": digital_gains.ravel(),
+        "_rf_input_dipole_delays": dipole_delays.ravel(),
+        "_rf_input_dipole_gains": dipole_gains.ravel(),
+    }
+
+
+def _get_antenna_table(rf_input_table: np.ndarray) -> np.ndarray:
+    """Returns the antenna table (see Antenna.get_antenna_table) of the rf_inputs, ordered by subfile_order"""
+    if len(rf_input_table) % 2 or (rf_input_table["subfile_order"] != np.arange(len(rf_input_table))).any():
+        raise PymwalibFitsError("TILEDATA must have an X and a Y rf_input for each of antennas 0 to N - 1")
+
+    rf_inputs_x = rf_input_table[0::2]
+    table = np.zeros(len(rf_inputs_x), dtype=[("ant", np.uint32),
+                                              ("tile_id", np.uint32),
+                                              ("tile_name", rf_input_table["tile_name"].dtype),
+                                              ("rfinput_x", np.uint64),
+                                              ("rfinput_y", np.uint64),
+                                              ("electrical_length_m", np.float64),
+                                              ("north_m", np.float64),
+                                              ("east_m", np.float64),
+                                              ("height_m", np.float64)])
+    for name in ("ant", "tile_id", "tile_name", "electrical_length_m", "north_m", "east_m", "height_m"):
+        table[name] = rf_inputs_x[name]
+    table["rfinput_x"] = np.arange(0, len(rf_input_table), 2)
+    table["rfinput_y"] = np.arange(1, len(rf_input_table), 2)
+
+    return table
+
+
+def get_metafits_state(metafits_filename: str,
+                       mwa_version: MWAVersion) -> typing.Tuple[dict, typing.Dict[str, np.ndarray]]:
+    """Returns the (scalars, arrays) of MetafitsMetadata._get_state() for the metafits and mwa_version, read from
+       its primary header and TILEDATA table"""
+    if mwa_version not in (MWAVersion.CorrMWAXv2, MWAVersion.VCSMWAXv2, MWAVersion.VCSLegacyRecombined):
+        raise PymwalibInvalidArgumentError(f"Reading metafits without mwalib does not support {mwa_version.name}")
+
+    hdus = read_fits_hdus(metafits_filename)
+    header = hdus[0].header
+    tile_data_hdus = [hdu for hdu in hdus[1:] if hdu.header.get("EXTNAME") == "TILEDATA"]
+    if not tile_data_hdus:
+        raise PymwalibFitsError(f"{metafits_filename} has no TILEDATA table")
+    tile_data = read_fits_table(metafits_filename, tile_data_hdus[0])
+
+    modes = {mode.name.upper(): mode for mode in MWAMode}
+    mode = modes.get(str(header.get("MODE")).upper())
+    if mode is None:
+        raise PymwalibFitsError(f"{metafits_filename}: unknown MODE {header.get('MODE')!r}")
+
+    # Coarse channels, in sky frequency order. CHANNELS lists the receiver channel numbers
+    channels = np.array([int(channel) for channel in str(header["CHANNELS"]).split(",")], dtype=np.int64)
+    channel_positions = np.argsort(channels, kind="stable")
+    coarse_chans = np.zeros(len(channels), dtype=c_struct_dtype(CCoarseChannelS))
+    coarse_chans["corr_chan_number"] = np.arange(len(channels))
+    coarse_chans["rec_chan_number"] = channels[channel_positions]
+    coarse_chans["gpubox_number"] = channels[channel_positions]
+    coarse_chans["chan_width_hz"] = COARSE_CHAN_WIDTH_HZ
+    coarse_chans["chan_centre_hz"] = coarse_chans["rec_chan_number"] * COARSE_CHAN_WIDTH_HZ
+    coarse_chans["chan_start_hz"] = coarse_chans["chan_centre_hz"] - COARSE_CHAN_WIDTH_HZ // 2
+    coarse_chans["chan_end_hz"] = coarse_chans["chan_centre_hz"] + COARSE_CHAN_WIDTH_HZ // 2
+
+    corr_fine_chan_width_hz = int(round(header["FINECHAN"] * 1000))
+    corr_int_time_ms = int(round(header["INTTIME"] * 1000))
+    if mwa_version == MWAVersion.VCSLegacyRecombined:
+        volt_fine_chan_width_hz, num_volt_fine_chans_per_coarse = LEGACY_VCS_FINE_CHAN_WIDTH_HZ, \
+            LEGACY_VCS_NUM_FINE_CHANS
+    else:
+        volt_fine_chan_width_hz, num_volt_fine_chans_per_coarse = COARSE_CHAN_WIDTH_HZ, 1
+
+    # Times. DATE-OBS is the (UTC) scheduled start, and GPSTIME the same in GPS seconds
+    sched_start_utc = datetime.fromisoformat(header["DATE-OBS"])
+    sched_duration_ms = int(header["EXPOSURE"]) * 1000
+    sched_start_gps_time_ms = int(header["GPSTIME"]) * 1000
+    sched_start_unix_time_ms = int(round(sched_start_utc.replace(tzinfo=timezone.utc).timestamp() * 1000))
+    quack_time_duration_ms = int(round(header.get("QUACKTIM", 0.) * 1000))
+    if "GOODTIME" in header:
+        good_time_unix_ms = int(round(header["GOODTIME"] * 1000))
+    else:
+        good_time_unix_ms = sched_start_unix_time_ms + quack_time_duration_ms
+    gps_to_unix_offset_ms = sched_start_unix_time_ms - sched_start_gps_time_ms
+
+    if mwa_version == MWAVersion.CorrMWAXv2:
+        timestep_duration_ms = corr_int_time_ms
+    elif mwa_version == MWAVersion.VCSMWAXv2:
+        timestep_duration_ms = MWAX_VCS_TIMESTEP_DURATION_MS
+    else:
+        timestep_duration_ms = 1000
+    metafits_timesteps = _get_timestep_table(
+        np.arange(sched_start_gps_time_ms, sched_start_gps_time_ms + sched_duration_ms, timestep_duration_ms,
+                  dtype=np.uint64), gps_to_unix_offset_ms)
+
+    arrays = _get_rf_input_state(metafits_filename, tile_data, channel_positions, mwa_version)
+    arrays["_antenna_table"] = _get_antenna_table(arrays["_rf_input_table"])
+    num_ants = len(arrays["_antenna_table"])
+    ant1_index, ant2_index = np.triu_indices(num_ants)
+    arrays["_baseline_table"] = np.zeros(len(ant1_index), dtype=c_struct_dtype(CBaselineS))
+    arrays["_baseline_table"]["ant1_index"] = ant1_index
+    arrays["_baseline_table"]["ant2_index"] = ant2_index
+    arrays["_metafits_timestep_table"] = metafits_timesteps
+    arrays["_metafits_coarse_chan_table"] = coarse_chans
+    if mwa_version == MWAVersion.CorrMWAXv2:
+        arrays["_metafits_fine_chan_freqs_hz"] = get_fine_chan_freqs_hz(
+            coarse_chans, COARSE_CHAN_WIDTH_HZ // corr_fine_chan_width_hz, corr_fine_chan_width_hz)
+    else:
+        arrays["_metafits_fine_chan_freqs_hz"] = get_fine_chan_freqs_hz(
+            coarse_chans, num_volt_fine_chans_per_coarse, volt_fine_chan_width_hz)
+
+    receivers = [int(receiver) for receiver in str(header.get("RECVRS", "")).split(",") if receiver.strip()]
+    delays = [int(delay) for delay in str(header.get("DELAYS", "")).split(",") if delay.strip()]
+    alt_deg = float(header["ALTITUDE"])
+    lst_deg = float(header["LST"])
+
+    scalars = {
+        "mwa_version": mwa_version.value,
+        "obs_id": int(header["GPSTIME"]),
+        "global_analogue_attenuation_db": float(header.get("ATTEN_DB", 0.)),
+        "ra_tile_pointing_deg": float(header["RA"]),
+        "dec_tile_pointing_deg": float(header["DEC"]),
+        "ra_phase_center_deg": float(header.get("RAPHASE", math.nan)),
+        "dec_phase_center_deg": float(header.get("DECPHASE", math.nan)),
+        "az_deg": float(header["AZIMUTH"]),
+        "alt_deg": alt_deg,
+        "za_deg": 90. - alt_deg,
+        "az_rad": math.radians(header["AZIMUTH"]),
+        "alt_rad": math.radians(alt_deg),
+        "za_rad": math.radians(90. - alt_deg),
+        "sun_alt_deg": float(header.get("SUN-ALT", math.nan)),
+        "sun_distance_deg": float(header.get("SUN-DIST", math.nan)),
+        "moon_distance_deg": float(header.get("MOONDIST", math.nan)),
+        "jupiter_distance_deg": float(header.get("JUP-DIST", math.nan)),
+        "lst_deg": lst_deg,
+        "lst_rad": math.radians(lst_deg),
+        "hour_angle_string": str(header.get("HA", "")),
+        "grid_name": str(header.get("GRIDNAME", "")),
+        "grid_number": int(header.get("GRIDNUM", 0)),
+        "creator": str(header.get("CREATOR", "")),
+        "project_id": str(header.get("PROJECT", "")),
+        "obs_name": str(header.get("FILENAME", "")),
+        "mode": mode.value,
+        "geometric_delays_applied": int(header.get("GEODEL", 0)),
+        "cable_delays_applied": int(header.get("CABLEDEL", 0)),
+        "calibration_delays_and_gains_applied": bool(header.get("CALIBDEL", False)),
+        "corr_fine_chan_width_hz": corr_fine_chan_width_hz,
+        "corr_int_time_ms": corr_int_time_ms,
+        "corr_raw_scale_factor": float(header.get("RAWSCALE", 1.)),
+        "num_corr_fine_chans_per_coarse": COARSE_CHAN_WIDTH_HZ // corr_fine_chan_width_hz,
+        "volt_fine_chan_width_hz": volt_fine_chan_width_hz,
+        "num_volt_fine_chans_per_coarse": num_volt_fine_chans_per_coarse,
+        "num_receivers": len(receivers),
+        "receivers": receivers,
+        "num_delays": len(delays),
+        "delays": delays,
+        "calibrator": bool(header.get("CALIBRAT", False)),
+        "calibrator_source": str(header.get("CALIBSRC", "")),
+        "sched_start_utc": sched_start_utc.isoformat(),
+        "sched_end_utc": (sched_start_utc + timedelta(milliseconds=sched_duration_ms)).isoformat(),
+        "sched_start_mjd": float(header["MJD"]),
+        "sched_end_mjd": float(header["MJD"]) + sched_duration_ms / 86_400_000.,
+        "sched_start_unix_time_ms": sched_start_unix_time_ms,
+        "sched_end_unix_time_ms": sched_start_unix_time_ms + sched_duration_ms,
+        "sched_start_gps_time_ms": sched_start_gps_time_ms,
+        "sched_end_gps_time_ms": sched_start_gps_time_ms + sched_duration_ms,
+        "sched_duration_ms": sched_duration_ms,
+        "dut1": float(header.get("DUT1", 0.)),
+        "quack_time_duration_ms": quack_time_duration_ms,
+        "good_time_unix_ms": good_time_unix_ms,
+        "good_time_gps_ms": good_time_unix_ms - gps_to_unix_offset_ms,
+        "num_ants": num_ants,
+        "num_rf_inputs": len(arrays["_rf_input_table"]),
+        "num_ant_pols": 2,
+        "num_baselines": len(ant1_index),
+        "num_visibility_pols": 4,
+        "num_metafits_timesteps": len(metafits_timesteps),
+        "num_metafits_coarse_chans": len(coarse_chans),
+        "num_metafits_fine_chan_freqs": len(arrays["_metafits_fine_chan_freqs_hz"]),
+        "obs_bandwidth_hz": len(coarse_chans) * COARSE_CHAN_WIDTH_HZ,
+        "coarse_chan_width_hz": COARSE_CHAN_WIDTH_HZ,
+        "centre_freq_hz": int(round(float(header["FREQCENT"]) * 1_000_000)),
+        "metafits_filename": metafits_filename,
+    }
+
+    return scalars, arrays
+
+
+def _get_first_run(mask: np.ndarray) -> np.ndarray:
+    """Returns the indices of the first run of consecutive True values in mask"""
+    indices = np.flatnonzero(mask)
+    if not indices.size:
+        return indices
+
+    run_end = np.flatnonzero(np.diff(indices) != 1)
+    return indices[:run_end[0] + 1] if run_end.size else indices
+
+
+def _get_common_state(metafits_scalars: dict, metafits_arrays: typing.Dict[str, np.ndarray],
+                      data_times_ms: typing.Iterable[typing.Tuple[int, int]],
+                      timestep_duration_ms: int) -> typing.Tuple[dict, typing.Dict[str, np.ndarray]]:
+    """Returns the scalars and arrays shared by the correlator and voltage metadata, given the (GPS time in ms,
+       receiver channel number) of each timestep and coarse channel with data. The timesteps run from the
+       scheduled start (or the first data, if earlier) to the scheduled end (or the end of the last data), every
+       timestep_duration_ms; the coarse channels are the metafits ones."""
+    coarse_chans = metafits_arrays["_metafits_coarse_chan_table"]
+    sched_start_gps_time_ms = metafits_scalars["sched_start_gps_time_ms"]
+    sched_end_gps_time_ms = metafits_scalars["sched_end_gps_time_ms"]
+    gps_to_unix_offset_ms = metafits_scalars["sched_start_unix_time_ms"] - sched_start_gps_time_ms
+
+    data_times_ms = sorted(set(data_times_ms))
+    for gps_time_ms, rec_chan_number in data_times_ms:
+        if (gps_time_ms - sched_start_gps_time_ms) % timestep_duration_ms:
+            raise PymwalibInvalidArgumentError(f"Data at GPS time {gps_time_ms / 1000.} is not on a "
+                                               f"{timestep_duration_ms} ms timestep boundary from the scheduled start")
+        if rec_chan_number not in coarse_chans["rec_chan_number"]:
+            raise PymwalibInvalidArgumentError(f"Receiver channel {rec_chan_number} is not in the metafits CHANNELS")
+
+    first_gps_time_ms = min([sched_start_gps_time_ms] + [time_ms for time_ms, _ in data_times_ms])
+    end_gps_time_ms = max([sched_end_gps_time_ms] + [time_ms + timestep_duration_ms for time_ms, _ in data_times_ms])
+    timesteps = _get_timestep_table(np.arange(first_gps_time_ms, end_gps_time_ms, timestep_duration_ms,
+                                              dtype=np.uint64), gps_to_unix_offset_ms)
+
+    # has_data[t, c] is True if there is data for timestep t and coarse channel c
+    has_data = np.zeros((len(timesteps), len(coarse_chans)), dtype=bool)
+    for gps_time_ms, rec_chan_number in data_times_ms:
+        has_data[(gps_time_ms - first_gps_time_ms) // timestep_duration_ms,
+                 int(np.flatnonzero(coarse_chans["rec_chan_number"] == rec_chan_number)[0])] = True
+
+    provided_timesteps = np.flatnonzero(has_data.any(axis=1))
+    provided_coarse_chans = np.flatnonzero(has_data.any(axis=0))
+
+    # As in mwalib, the common timesteps are the first run of consecutive timesteps with data for every provided
+    # coarse channel, and the common good timesteps the same from the first timestep after the quack time. The
+    # common (good) coarse channels are the provided ones if there are any common (good) timesteps.
+    has_all_data = has_data[:, provided_coarse_chans].all(axis=1) & has_data.any(axis=1)
+    common_timesteps = _get_first_run(has_all_data)
+    good_timesteps = _get_first_run(has_all_data & (timesteps["unix_time_ms"] >= metafits_scalars["good_time_unix_ms"]))
+    common_coarse_chans = provided_coarse_chans if common_timesteps.size else common_timesteps
+    good_coarse_chans = provided_coarse_chans if good_timesteps.size else good_timesteps
+
+    scalars = {
+        "num_timesteps": len(timesteps),
+        "num_coarse_chans": len(coarse_chans),
+        "num_provided_timesteps": len(provided_timesteps),
+        "num_provided_coarse_chans": len(provided_coarse_chans),
+        "provided_timestep_indices": provided_timesteps.tolist(),
+        "provided_coarse_chan_indices": provided_coarse_chans.tolist(),
+    }
+
+    for prefix, timestep_indices, coarse_chan_indices in (("common", common_timesteps, common_coarse_chans),
+                                                          ("common_good", good_timesteps, good_coarse_chans)):
+        if timestep_indices.size and coarse_chan_indices.size:
+            start_unix_time_ms = int(timesteps["unix_time_ms"][timestep_indices[0]])
+            end_unix_time_ms = int(timesteps["unix_time_ms"][timestep_indices[-1]]) + timestep_duration_ms
+        else:
+            start_unix_time_ms = end_unix_time_ms = 0
+
+        scalars[f"num_{prefix}_timesteps"] = len(timestep_indices)
+        scalars[f"num_{prefix}_coarse_chans"] = len(coarse_chan_indices)
+        scalars[f"{prefix}_start_unix_time_ms"] = start_unix_time_ms
+        scalars[f"{prefix}_end_unix_time_ms"] = end_unix_time_ms
+        scalars[f"{prefix}_start_gps_time_ms"] = start_unix_time_ms - gps_to_unix_offset_ms if start_unix_time_ms else 0
+        scalars[f"{prefix}_end_gps_time_ms"] = end_unix_time_ms - gps_to_unix_offset_ms if end_unix_time_ms else 0
+        scalars[f"{prefix}_duration_ms"] = end_unix_time_ms - start_unix_time_ms
+        scalars[f"{prefix}_bandwidth_hz"] = len(coarse_chan_indices) * COARSE_CHAN_WIDTH_HZ
+        scalars[f"{prefix}_timestep_indices"] = timestep_indices.tolist()
+        scalars[f"{prefix}_coarse_chan_indices"] = coarse_chan_indices.tolist()
+
+    arrays = add_prefix("metafits_context", metafits_arrays)
+    arrays["coarse_channels"] = coarse_chans
+    arrays["timesteps"] = timesteps
+
+    return scalars, arrays
+
+
+def get_correlator_state(metafits_filename: str,
+                         gpubox_reader: MWAXGpuboxReader) -> typing.Tuple[dict, typing.Dict[str, np.ndarray]]:
+    """Returns the (scalars, arrays) of CorrelatorContext._get_state() for the metafits and the (MWAX) gpubox
+       files of gpubox_reader, from the metafits and the gpubox file headers"""
+    for gpubox_file in gpubox_reader.gpubox_files:
+        if gpubox_file.primary_header.get("CORR_VER") != 2:
+            raise PymwalibInvalidArgumentError(f"{gpubox_file.filename} is not an MWAX (CORR_VER = 2) gpubox file")
+
+    metafits_scalars, metafits_arrays = get_metafits_state(metafits_filename, MWAVersion.CorrMWAXv2)
+    gps_to_unix_offset_ms = metafits_scalars["sched_start_unix_time_ms"] - metafits_scalars["sched_start_gps_time_ms"]
+
+    data_times_ms = [(unix_time_ms - gps_to_unix_offset_ms, gpubox_file.rec_chan_number)
+                     for gpubox_file in gpubox_reader.gpubox_files for unix_time_ms in gpubox_file.unix_times_ms]
+    scalars, arrays = _get_common_state(metafits_scalars, metafits_arrays, data_times_ms,
+                                        metafits_scalars["corr_int_time_ms"])
+
+    num_timestep_coarse_chan_floats = metafits_scalars["num_baselines"] * \
+        metafits_scalars["num_corr_fine_chans_per_coarse"] * metafits_scalars["num_visibility_pols"] * 2
+
+    scalars["mwa_version"] = MWAVersion.CorrMWAXv2.value
+    scalars["num_timestep_coarse_chan_floats"] = num_timestep_coarse_chan_floats
+    scalars["num_timestep_coarse_chan_bytes"] = num_timestep_coarse_chan_floats * 4
+    scalars["num_gpubox_files"] = len(gpubox_reader.gpubox_files)
+    scalars["metafits_context"] = metafits_scalars
+
+    return scalars, arrays
+
+
+def get_voltage_state(metafits_filename: str,
+                      voltage_filenames: list) -> typing.Tuple[dict, typing.Dict[str, np.ndarray]]:
+    """Returns the (scalars, arrays) of VoltageContext._get_state() for the metafits and voltage files, from the
+       metafits and the names of the voltage files, which must all be MWAX VCS (.sub) or legacy recombined VCS
+       (.dat) files"""
+    names = [os.path.basename(filename) for filename in voltage_filenames]
+    if names and all(MWAX_SUBFILE_FILENAME_RE.match(name) for name in names):
+        mwa_version, filename_re = MWAVersion.VCSMWAXv2, MWAX_SUBFILE_FILENAME_RE
+    elif names and all(LEGACY_DAT_FILENAME_RE.match(name) for name in names):
+        mwa_version, filename_re = MWAVersion.VCSLegacyRecombined, LEGACY_DAT_FILENAME_RE
+    else:
+        raise PymwalibInvalidArgumentError("voltage_filenames must all be MWAX VCS (.sub) files or all be legacy "
+                                           "recombined VCS (.dat) files")
+
+    metafits_scalars, metafits_arrays = get_metafits_state(metafits_filename, mwa_version)
+    num_rf_inputs = metafits_scalars["num_rf_inputs"]
+
+    if mwa_version == MWAVersion.VCSMWAXv2:
+        timestep_duration_ms = MWAX_VCS_TIMESTEP_DURATION_MS
+        sample_size_bytes = MWAX_VCS_SAMPLE_SIZE_BYTES
+        num_voltage_blocks_per_timestep = MWAX_VCS_NUM_VOLTAGE_BLOCKS_PER_TIMESTEP
+        num_samples_per_voltage_block = MWAX_VCS_NUM_SAMPLES_PER_VOLTAGE_BLOCK
+        voltage_block_size_bytes = num_samples_per_voltage_block * num_rf_inputs * sample_size_bytes
+        delay_block_size_bytes = voltage_block_size_bytes
+        data_file_header_size_bytes = MWAX_VCS_HEADER_SIZE_BYTES
+    else:
+        timestep_duration_ms = 1000
+        sample_size_bytes = 1
+        num_voltage_blocks_per_timestep = 1
+        num_samples_per_voltage_block = LEGACY_VCS_NUM_SAMPLES_PER_SECOND
+        voltage_block_size_bytes = num_samples_per_voltage_block * LEGACY_VCS_NUM_FINE_CHANS * num_rf_inputs * \
+            sample_size_bytes
+        delay_block_size_bytes = 0
+        data_file_header_size_bytes = 0
+
+    data_times_ms = []
+    for name in names:
+        match = filename_re.match(name)
+        data_times_ms.append((int(match.group("gps_time")) * 1000, int(match.group("rec_chan_number"))))
+    scalars, arrays = _get_common_state(metafits_scalars, metafits_arrays, data_times_ms, timestep_duration_ms)
+
+    # VoltageContext names its common (good) coarse channel lists without the _indices suffix
+    scalars["common_coarse_chans"] = scalars.pop("common_coarse_chan_indices")
+    scalars["common_good_coarse_chans"] = scalars.pop("common_good_coarse_chan_indices")
+
+    scalars["mwa_version"] = mwa_version.value
+    scalars["timestep_duration_ms"] = timestep_duration_ms
+    scalars["coarse_chan_width_hz"] = COARSE_CHAN_WIDTH_HZ
+    scalars["fine_chan_width_hz"] = metafits_scalars["volt_fine_chan_width_hz"]
+    scalars["num_fine_chans_per_coarse"] = metafits_scalars["num_volt_fine_chans_per_coarse"]
+    scalars["sample_size_bytes"] = sample_size_bytes
+    scalars["num_voltage_blocks_per_timestep"] = num_voltage_blocks_per_timestep
+    scalars["num_voltage_blocks_per_second"] = num_voltage_blocks_per_timestep * 1000 // timestep_duration_ms
+    scalars["num_samples_per_voltage_block"] = num_samples_per_voltage_block
+    scalars["voltage_block_size_bytes"] = voltage_block_size_bytes
+    scalars["delay_block_size_bytes"] = delay_block_size_bytes
+    scalars["data_file_header_size_bytes"] = data_file_header_size_bytes
+    scalars["expected_voltage_data_file_size_bytes"] = data_file_header_size_bytes + delay_block_size_bytes + \
+        num_voltage_blocks_per_timestep * voltage_block_size_bytes
+    scalars["metafits_context"] = metafits_scalars
+
+    return scalars, arrays
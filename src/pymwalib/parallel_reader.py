@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+#
+# ParallelReader and ProcessPoolReader: run reads on pools of threads (sharing one context) or processes
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import os
+import threading
+import typing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing.util import Finalize
+
+import numpy as np
+
+from .errors import PymwalibNoDataForTimestepAndCoarseChannelError, PymwalibInvalidArgumentError
+
+READ_METHODS = ("read_by_baseline", "read_by_frequency", "read_file", "read_second")
+
+# The context and read buffers of a ProcessPoolReader worker process
+_worker_context = None
+_worker_buffers = {}
+
+
+def _get_cached_buffer(buffers: dict, context, read: str, item: tuple) -> np.ndarray:
+    """Returns the buffer in buffers for the read method, creating it on first use"""
+    if read == "read_second":
+        key = (read, item[1])
+    else:
+        key = read
+
+    buffer = buffers.get(key)
+
+    if buffer is None:
+        if read == "read_second":
+            buffer = context._get_second_buffer(item[1], None)
+        elif read == "read_file":
+            buffer = context._get_file_buffer(None)
+        else:
+            buffer = context._get_hdu_buffer(None)
+        buffers[key] = buffer
+
+    return buffer
+
+
+def _init_worker(context_class, metafits_filename: str, data_filenames: list, context_kwargs: dict):
+    """Runs once in each ProcessPoolReader worker process to open the context it will keep for all its tasks,
+       and to release it when the worker exits"""
+    global _worker_context
+    _worker_context = context_class(metafits_filename, data_filenames, **context_kwargs)
+    Finalize(None, _release_worker, exitpriority=10)
+
+
+def _release_worker():
+    """Frees the worker process' context (and its mwalib memory) and read buffers as the worker exits"""
+    global _worker_context
+    if _worker_context is not None:
+        _worker_context.__exit__(None, None, None)
+        _worker_context = None
+    _worker_buffers.clear()
+
+
+def _run_worker_task(func, read: str, item: tuple):
+    """Runs one ProcessPoolReader task against the worker process' context"""
+    buffer = _get_cached_buffer(_worker_buffers, _worker_context, read, item)
+    try:
+        data = getattr(_worker_context, read)(*item, out=buffer)
+    except PymwalibNoDataForTimestepAndCoarseChannelError:
+        return None
+    return func(*item, data)
+
+
+class ParallelReader:
+    """
+    Runs reads against one CorrelatorContext or VoltageContext on a pool of threads.
+
+    Thread safety
+    -------------
+    ctypes releases the GIL for the duration of each mwalib read call and no lock is taken around them, so one
+    context serves reads from many threads at once. This relies on mwalib's read methods (e.g.
+    CorrelatorContext::read_by_baseline) taking the context by shared reference (&self) and opening the data file
+    themselves on each call, so they only read from the context; test_parallel_reader_concurrent_reads checks
+    that concurrent reads of the same HDUs match serial ones. The "mmap" backends only read from their memory
+    maps, which are opened under a lock.
+
+    Each worker thread reads into its own buffer. The one piece of shared mutable state on the read path is the
+    HDU / file cache (hdu_cache_bytes / file_cache_bytes), which is locked, and which reads a key only once when
+    several threads miss on it together (see HDUCache.read).
+
+    The context must not be freed (i.e. its with block exited) while reads are in flight. All of the methods
+    below wait for their reads to finish before returning, so use the reader inside the context's with block.
+
+    Items are the positional arguments of the read method:
+      read_by_baseline / read_by_frequency / read_file : (timestep_index, coarse_chan_index)
+      read_second                                     : (gps_second_start, gps_second_count, coarse_chan_index)
+
+    """
+
+    def __init__(self, context, max_workers: typing.Optional[int] = None):
+        """Initialise the reader with a context and the number of threads to use (default is the number of cpus)"""
+        self.context = context
+        self.max_workers: int = max_workers if max_workers else os.cpu_count()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pymwalib_reader")
+        self._thread_local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Wait for any outstanding reads and shut down the thread pool"""
+        self._executor.shutdown(wait=True)
+
+    def _get_read_method(self, read: str):
+        if read not in READ_METHODS or not hasattr(self.context, read):
+            raise PymwalibInvalidArgumentError(f"{read!r} is not a read method of {type(self.context).__name__}")
+        return getattr(self.context, read)
+
+    def _get_thread_buffer(self, read: str, item: tuple) -> np.ndarray:
+        """Returns this thread's buffer for the read method, creating it on first use"""
+        buffers = self._thread_local.__dict__.setdefault("buffers", {})
+
+        return _get_cached_buffer(buffers, self.context, read, item)
+
+    def map(self, func, items: typing.Iterable[tuple], read: str = "read_by_baseline") -> list:
+        """For each item, read the data in a worker thread then call func(*item, data) in that same thread.
+
+           data is the calling thread's own buffer, so it is only valid until func returns: reduce it or copy
+           it. Returns the results of func in the order of items, with None for items which had no data."""
+        read_method = self._get_read_method(read)
+
+        def task(item: tuple):
+            buffer = self._get_thread_buffer(read, item)
+            try:
+                data = read_method(*item, out=buffer)
+            except PymwalibNoDataForTimestepAndCoarseChannelError:
+                return None
+            return func(*item, data)
+
+        return list(self._executor.map(task, items))
+
+    def read_into(self, items: typing.Iterable[tuple], outs: typing.Iterable[np.ndarray],
+                  read: str = "read_by_baseline") -> list:
+        """Read each item concurrently into the matching caller supplied buffer in outs. Returns a list of
+           booleans in the order of items, which are False where there was no data."""
+        read_method = self._get_read_method(read)
+
+        def task(item: tuple, out: np.ndarray) -> bool:
+            try:
+                read_method(*item, out=out)
+            except PymwalibNoDataForTimestepAndCoarseChannelError:
+                return False
+            return True
+
+        return list(self._executor.map(task, items, outs))
+
+
+class ProcessPoolReader:
+    """
+    Runs reads on a pool of worker processes, for reductions which need more than one python process.
+
+    Each worker opens its own context (context_class(metafits_filename, data_filenames, **context_kwargs)) once,
+    when it starts, and keeps it and its read buffers for every task it receives, so the metafits and data files
+    are only parsed and validated once per worker rather than once per task. The context is freed when the worker
+    exits (on close()). Tasks only carry the read method's arguments (see ParallelReader for the items each read
+    method takes).
+
+    func, its arguments and its results are sent between processes, so func must be picklable (e.g. a module
+    level function) and should return something small, such as a reduction of the data.
+
+    """
+
+    def __init__(self, context_class, metafits_filename: str, data_filenames: list,
+                 max_workers: typing.Optional[int] = None, context_kwargs: typing.Optional[dict] = None):
+        """Initialise the pool. context_class is CorrelatorContext or VoltageContext, and context_kwargs its
+           optional keyword arguments (e.g. cache_dir, backend or hdu_cache_bytes), which must be picklable."""
+        self.max_workers: int = max_workers if max_workers else os.cpu_count()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             initializer=_init_worker,
+                                             initargs=(context_class, metafits_filename, list(data_filenames),
+                                                       dict(context_kwargs or {})))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Wait for any outstanding tasks and shut down the worker processes"""
+        self._executor.shutdown(wait=True)
+
+    def map(self, func, items: typing.Iterable[tuple], read: str = "read_by_baseline", chunksize: int = 1) -> list:
+        """For each item, read the data in a worker process and call func(*item, data) there. Returns the results
+           of func in the order of items, with None for items which had no data. chunksize items are sent to a
+           worker at a time."""
+        if read not in READ_METHODS:
+            raise PymwalibInvalidArgumentError(f"{read!r} is not a read method")
+
+        return list(self._executor.map(partial(_run_worker_task, func, read), items, chunksize=chunksize))
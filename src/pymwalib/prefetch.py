@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# prefetch: read ahead on a background thread into a ring of recycled buffers
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import queue
+import threading
+import typing
+
+import numpy as np
+
+from .errors import PymwalibInvalidArgumentError
+
+# Put on the filled queue by the reader thread once it has read every item
+_DONE = object()
+
+
+class _ReadError:
+    """Carries an exception raised in the reader thread back to the consumer"""
+
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+class Prefetcher:
+    """
+    Iterates over (item, buffer) for each item in items, reading up to prefetch items ahead on a background thread
+    so reading overlaps with whatever the consumer does with each buffer.
+
+    read(item, buffer) fills buffer with the data for item and returns False if the item has no data, in which
+    case it is skipped. The prefetch + 1 buffers come from make_buffer() and are recycled: each buffer yielded is
+    only valid until the next item is requested, so copy anything which needs to outlive that.
+
+    The reader thread is stopped (after any read in progress finishes) when iteration ends, including when the
+    consumer breaks out of the loop early or raises. Exceptions raised by read are re-raised in the consumer.
+
+    """
+
+    def __init__(self, read: typing.Callable[[tuple, np.ndarray], bool], items: typing.Iterable[tuple],
+                 make_buffer: typing.Callable[[], np.ndarray], prefetch: int = 2):
+        """Initialise with the read function, the items to read, a function creating one buffer and the number of
+           items to read ahead"""
+        if prefetch < 1:
+            raise PymwalibInvalidArgumentError(f"prefetch must be at least 1, not {prefetch}")
+
+        self._read = read
+        self._items = items
+        self._free_buffers: queue.Queue = queue.Queue()
+        self._filled_buffers: queue.Queue = queue.Queue()
+        self._stop = threading.Event()
+
+        for _ in range(prefetch + 1):
+            self._free_buffers.put(make_buffer())
+
+    def _run(self):
+        """Body of the reader thread"""
+        try:
+            for item in self._items:
+                buffer = self._free_buffers.get()
+                if self._stop.is_set():
+                    break
+                if self._read(item, buffer):
+                    self._filled_buffers.put((item, buffer))
+                else:
+                    self._free_buffers.put(buffer)
+        except BaseException as exception:
+            self._filled_buffers.put(_ReadError(exception))
+        finally:
+            self._filled_buffers.put(_DONE)
+
+    def __iter__(self) -> typing.Iterator[typing.Tuple[tuple, np.ndarray]]:
+        thread = threading.Thread(target=self._run, name="pymwalib_prefetch", daemon=True)
+        thread.start()
+        buffer = None
+
+        try:
+            while True:
+                if buffer is not None:
+                    self._free_buffers.put(buffer)
+                    buffer = None
+
+                filled = self._filled_buffers.get()
+                if filled is _DONE:
+                    break
+                if isinstance(filled, _ReadError):
+                    raise filled.exception
+
+                item, buffer = filled
+                yield item, buffer
+        finally:
+            # Wake the reader thread if it is waiting for a free buffer, so it can see it should stop
+            self._stop.set()
+            self._free_buffers.put(buffer)
+            thread.join()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+#
+# record_list: base class for sequences of records backed by numpy columns
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import typing
+from collections.abc import Sequence
+
+import numpy as np
+
+
+class RecordList(Sequence):
+    """
+    A read-only sequence of records stored as one numpy structured array rather than one python object per record.
+
+    Indexing with an int builds a single record (an instance of _record_class) on demand. Indexing with a slice,
+    an array of indices or a boolean mask returns a new list of the same type holding just those records, which
+    keep their original index. Each field is also available as a read-only numpy column, e.g. timesteps.gps_time_ms
+    or baselines.ant1_index, as is index.
+
+    Subclasses set _record_class, whose constructor must take index followed by the fields of the table in order.
+
+    """
+    _record_class = None
+
+    def __init__(self, table: np.ndarray, index: typing.Optional[np.ndarray] = None):
+        """Initialise the list from a numpy structured array and (for a selection) the original index of each row"""
+        self._table: np.ndarray = table.view()
+        self._table.flags.writeable = False
+        self._index: np.ndarray = np.arange(len(table)) if index is None else index
+        self._index.flags.writeable = False
+
+    @property
+    def table(self) -> np.ndarray:
+        """The read-only numpy structured array holding every field of every record"""
+        return self._table
+
+    @property
+    def index(self) -> np.ndarray:
+        """The read-only array of the original index of each record"""
+        return self._index
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        """Returns the read-only numpy column for the field name"""
+        if not name.startswith("_") and name in self._table.dtype.names:
+            return self._table[name]
+        raise AttributeError(f"{self.__class__.__name__!r} object has no attribute {name!r}")
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._record_class(int(self._index[key]), *self._table[key].item())
+        return self.__class__(self._table[key], self._index[key])
+
+    def __iter__(self):
+        for index, row in zip(self._index.tolist(), self._table.tolist()):
+            yield self._record_class(index, *row)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, RecordList):
+            return (self._record_class is other._record_class
+                    and np.array_equal(self._index, other._index)
+                    and np.array_equal(self._table, other._table))
+        return NotImplemented
+
+    def __repr__(self):
+        """Returns a representation of the class"""
+        return repr(list(self))
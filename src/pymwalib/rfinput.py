@@ -6,10 +6,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
-from numpy import double
-from .mwalib import CRFInputS, CMetafitsMetadataS
+import ctypes as ct
 from typing import List
 
+import numpy as np
+from numpy import double
+from .mwalib import CMetafitsMetadataS, c_struct_array_to_numpy, copy_c_arrays, decode_c_strings
+
 
 class RFInput:
     """
@@ -94,47 +97,93 @@ class RFInput:
                f"rec_slot_number: {self.rec_slot_number})"
 
     @staticmethod
-    def get_rf_inputs(metafits_metadata: CMetafitsMetadataS) -> List['RFInput']:
-        """Retrieve all of the rf_input metadata and populate a list of rf_inputs."""
-        # The return type of this function is in single quotes as it is a forward reference.
-        rf_inputs = []
+    def get_rf_input_table(metafits_metadata: CMetafitsMetadataS) -> tuple:
+        """Copy all of the rf_input metadata in bulk. Returns a tuple of a numpy structured array with one row per
+           rf_input (the fields of CRFInputS, with strings decoded and the per rf_input arrays removed) and
+           flattened numpy arrays of every rf_input's digital_gains, dipole_delays and dipole_gains."""
+        c_table = c_struct_array_to_numpy(metafits_metadata.rf_inputs, metafits_metadata.num_rf_inputs)
+        tile_names = decode_c_strings(c_table["tile_name"])
+        pols = decode_c_strings(c_table["pol"])
 
-        for rf_index in range(0, metafits_metadata.num_rf_inputs):
-            obj: CRFInputS = metafits_metadata.rf_inputs[rf_index]
+        table = np.empty(len(c_table), dtype=[("input", np.uint32),
+                                              ("ant", np.uint32),
+                                              ("tile_id", np.uint32),
+                                              ("tile_name", tile_names.dtype),
+                                              ("pol", pols.dtype),
+                                              ("electrical_length_m", np.float64),
+                                              ("north_m", np.float64),
+                                              ("east_m", np.float64),
+                                              ("height_m", np.float64),
+                                              ("vcs_order", np.uint32),
+                                              ("subfile_order", np.uint32),
+                                              ("flagged", bool),
+                                              ("num_digital_gains", np.uint64),
+                                              ("num_dipole_delays", np.uint64),
+                                              ("num_dipole_gains", np.uint64),
+                                              ("rec_number", np.uint32),
+                                              ("rec_slot_number", np.uint32)])
+        for name in table.dtype.names:
+            table[name] = c_table[name]
+        table["tile_name"] = tile_names
+        table["pol"] = pols
 
-            digital_gains = []
-            for i in range(0, obj.num_digital_gains):
-                digital_gains.append(obj.digital_gains[i])
+        digital_gains = copy_c_arrays(c_table["digital_gains"], c_table["num_digital_gains"], ct.c_double)
+        dipole_delays = copy_c_arrays(c_table["dipole_delays"], c_table["num_dipole_delays"], ct.c_uint32)
+        dipole_gains = copy_c_arrays(c_table["dipole_gains"], c_table["num_dipole_gains"], ct.c_double)
 
-            dipole_delays = []
-            for j in range(0, obj.num_dipole_delays):
-                dipole_delays.append(obj.dipole_delays[j])
+        return table, digital_gains, dipole_delays, dipole_gains
 
-            dipole_gains = []
-            for k in range(0, obj.num_dipole_gains):
-                dipole_gains.append(obj.dipole_gains[k])
+    @staticmethod
+    def get_rf_inputs_from_table(rf_input_table: np.ndarray,
+                                 digital_gains: np.ndarray,
+                                 dipole_delays: np.ndarray,
+                                 dipole_gains: np.ndarray) -> List['RFInput']:
+        """Populate a list of rf_inputs from the arrays returned by get_rf_input_table()."""
+        # The return type of this function is in single quotes as it is a forward reference.
+        rf_inputs = []
+
+        digital_gains_end = np.cumsum(rf_input_table["num_digital_gains"]).tolist()
+        dipole_delays_end = np.cumsum(rf_input_table["num_dipole_delays"]).tolist()
+        dipole_gains_end = np.cumsum(rf_input_table["num_dipole_gains"]).tolist()
+        digital_gains = digital_gains.tolist()
+        dipole_delays = dipole_delays.tolist()
+        dipole_gains = dipole_gains.tolist()
+
+        for rf_index, obj in enumerate(rf_input_table.tolist()):
+            (input, ant, tile_id, tile_name, pol, electrical_length_m, north_m, east_m, height_m, vcs_order,
+             subfile_order, flagged, num_digital_gains, num_dipole_delays, num_dipole_gains, rec_number,
+             rec_slot_number) = obj
 
             # Populate all the fields
             rf_inputs.append(RFInput(rf_index,
-                                     obj.input,
-                                     obj.ant,
-                                     obj.tile_id,
-                                     obj.tile_name.decode("utf-8"),
-                                     obj.pol.decode("utf-8"),
-                                     obj.electrical_length_m,
-                                     obj.north_m,
-                                     obj.east_m,
-                                     obj.height_m,
-                                     obj.vcs_order,
-                                     obj.subfile_order,
-                                     obj.flagged,
-                                     digital_gains,
-                                     obj.num_digital_gains,
-                                     dipole_delays,
-                                     obj.num_dipole_delays,
-                                     dipole_gains,
-                                     obj.num_dipole_gains,
-                                     obj.rec_number,
-                                     obj.rec_slot_number))
+                                     input,
+                                     ant,
+                                     tile_id,
+                                     tile_name,
+                                     pol,
+                                     electrical_length_m,
+                                     north_m,
+                                     east_m,
+                                     height_m,
+                                     vcs_order,
+                                     subfile_order,
+                                     flagged,
+                                     digital_gains[digital_gains_end[rf_index] - num_digital_gains:
+                                                   digital_gains_end[rf_index]],
+                                     num_digital_gains,
+                                     dipole_delays[dipole_delays_end[rf_index] - num_dipole_delays:
+                                                   dipole_delays_end[rf_index]],
+                                     num_dipole_delays,
+                                     dipole_gains[dipole_gains_end[rf_index] - num_dipole_gains:
+                                                  dipole_gains_end[rf_index]],
+                                     num_dipole_gains,
+                                     rec_number,
+                                     rec_slot_number))
 
         return rf_inputs
+
+    @staticmethod
+    def get_rf_inputs(metafits_metadata: CMetafitsMetadataS) -> List['RFInput']:
+        """Retrieve all of the rf_input metadata and populate a list of rf_inputs."""
+        # The return type of this function is in single quotes as it is a forward reference.
+        return RFInput.get_rf_inputs_from_table(*RFInput.get_rf_input_table(metafits_metadata))
@@ -6,7 +6,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
-from .mwalib import CTimeStepS, CMetafitsMetadataS
+import numpy as np
+from .mwalib import CMetafitsMetadataS, c_struct_array_to_numpy
+from .record_list import RecordList
 
 
 class TimeStep:
@@ -25,6 +27,7 @@ class TimeStep:
         The GPS time (in milliseconds) of the start of this time step
 
     """
+    __slots__ = ("index", "unix_time_ms", "gps_time_ms")
 
     def __init__(self,
                  index: int,
@@ -43,31 +46,36 @@ class TimeStep:
                f"GPS time: {float(self.gps_time_ms) / 1000.})"
 
     @staticmethod
-    def get_metafits_timesteps(metafits_metadata: CMetafitsMetadataS) -> []:
-        """Retrieve all of the metafits timestep metadata and populate a list of metafits timesteps."""
-        timesteps = []
-
-        for i in range(0, metafits_metadata.num_metafits_timesteps):
-            obj: CTimeStepS = metafits_metadata.metafits_timesteps[i]
-
-            # Populate all the fields
-            timesteps.append(TimeStep(i,
-                                      obj.unix_time_ms,
-                                      obj.gps_time_ms))
+    def get_timesteps_from_table(timestep_table: np.ndarray) -> 'TimeStepList':
+        """Populate a list of timesteps from a numpy structured array of unix_time_ms and gps_time_ms."""
+        # The return type of this function is in single quotes as it is a forward reference.
+        return TimeStepList(timestep_table)
 
-        return timesteps
+    @staticmethod
+    def get_metafits_timesteps(metafits_metadata: CMetafitsMetadataS) -> 'TimeStepList':
+        """Retrieve all of the metafits timestep metadata and populate a list of metafits timesteps."""
+        return TimeStep.get_timesteps_from_table(
+            c_struct_array_to_numpy(metafits_metadata.metafits_timesteps, metafits_metadata.num_metafits_timesteps))
 
     @staticmethod
-    def get_correlator_or_voltage_timesteps(correlator_or_voltage_metadata) -> []:
+    def get_correlator_or_voltage_timesteps(correlator_or_voltage_metadata) -> 'TimeStepList':
         """Retrieve all of the timestep metadata and populate a list of timesteps."""
-        timesteps = []
+        return TimeStep.get_timesteps_from_table(
+            c_struct_array_to_numpy(correlator_or_voltage_metadata.timesteps,
+                                    correlator_or_voltage_metadata.num_timesteps))
 
-        for i in range(0, correlator_or_voltage_metadata.num_timesteps):
-            obj: CTimeStepS = correlator_or_voltage_metadata.timesteps[i]
 
-            # Populate all the fields
-            timesteps.append(TimeStep(i,
-                                      obj.unix_time_ms,
-                                      obj.gps_time_ms))
+class TimeStepList(RecordList):
+    """
+    A list of TimeStep stored as numpy columns. Indexing it returns a TimeStep. See RecordList.
 
-        return timesteps
+    Attributes
+    ----------
+    unix_time_ms : np.ndarray
+        The UNIX time (in milliseconds) of the start of each time step
+
+    gps_time_ms : np.ndarray
+        The GPS time (in milliseconds) of the start of each time step
+
+    """
+    _record_class = TimeStep
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+#
+# uvfits: single pass, streaming UVFITS writer for correlator observations
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import math
+import typing
+from datetime import datetime, timezone
+
+import numpy as np
+
+from .common import GeometricDelaysApplied
+from .constants import MWA_ALTITUDE_METRES, MWA_LATITUDE_RADIANS, MWA_LONGITUDE_RADIANS
+from .errors import PymwalibInvalidArgumentError
+from .gpubox_mmap import FITS_BLOCK_SIZE, FITS_CARD_SIZE
+
+SPEED_OF_LIGHT_M_PER_S = 299792458.0
+
+# Sidereal days per solar (UT1) day
+SIDEREAL_RATE = 1.00273790935
+
+# Julian date of the UNIX epoch
+UNIX_EPOCH_JD = 2440587.5
+
+# GPS time 0 (1980-01-06) as a UNIX time, and TAI - GPS, in seconds
+GPS_EPOCH_UNIX_S = 315964800
+TAI_MINUS_GPS_S = 19
+
+# WGS84 ellipsoid
+WGS84_SEMI_MAJOR_AXIS_M = 6378137.0
+WGS84_FLATTENING = 1.0 / 298.257223563
+
+# UVFITS pols are XX, YY, XY, YX (STOKES axis -5 to -8); these are their positions in an HDU's XX, XY, YX, YY
+UVFITS_POL_ORDER = [0, 3, 1, 2]
+
+# UU, VV, WW (seconds), BASELINE and DATE (Julian date, offset from PZERO5)
+GROUP_PARAMS = ("UU", "VV", "WW", "BASELINE", "DATE")
+
+
+def make_card(keyword: str, value=None, comment: typing.Optional[str] = None) -> bytes:
+    """Returns an 80 character FITS header card, with value (int, float, bool or str) in fixed format"""
+    if isinstance(value, bool):
+        value_str = f"{'T' if value else 'F':>20}"
+    elif isinstance(value, (int, np.integer)):
+        value_str = f"{value:>20}"
+    elif isinstance(value, (float, np.floating)):
+        value_str = f"{repr(float(value)).upper():>20}"
+    else:
+        value_str = f"'{str(value).replace(chr(39), chr(39) * 2):<8}'"
+
+    card = f"{keyword:<8}= {value_str}"
+    if comment:
+        card += f" / {comment}"
+
+    return card[:FITS_CARD_SIZE].ljust(FITS_CARD_SIZE).encode("ascii")
+
+
+def make_header(cards: typing.List[bytes]) -> bytes:
+    """Returns a FITS header of cards (see make_card), with an END card, padded with spaces to whole blocks"""
+    header = b"".join(cards) + b"END".ljust(FITS_CARD_SIZE)
+    return header.ljust(-(-len(header) // FITS_BLOCK_SIZE) * FITS_BLOCK_SIZE, b" ")
+
+
+def get_local_xyz(north_m, east_m, height_m, latitude_rad: float = MWA_LATITUDE_RADIANS) -> np.ndarray:
+    """Returns an (antenna,3) array of the local XYZ (X towards the meridian at the equator, Y east, Z the north
+       celestial pole) positions, in metres, of antennas at north_m, east_m, height_m from the array centre"""
+    north_m = np.asarray(north_m, dtype=np.float64)
+    height_m = np.asarray(height_m, dtype=np.float64)
+
+    return np.stack([-math.sin(latitude_rad) * north_m + math.cos(latitude_rad) * height_m,
+                     np.asarray(east_m, dtype=np.float64),
+                     math.cos(latitude_rad) * north_m + math.sin(latitude_rad) * height_m], axis=-1)
+
+
+def get_uvw(local_xyz: np.ndarray, hour_angle_rad: float, dec_rad: float) -> np.ndarray:
+    """Returns the (...,3) UVWs, in the units of local_xyz (a (...,3) array from get_local_xyz), towards the
+       direction at hour_angle_rad and dec_rad"""
+    x, y, z = local_xyz[..., 0], local_xyz[..., 1], local_xyz[..., 2]
+    sin_ha, cos_ha = math.sin(hour_angle_rad), math.cos(hour_angle_rad)
+    sin_dec, cos_dec = math.sin(dec_rad), math.cos(dec_rad)
+
+    return np.stack([sin_ha * x + cos_ha * y,
+                     -sin_dec * cos_ha * x + sin_dec * sin_ha * y + cos_dec * z,
+                     cos_dec * cos_ha * x - cos_dec * sin_ha * y + sin_dec * z], axis=-1)
+
+
+def get_hour_angle_dec_rad(az_rad: float, alt_rad: float, latitude_rad: float) -> typing.Tuple[float, float]:
+    """Returns the hour angle and declination, in radians, of the direction at az_rad (east of north) and alt_rad,
+       seen from latitude_rad"""
+    sin_dec = math.sin(alt_rad) * math.sin(latitude_rad) + math.cos(alt_rad) * math.cos(latitude_rad) * math.cos(az_rad)
+    hour_angle_rad = math.atan2(-math.sin(az_rad) * math.cos(alt_rad),
+                                math.cos(latitude_rad) * math.sin(alt_rad) -
+                                math.sin(latitude_rad) * math.cos(alt_rad) * math.cos(az_rad))
+
+    return hour_angle_rad, math.asin(max(-1.0, min(1.0, sin_dec)))
+
+
+def get_geocentric_xyz(latitude_rad: float, longitude_rad: float, height_m: float) -> np.ndarray:
+    """Returns the geocentric (ITRF) XYZ, in metres, of a WGS84 geodetic position"""
+    e2 = WGS84_FLATTENING * (2 - WGS84_FLATTENING)
+    radius = WGS84_SEMI_MAJOR_AXIS_M / math.sqrt(1 - e2 * math.sin(latitude_rad) ** 2)
+
+    return np.array([(radius + height_m) * math.cos(latitude_rad) * math.cos(longitude_rad),
+                     (radius + height_m) * math.cos(latitude_rad) * math.sin(longitude_rad),
+                     (radius * (1 - e2) + height_m) * math.sin(latitude_rad)])
+
+
+def get_gmst_deg(jd: float) -> float:
+    """Returns the Greenwich mean sidereal time, in degrees, at 0h UT1 of the day of Julian date jd (IAU 1982)"""
+    jd_midnight = math.floor(jd - 0.5) + 0.5
+    t = (jd_midnight - 2451545.0) / 36525
+    gmst_s = 24110.54841 + 8640184.812866 * t + 0.093104 * t ** 2 - 6.2e-6 * t ** 3
+
+    return (gmst_s / 240.0) % 360.0
+
+
+def get_lst_rad(unix_time_ms: float, longitude_rad: float = MWA_LONGITUDE_RADIANS) -> float:
+    """Returns the local (mean) sidereal time, in radians, at longitude_rad and UTC unix_time_ms"""
+    jd = unix_time_ms / 86400000.0 + UNIX_EPOCH_JD
+    day_fraction = (jd - 0.5) - math.floor(jd - 0.5)
+    gmst_deg = get_gmst_deg(jd) + day_fraction * 360.0 * SIDEREAL_RATE
+
+    return (math.radians(gmst_deg) + longitude_rad) % (2 * math.pi)
+
+
+def get_phasors(delta_w_s: np.ndarray, freqs_hz: np.ndarray) -> np.ndarray:
+    """Returns the (baseline,freq) complex64 exp(-2 pi i delta_w freq) which rotate the phase of visibilities by
+       delta_w_s (a (baseline,) array of w changes, in seconds) at each of freqs_hz"""
+    phases = -2 * np.pi * np.outer(delta_w_s, freqs_hz)
+    return np.exp(1j * phases).astype(np.complex64)
+
+
+def encode_baseline(ant1, ant2, num_ants: int):
+    """Returns the UVFITS BASELINE of 1 based antenna numbers ant1 and ant2 (ints or arrays): 256 * ant1 + ant2,
+       or 2048 * ant1 + ant2 + 65536 when there are more than 255 antennas"""
+    if num_ants > 255:
+        return 2048 * ant1 + ant2 + 65536
+    return 256 * ant1 + ant2
+
+
+def _get_antenna_table_hdu(context, ref_freq_hz: float, start_jd: float, iat_utc_s: int) -> bytes:
+    """Returns the header and data of the AIPS AN table"""
+    antenna_table = context.metafits_context.antenna_table
+    num_ants = len(antenna_table)
+
+    local_xyz = get_local_xyz(antenna_table["north_m"], antenna_table["east_m"], antenna_table["height_m"])
+    cos_lon, sin_lon = math.cos(MWA_LONGITUDE_RADIANS), math.sin(MWA_LONGITUDE_RADIANS)
+
+    rows = np.zeros(num_ants, dtype=[("ANNAME", "S8"), ("STABXYZ", ">f8", (3,)), ("NOSTA", ">i4"),
+                                     ("MNTSTA", ">i4"), ("STAXOF", ">f4"), ("POLTYA", "S1"), ("POLAA", ">f4"),
+                                     ("POLTYB", "S1"), ("POLAB", ">f4")])
+    rows["ANNAME"] = [str(tile_name).encode("ascii")[:8] for tile_name in antenna_table["tile_name"]]
+    # Relative to the array centre, with axes parallel to ITRF
+    rows["STABXYZ"][:, 0] = local_xyz[:, 0] * cos_lon - local_xyz[:, 1] * sin_lon
+    rows["STABXYZ"][:, 1] = local_xyz[:, 0] * sin_lon + local_xyz[:, 1] * cos_lon
+    rows["STABXYZ"][:, 2] = local_xyz[:, 2]
+    rows["NOSTA"] = np.arange(1, num_ants + 1)
+    rows["POLTYA"] = b"X"
+    rows["POLTYB"] = b"Y"
+
+    columns = [("ANNAME", "8A", None), ("STABXYZ", "3D", "METERS"), ("NOSTA", "1J", None), ("MNTSTA", "1J", None),
+               ("STAXOF", "1E", "METERS"), ("POLTYA", "1A", None), ("POLAA", "1E", "DEGREES"),
+               ("POLTYB", "1A", None), ("POLAB", "1E", "DEGREES")]
+    cards = [make_card("XTENSION", "BINTABLE"), make_card("BITPIX", 8), make_card("NAXIS", 2),
+             make_card("NAXIS1", rows.dtype.itemsize), make_card("NAXIS2", num_ants), make_card("PCOUNT", 0),
+             make_card("GCOUNT", 1), make_card("TFIELDS", len(columns))]
+    for column_number, (name, tform, tunit) in enumerate(columns, 1):
+        cards.append(make_card(f"TTYPE{column_number}", name))
+        cards.append(make_card(f"TFORM{column_number}", tform))
+        if tunit is not None:
+            cards.append(make_card(f"TUNIT{column_number}", tunit))
+
+    array_xyz = get_geocentric_xyz(MWA_LATITUDE_RADIANS, MWA_LONGITUDE_RADIANS, MWA_ALTITUDE_METRES)
+    rdate = datetime.fromtimestamp((math.floor(start_jd - 0.5) + 0.5 - UNIX_EPOCH_JD) * 86400, timezone.utc)
+    cards += [make_card("EXTNAME", "AIPS AN"), make_card("EXTVER", 1),
+              make_card("ARRAYX", float(array_xyz[0])), make_card("ARRAYY", float(array_xyz[1])),
+              make_card("ARRAYZ", float(array_xyz[2])),
+              make_card("GSTIA0", get_gmst_deg(start_jd), "GMST at 0h on RDATE (degrees)"),
+              make_card("DEGPDY", SIDEREAL_RATE * 360.0), make_card("FREQ", float(ref_freq_hz)),
+              make_card("RDATE", rdate.strftime("%Y-%m-%d")), make_card("POLARX", 0.0), make_card("POLARY", 0.0),
+              make_card("UT1UTC", float(context.metafits_context.dut1)), make_card("DATUTC", 0.0),
+              make_card("TIMSYS", "UTC"), make_card("ARRNAM", "MWA"), make_card("XYZHAND", "RIGHT"),
+              make_card("FRAME", "ITRF"), make_card("NUMORB", 0), make_card("NO_IF", 1), make_card("NOPCAL", 0),
+              make_card("POLTYPE", "X-Y LIN"), make_card("FREQID", -1), make_card("IATUTC", float(iat_utc_s))]
+
+    data = rows.tobytes()
+    return make_header(cards) + data.ljust(-(-len(data) // FITS_BLOCK_SIZE) * FITS_BLOCK_SIZE, b"\0")
+
+
+def write_uvfits(context, filename: str, timestep_indices: typing.Optional[list] = None,
+                 coarse_chan_indices: typing.Optional[list] = None, baselines=None, time_avg: int = 1,
+                 freq_avg: int = 1, flagged_baselines=None, flagged_fine_chans=None, prefetch: int = 2) -> int:
+    """Writes the visibilities of a CorrelatorContext to filename as UVFITS (random groups, with an AIPS AN
+       table), in one pass over the data, and returns the number of groups (rows) written.
+
+       timestep_indices, coarse_chan_indices, time_avg, freq_avg, flagged_baselines, flagged_fine_chans and
+       prefetch are as for CorrelatorContext.read_averaged(), which reads and averages the data; only one averaged
+       timestep is held at a time and its groups are written as soon as it is read. The coarse channels must be
+       contiguous in frequency. baselines (an index array, e.g. from MetafitsMetadata.baselines_for_tiles(),
+       default all) selects the baselines written.
+
+       Each averaged timestep gets UVWs (ant1 minus ant2, in seconds) towards ra_phase_center_deg and
+       dec_phase_center_deg (or the tile pointing if there is no phase centre), using the antenna positions and the
+       LST (see get_lst_rad()) at the centre of the averaged timestep. The correlator output is phased to the
+       zenith, or, if metafits_context.geometric_delays_applied is TilePointing, to the (fixed az/el) tile pointing,
+       so each channel's visibilities are rotated (see get_phasors()) by the difference between the w towards the
+       phase centre and towards that direction, at the channel's centre frequency. As this is done after averaging,
+       long time_avg or freq_avg decorrelate away from that direction. AzElTracking delays are not supported and
+       raise PymwalibInvalidArgumentError. No precession is done. Pols are XX,
+       YY, XY, YX; the weight of each visibility is the weight from read_averaged(), so flagged and missing data
+       have weight 0. Groups with no data at all are not written."""
+    metafits_context = context.metafits_context
+    geometric_delays_applied = GeometricDelaysApplied(metafits_context.geometric_delays_applied)
+    if geometric_delays_applied == GeometricDelaysApplied.AzElTracking:
+        raise PymwalibInvalidArgumentError(f"Observations with {geometric_delays_applied} geometric delays applied "
+                                           f"are not supported")
+
+    if timestep_indices is None:
+        timestep_indices = list(range(context.provided_timestep_indices[0], context.provided_timestep_indices[-1] + 1))
+    if coarse_chan_indices is None:
+        coarse_chan_indices = context.provided_coarse_chan_indices
+    if len(timestep_indices) == 0 or len(coarse_chan_indices) == 0:
+        raise PymwalibInvalidArgumentError("At least one timestep and coarse channel must be written")
+
+    baselines = np.arange(metafits_context.num_baselines) if baselines is None else np.asarray(baselines, np.intp)
+    num_ants = metafits_context.num_ants
+    ant1_numbers = metafits_context.baseline_ant1_index[baselines] + 1
+    ant2_numbers = metafits_context.baseline_ant2_index[baselines] + 1
+
+    # Frequencies (of the centre) of each averaged channel, which must be evenly spaced
+    chan_width_hz = float(metafits_context.corr_fine_chan_width_hz * freq_avg)
+    freqs_hz = np.asarray(context.get_fine_chan_freqs_hz_array(coarse_chan_indices)).reshape(-1, freq_avg).mean(axis=1)
+    if not np.allclose(np.diff(freqs_hz), chan_width_hz):
+        raise PymwalibInvalidArgumentError(f"Coarse channels {coarse_chan_indices} are not contiguous in frequency")
+    num_chans = len(freqs_hz)
+
+    ra_deg, dec_deg = metafits_context.ra_phase_center_deg, metafits_context.dec_phase_center_deg
+    if math.isnan(ra_deg) or math.isnan(dec_deg):
+        ra_deg, dec_deg = metafits_context.ra_tile_pointing_deg, metafits_context.dec_tile_pointing_deg
+
+    antenna_table = metafits_context.antenna_table
+    local_xyz = get_local_xyz(antenna_table["north_m"], antenna_table["east_m"], antenna_table["height_m"])
+    # The direction the correlator output is phased to, which is fixed in az/el
+    if geometric_delays_applied == GeometricDelaysApplied.TilePointing:
+        phased_hour_angle_rad, phased_dec_rad = get_hour_angle_dec_rad(math.radians(metafits_context.az_deg),
+                                                                       math.radians(metafits_context.alt_deg),
+                                                                       MWA_LATITUDE_RADIANS)
+    else:
+        phased_hour_angle_rad, phased_dec_rad = 0.0, MWA_LATITUDE_RADIANS
+    phased_w = get_uvw(local_xyz, phased_hour_angle_rad, phased_dec_rad)[:, 2] / SPEED_OF_LIGHT_M_PER_S
+    phased_delta_w = phased_w[ant1_numbers - 1] - phased_w[ant2_numbers - 1]
+
+    def get_centre_unix_time_ms(group: list) -> float:
+        return float(np.mean([context.timesteps.unix_time_ms[timestep_index] for timestep_index in group])) + \
+            metafits_context.corr_int_time_ms / 2
+
+    start_unix_time_ms = get_centre_unix_time_ms(timestep_indices[:time_avg])
+    start_jd = start_unix_time_ms / 86400000.0 + UNIX_EPOCH_JD
+    first_timestep = context.timesteps[timestep_indices[0]]
+    iat_utc_s = TAI_MINUS_GPS_S + round((first_timestep.gps_time_ms + GPS_EPOCH_UNIX_S * 1000 -
+                                         first_timestep.unix_time_ms) / 1000)
+
+    def get_primary_header(num_groups: int) -> bytes:
+        start_utc = datetime.fromtimestamp(first_timestep.unix_time_ms / 1000, timezone.utc)
+        cards = [make_card("SIMPLE", True), make_card("BITPIX", -32), make_card("NAXIS", 7),
+                 make_card("NAXIS1", 0), make_card("NAXIS2", 3), make_card("NAXIS3", 4),
+                 make_card("NAXIS4", num_chans), make_card("NAXIS5", 1), make_card("NAXIS6", 1),
+                 make_card("NAXIS7", 1), make_card("EXTEND", True), make_card("GROUPS", True),
+                 make_card("PCOUNT", len(GROUP_PARAMS)), make_card("GCOUNT", num_groups),
+                 make_card("BSCALE", 1.0), make_card("BZERO", 0.0),
+                 make_card("OBJECT", metafits_context.obs_name), make_card("TELESCOP", "MWA"),
+                 make_card("INSTRUME", "MWA"), make_card("OBSID", metafits_context.obs_id),
+                 make_card("EPOCH", 2000.0), make_card("OBSRA", float(ra_deg)), make_card("OBSDEC", float(dec_deg)),
+                 make_card("DATE-OBS", start_utc.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]),
+                 make_card("CTYPE2", "COMPLEX"), make_card("CRVAL2", 1.0), make_card("CDELT2", 1.0),
+                 make_card("CRPIX2", 1.0),
+                 make_card("CTYPE3", "STOKES"), make_card("CRVAL3", -5.0), make_card("CDELT3", -1.0),
+                 make_card("CRPIX3", 1.0),
+                 make_card("CTYPE4", "FREQ"), make_card("CRVAL4", float(freqs_hz[0])),
+                 make_card("CDELT4", chan_width_hz), make_card("CRPIX4", 1.0),
+                 make_card("CTYPE5", "IF"), make_card("CRVAL5", 1.0), make_card("CDELT5", 1.0),
+                 make_card("CRPIX5", 1.0),
+                 make_card("CTYPE6", "RA"), make_card("CRVAL6", float(ra_deg)), make_card("CDELT6", 1.0),
+                 make_card("CRPIX6", 1.0),
+                 make_card("CTYPE7", "DEC"), make_card("CRVAL7", float(dec_deg)), make_card("CDELT7", 1.0),
+                 make_card("CRPIX7", 1.0)]
+        for param_number, param in enumerate(GROUP_PARAMS, 1):
+            cards += [make_card(f"PTYPE{param_number}", param), make_card(f"PSCAL{param_number}", 1.0),
+                      make_card(f"PZERO{param_number}", start_jd if param == "DATE" else 0.0)]
+
+        return make_header(cards)
+
+    # One averaged timestep of groups
+    rows = np.zeros((len(baselines), len(GROUP_PARAMS) + num_chans * 4 * 3), dtype=">f4")
+    rows[:, 3] = encode_baseline(ant1_numbers, ant2_numbers, num_ants)
+    vis = rows[:, len(GROUP_PARAMS):].reshape(len(baselines), num_chans, 4, 3)
+    num_groups = 0
+
+    with open(filename, "wb") as uvfits_file:
+        # GCOUNT is only known at the end, so the header is written again then (it is the same size)
+        uvfits_file.write(get_primary_header(0))
+
+        for group, data, weights in context.read_averaged(time_avg, freq_avg, timestep_indices, coarse_chan_indices,
+                                                          flagged_baselines, flagged_fine_chans, prefetch):
+            centre_unix_time_ms = get_centre_unix_time_ms(group)
+            lst_rad = get_lst_rad(centre_unix_time_ms)
+            uvw = get_uvw(local_xyz, lst_rad - math.radians(ra_deg), math.radians(dec_deg)) / SPEED_OF_LIGHT_M_PER_S
+
+            delta_uvw = uvw[ant1_numbers - 1] - uvw[ant2_numbers - 1]
+            rows[:, 0:3] = delta_uvw
+            rows[:, 4] = (centre_unix_time_ms - start_unix_time_ms) / 86400000.0
+            # (coarse_chan,baseline,freq,...) to (baseline,coarse_chan*freq,...)
+            data = data[:, baselines].transpose(1, 0, 2, 3, 4).reshape(len(baselines), num_chans, 4, 2)
+            # Rotate from the direction the data is phased to, to the phase centre
+            data = data.view(np.complex64)[..., 0] * get_phasors(delta_uvw[:, 2] - phased_delta_w, freqs_hz)[..., None]
+            vis[..., 0] = data.real[:, :, UVFITS_POL_ORDER]
+            vis[..., 1] = data.imag[:, :, UVFITS_POL_ORDER]
+            vis[..., 2] = weights[:, baselines].transpose(1, 0, 2).reshape(len(baselines), num_chans, 1)
+
+            uvfits_file.write(rows.tobytes())
+            num_groups += len(baselines)
+
+        data_size = num_groups * rows.shape[1] * rows.itemsize
+        uvfits_file.write(b"\0" * (-data_size % FITS_BLOCK_SIZE))
+        uvfits_file.write(_get_antenna_table_hdu(context, freqs_hz[0], start_jd, iat_utc_s))
+
+        uvfits_file.seek(0)
+        uvfits_file.write(get_primary_header(num_groups))
+
+    return num_groups
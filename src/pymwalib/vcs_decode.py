@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#
+# vcs_decode: vectorized decoding of raw VCS voltage samples into complex arrays
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import typing
+
+import numpy as np
+
+from .common import MWAVersion
+from .errors import PymwalibInvalidArgumentError, PymwalibOutputBufferError
+
+
+def _get_nibble_values() -> np.ndarray:
+    """Returns the signed (two's complement) value of each 4 bit nibble 0 to 15"""
+    nibbles = np.arange(16, dtype=np.int8)
+    return np.where(nibbles < 8, nibbles, nibbles - 16).astype(np.int8)
+
+
+def make_legacy_lut(real_high_nibble: bool = True) -> np.ndarray:
+    """Returns a read-only (256,2) int8 table of the (real, imaginary) parts of each legacy 4+4 bit sample byte.
+       If real_high_nibble is True the real part is the high nibble and the imaginary part the low nibble,
+       otherwise the other way around."""
+    values = _get_nibble_values()
+    codes = np.arange(256)
+    high, low = values[codes >> 4], values[codes & 0xF]
+
+    lut = np.stack([high, low] if real_high_nibble else [low, high], axis=-1)
+    lut.flags.writeable = False
+    return lut
+
+
+def make_legacy_complex_lut(real_high_nibble: bool = True) -> np.ndarray:
+    """Returns a read-only table of the complex64 value of each legacy sample byte (see make_legacy_lut())"""
+    int8_lut = make_legacy_lut(real_high_nibble)
+    lut = (int8_lut[:, 0] + 1j * int8_lut[:, 1]).astype(np.complex64)
+    lut.flags.writeable = False
+    return lut
+
+
+# Legacy sample byte to (real, imaginary), as int8 pairs and as complex64
+LEGACY_INT8_LUT = make_legacy_lut()
+LEGACY_COMPLEX_LUT = make_legacy_complex_lut()
+
+
+def _as_bytes(data, shape: typing.Optional[tuple], sample_size_bytes: int) -> typing.Tuple[np.ndarray, tuple]:
+    """Returns a flat uint8 view (via np.frombuffer, no copy) of data (a C contiguous array or bytes-like
+       object) and the sample shape, which is shape, or if it is None, the number of samples"""
+    data = np.frombuffer(data, dtype=np.uint8)
+    if data.size % sample_size_bytes != 0:
+        raise PymwalibInvalidArgumentError(f"data is {data.size} bytes, which is not a whole number of "
+                                           f"{sample_size_bytes} byte samples")
+
+    num_samples = data.size // sample_size_bytes
+    if shape is None:
+        shape = (num_samples,)
+    elif int(np.prod(shape)) != num_samples:
+        raise PymwalibInvalidArgumentError(f"data has {num_samples} samples, which will not fit shape {shape}")
+
+    return data, tuple(shape)
+
+
+def _get_out(out, shape: tuple, dtype) -> np.ndarray:
+    """Returns out if it is a writeable, C contiguous array of dtype and shape, otherwise a new array if out is
+       None"""
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+
+    if not isinstance(out, np.ndarray) or out.dtype != dtype or out.shape != shape or \
+            not out.flags.c_contiguous or not out.flags.writeable:
+        raise PymwalibOutputBufferError(f"out must be a writeable, C contiguous {np.dtype(dtype).name} array of "
+                                        f"shape {shape}")
+    return out
+
+
+def decode_legacy(data, shape: typing.Optional[tuple] = None, out=None, real_high_nibble: bool = True) -> np.ndarray:
+    """Decodes legacy recombined VCS data (one 4 bit real + 4 bit imaginary byte per sample, e.g. from
+       read_file(), read_second() or get_legacy_second_view()) to a complex64 array of shape (default flat), e.g.
+       get_voltage_shape(context). Each byte is looked up in a 256 entry table with np.take, which releases
+       the GIL, so decoding can run on many threads. If out is given it is filled and returned."""
+    codes, shape = _as_bytes(data, shape, 1)
+    out = _get_out(out, shape, np.complex64)
+    lut = LEGACY_COMPLEX_LUT if real_high_nibble else make_legacy_complex_lut(False)
+
+    # Every byte is a valid index, so mode="clip" never clips; unlike the default it does not buffer out
+    np.take(lut, codes, out=out.reshape(-1), mode="clip")
+    return out
+
+
+def decode_legacy_int8(data, shape: typing.Optional[tuple] = None, out=None,
+                       real_high_nibble: bool = True) -> np.ndarray:
+    """As decode_legacy(), but to an int8 array of shape + (2,) holding the (real, imaginary) pair of each
+       sample"""
+    codes, shape = _as_bytes(data, shape, 1)
+    out = _get_out(out, shape + (2,), np.int8)
+    lut = LEGACY_INT8_LUT if real_high_nibble else make_legacy_lut(False)
+
+    np.take(lut, codes, axis=0, out=out.reshape(-1, 2), mode="clip")
+    return out
+
+
+def get_mwax_int8_pairs(data, shape: typing.Optional[tuple] = None) -> np.ndarray:
+    """Returns an int8 view (no copy) of MWAX VCS data (an 8 bit real, 8 bit imaginary pair per sample, e.g. from
+       read_file() or read_second()) with shape shape + (2,) (default flat)"""
+    data, shape = _as_bytes(data, shape, 2)
+    return data.view(np.int8).reshape(shape + (2,))
+
+
+def decode_mwax(data, shape: typing.Optional[tuple] = None, out=None) -> np.ndarray:
+    """Decodes MWAX VCS data (an 8 bit real, 8 bit imaginary pair per sample) to a complex64 array of shape
+       (default flat), e.g. get_voltage_shape(context), by converting the pairs straight into the float32 real
+       and imaginary parts of out in one pass (which releases the GIL). If out is given it is filled and
+       returned."""
+    pairs = get_mwax_int8_pairs(data, shape)
+    out = _get_out(out, pairs.shape[:-1], np.complex64)
+
+    np.copyto(out.view(np.float32).reshape(pairs.shape), pairs)
+    return out
+
+
+def get_voltage_shape(context, num_bytes: int) -> tuple:
+    """Returns the shape of num_bytes of data (whole voltage blocks) from a VoltageContext: (second, sample,
+       fine_chan, input) for legacy recombined VCS, where the inputs are in file (vcs_order) order, and (voltage
+       block, rf_input, sample, fine_chan) for MWAX VCS"""
+    num_blocks, remainder = divmod(num_bytes, context.voltage_block_size_bytes)
+    if remainder != 0:
+        raise PymwalibInvalidArgumentError(f"{num_bytes} bytes is not a whole number of "
+                                           f"{context.voltage_block_size_bytes} byte voltage blocks")
+
+    samples_per_input = context.num_samples_per_voltage_block * context.num_fine_chans_per_coarse
+
+    if context.mwa_version == MWAVersion.VCSLegacyRecombined:
+        num_inputs = context.voltage_block_size_bytes // samples_per_input
+        return num_blocks, context.num_samples_per_voltage_block, context.num_fine_chans_per_coarse, num_inputs
+    elif context.mwa_version == MWAVersion.VCSMWAXv2:
+        num_rf_inputs = context.voltage_block_size_bytes // (samples_per_input * 2)
+        return num_blocks, num_rf_inputs, context.num_samples_per_voltage_block, context.num_fine_chans_per_coarse
+    else:
+        raise PymwalibInvalidArgumentError(f"Cannot decode {context.mwa_version.name} voltages")
+
+
+def decode_voltages(context, data, out=None) -> np.ndarray:
+    """Decodes data read from a VoltageContext (e.g. by read_file() or read_second()) to a complex64 array of
+       get_voltage_shape(context, data.nbytes), with decode_legacy() or decode_mwax() as appropriate. If out is
+       given it is filled and returned."""
+    num_bytes = np.frombuffer(data, dtype=np.uint8).size
+    shape = get_voltage_shape(context, num_bytes)
+
+    if context.mwa_version == MWAVersion.VCSLegacyRecombined:
+        return decode_legacy(data, shape, out)
+    return decode_mwax(data, shape, out)
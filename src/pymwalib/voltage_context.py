@@ -6,41 +6,105 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
-import ctypes
+import threading
+import typing
 
-import numpy.ctypeslib as npct
+import numpy as np
 from .mwalib import CVoltageContextS, ct, mwalib_library, create_string_buffer, CVoltageMetadataS, MWALIB_SUCCESS, \
     MWALIB_NO_DATA_FOR_TIMESTEP_COARSECHAN
 from .common import ERROR_MESSAGE_LEN, MWAVersion
 from .errors import PymwalibVoltageMetadataGetError, PymwalibVoltageContextNewError, \
     PymwalibCorrelatorContextDisplayError, PymwalibNoDataForTimestepAndCoarseChannelError, \
     PymwalibVoltageContextReadFileError, PymwalibVoltageContextReadSecondError, \
-    PymwalibVoltageContextGetFineChanFreqsArrayError
-from .coarse_channel import CoarseChannel
+    PymwalibVoltageContextGetFineChanFreqsArrayError, PymwalibOutputBufferError, PymwalibInvalidArgumentError
+from .coarse_channel import CoarseChannel, CoarseChannelList
+from .hdu_cache import HDUCache
+from .metadata_cache import add_prefix, get_cache_key, get_scalar_state, load_state, remove_prefix, save_state
 from .metafits_metadata import MetafitsMetadata
-from .timestep import TimeStep
+from .mmap_metadata import get_fine_chan_freqs_hz, get_voltage_state
+from .prefetch import Prefetcher
+from .timestep import TimeStep, TimeStepList
 from .version import check_mwalib_version
+from .voltage_mmap import VoltageFileReader, MWAX_SUBFILE_FILENAME_RE, LEGACY_DAT_FILENAME_RE
 
 
 class VoltageContext:
-    """Main class to interface with mwalib"""
+    """Main class to interface with mwalib
 
-    def __init__(self, metafits_filename: str, voltage_filenames: list):
-        """Take metafits and voltage files, and populate this class via mwalib"""
-        #
-        # Ensure we have a compatible version of mwalib
-        #
-        check_mwalib_version()
+       The read methods may be called concurrently from multiple threads (see ParallelReader)."""
 
-        error_message: bytes = create_string_buffer(ERROR_MESSAGE_LEN)
-        self._voltage_context_object = ct.POINTER(CVoltageContextS)()
+    def __init__(self, metafits_filename: str, voltage_filenames: list, cache_dir: typing.Optional[str] = None,
+                 backend: str = "mwalib", file_cache_bytes: typing.Optional[int] = None):
+        """Take metafits and voltage files, and populate this class via mwalib. If cache_dir is given, the
+           metadata is read from (or on a miss, written to) the metadata cache there (see metadata_cache);
+           on a hit the mwalib context is not created until mwalib is first needed, e.g. by a read.
+
+           backend is "mwalib" to read data through mwalib, or "mmap" (MWAX VCS .sub or legacy recombined VCS .dat
+           files only) to memory map the voltage files (see voltage_mmap), in which case read_file and read_second
+           return read-only views of the files whenever no out buffer is given. The "mmap" backend is needed for
+           get_legacy_second_view/read_legacy_seconds. It does not use mwalib at all: the metadata comes from the
+           metafits and the voltage file names (see mmap_metadata), so it works where libmwalib is not installed.
+           display() needs mwalib.
 
-        # First populate the context object
-        self._get_voltage_context(metafits_filename, voltage_filenames)
+           If file_cache_bytes is given, up to that many bytes of files read by read_file are kept in an LRU cache
+           (see hdu_cache), so reading a file again does not go back to disk. The "mmap" backend does not use
+           it, as its views of the files already come from the page cache."""
+        if backend not in ("mwalib", "mmap"):
+            raise PymwalibInvalidArgumentError(f"backend must be \"mwalib\" or \"mmap\", not {backend!r}")
+
+        self._voltage_context_object = ct.POINTER(CVoltageContextS)()
+        self._voltage_context_args = (metafits_filename, voltage_filenames)
+        self._voltage_context_lock = threading.Lock()
+        self._fine_chan_freqs_hz_cache: typing.Dict[tuple, np.ndarray] = {}
+        self.backend: str = backend
+        self._voltage_file_reader: typing.Optional[VoltageFileReader] = None
+        self._file_cache: typing.Optional[HDUCache] = None
+        if file_cache_bytes is not None and backend == "mwalib":
+            self._file_cache = HDUCache(file_cache_bytes)
+
+        if backend == "mmap":
+            def get_metadata():
+                self._set_state(*get_voltage_state(metafits_filename, voltage_filenames))
+        else:
+            #
+            # Ensure we have a compatible version of mwalib
+            #
+            check_mwalib_version()
+
+            # The context object is created by _get_voltage_metadata() on a metadata cache miss, and otherwise
+            # only when mwalib is first needed (see _get_voltage_context_object())
+            get_metadata = self._get_voltage_metadata
+
+        # Get the voltage and metafits metadata, from the cache if we can
+        if cache_dir is not None:
+            cache_key = get_cache_key("voltage" if backend == "mwalib" else f"voltage:{backend}",
+                                      metafits_filename, voltage_filenames, uses_mwalib=backend == "mwalib")
+            state = load_state(cache_dir, cache_key)
+            if state is not None:
+                self._set_state(*state)
+            else:
+                get_metadata()
+                save_state(cache_dir, cache_key, *self._get_state())
+        else:
+            get_metadata()
+
+        if backend == "mmap":
+            filename_re = MWAX_SUBFILE_FILENAME_RE if self.mwa_version == MWAVersion.VCSMWAXv2 else \
+                LEGACY_DAT_FILENAME_RE
+            self._voltage_file_reader = VoltageFileReader(voltage_filenames,
+                                                          self.data_file_header_size_bytes,
+                                                          self.delay_block_size_bytes,
+                                                          self.voltage_block_size_bytes,
+                                                          self.num_voltage_blocks_per_timestep,
+                                                          filename_re)
+
+    def _get_voltage_metadata(self):
+        """Retrieve the voltage metadata (and its metafits metadata) from mwalib and populate this class"""
+        error_message: bytes = create_string_buffer(ERROR_MESSAGE_LEN)
 
         # Now Get voltage metadata
         c_object_ptr = ct.POINTER(CVoltageMetadataS)()
-        if mwalib_library.mwalib_voltage_metadata_get(self._voltage_context_object,
+        if mwalib_library.mwalib_voltage_metadata_get(self._get_voltage_context_object(),
                                                       ct.byref(c_object_ptr),
                                                       error_message,
                                                       ERROR_MESSAGE_LEN) != 0:
@@ -124,14 +188,39 @@ class VoltageContext:
         self.metafits_context: MetafitsMetadata = MetafitsMetadata(None, None, self._voltage_context_object)
 
         # Populate coarse channels
-        self.coarse_channels = CoarseChannel.get_correlator_or_voltage_coarse_channels(c_object_ptr.contents)
+        self.coarse_channels: CoarseChannelList = \
+            CoarseChannel.get_correlator_or_voltage_coarse_channels(c_object_ptr.contents)
 
         # Populate timesteps
-        self.timesteps = TimeStep.get_correlator_or_voltage_timesteps(c_object_ptr.contents)
+        self.timesteps: TimeStepList = TimeStep.get_correlator_or_voltage_timesteps(c_object_ptr.contents)
 
         # We're now finished with the C memory, so free it
         mwalib_library.mwalib_voltage_metadata_free(c_object)
 
+    def _get_state(self) -> typing.Tuple[dict, typing.Dict[str, np.ndarray]]:
+        """Returns the fields of this class as a dict of json serialisable scalars and a dict of numpy arrays (see
+           metadata_cache)"""
+        scalars = get_scalar_state(self)
+        scalars["mwa_version"] = self.mwa_version.value
+        scalars["metafits_context"], metafits_arrays = self.metafits_context._get_state()
+
+        arrays = add_prefix("metafits_context", metafits_arrays)
+        arrays["coarse_channels"] = self.coarse_channels.table
+        arrays["timesteps"] = self.timesteps.table
+
+        return scalars, arrays
+
+    def _set_state(self, scalars: dict, arrays: typing.Dict[str, np.ndarray]):
+        """Populate this class from the output of _get_state(), instead of via mwalib"""
+        scalars = dict(scalars)
+        metafits_scalars = scalars.pop("metafits_context")
+        self.__dict__.update(scalars)
+        self.mwa_version = MWAVersion(scalars["mwa_version"])
+        self.metafits_context = MetafitsMetadata._from_state(metafits_scalars,
+                                                             remove_prefix("metafits_context", arrays))
+        self.coarse_channels = CoarseChannelList(arrays["coarse_channels"])
+        self.timesteps = TimeStepList(arrays["timesteps"])
+
     def __enter__(self):
         return self
 
@@ -140,6 +229,17 @@ class VoltageContext:
         if self._voltage_context_object:
             mwalib_library.mwalib_voltage_context_free(self._voltage_context_object)
 
+    def _get_voltage_context_object(self):
+        """Returns the mwalib voltage context, creating it on first use. A context populated from the metadata cache
+           does not create it (reading and validating the metafits and data files again) until mwalib is needed,
+           e.g. by a read through mwalib."""
+        if not self._voltage_context_object:
+            with self._voltage_context_lock:
+                if not self._voltage_context_object:
+                    self._get_voltage_context(*self._voltage_context_args)
+
+        return self._voltage_context_object
+
     def _get_voltage_context(self, metafits_filename: str, voltage_filenames: list):
         """This method will read and validate the metafits and voltage files. If all has worked, then
         the context object can be used in subsequent calls to populate aspects of this class."""
@@ -162,63 +262,223 @@ class VoltageContext:
         else:
             raise PymwalibVoltageContextNewError("Error creating voltage context object: mwalib is not loaded.")
 
-    def get_fine_chan_freqs_hz_array(self, volt_coarse_chan_indices) -> list:
-        """Populates a list of fine channel centre frequencies based on the input list of coarse channel
-           indices"""
+    def get_fine_chan_freqs_hz_array(self, volt_coarse_chan_indices) -> np.ndarray:
+        """Returns a read-only float64 array of the fine channel centre frequencies of the input list of coarse
+           channel indices. The result is memoized per tuple of indices, so repeated calls do not call mwalib."""
+        key = tuple(int(index) for index in volt_coarse_chan_indices)
+
+        out_frequencies = self._fine_chan_freqs_hz_cache.get(key)
+        if out_frequencies is not None:
+            return out_frequencies
+
+        if self.backend == "mmap":
+            out_frequencies = get_fine_chan_freqs_hz(self.coarse_channels.table[list(key)],
+                                                     self.metafits_context.num_volt_fine_chans_per_coarse,
+                                                     self.metafits_context.volt_fine_chan_width_hz)
+            out_frequencies.flags.writeable = False
+            self._fine_chan_freqs_hz_cache[key] = out_frequencies
+            return out_frequencies
+
         error_message = create_string_buffer(ERROR_MESSAGE_LEN)
 
-        volt_coarse_chan_indices_type = ctypes.c_ulong * len(volt_coarse_chan_indices)
-        volt_coarse_chan_indices_array = volt_coarse_chan_indices_type(*volt_coarse_chan_indices)
+        volt_coarse_chan_indices_array = np.array(key, dtype=np.uintp)
+        out_frequencies = np.empty(len(key) * self.metafits_context.num_volt_fine_chans_per_coarse, dtype=np.float64)
 
-        out_frequencies_len = len(volt_coarse_chan_indices) * self.metafits_context.num_volt_fine_chans_per_coarse
-        out_frequencies_type = ct.c_double * out_frequencies_len
-        out_frequencies = out_frequencies_type()
+        volt_coarse_chan_indices_ptr = volt_coarse_chan_indices_array.ctypes.data_as(ct.POINTER(ct.c_size_t))
+        out_frequencies_ptr = out_frequencies.ctypes.data_as(ct.POINTER(ct.c_double))
 
-        if mwalib_library.mwalib_voltage_context_get_fine_chan_freqs_hz_array(self._voltage_context_object,
-                                                                              volt_coarse_chan_indices_array,
-                                                                              len(volt_coarse_chan_indices),
-                                                                              out_frequencies,
-                                                                              out_frequencies_len,
+        if mwalib_library.mwalib_voltage_context_get_fine_chan_freqs_hz_array(self._get_voltage_context_object(),
+                                                                              volt_coarse_chan_indices_ptr,
+                                                                              len(key),
+                                                                              out_frequencies_ptr,
+                                                                              out_frequencies.size,
                                                                               error_message,
                                                                               ERROR_MESSAGE_LEN) != 0:
             raise PymwalibVoltageContextGetFineChanFreqsArrayError(
                 f"Error calling mwalib_voltage_context_get_fine_chan_freqs_hz_array(): "
                 f"{error_message.decode('utf-8').rstrip()}")
-        out_frequencies_list = []
 
-        for i in range(0, out_frequencies_len):
-            out_frequencies_list.append(out_frequencies[i])
+        out_frequencies.flags.writeable = False
+        self._fine_chan_freqs_hz_cache[key] = out_frequencies
 
-        return out_frequencies_list
+        return out_frequencies
 
     def display(self):
         """Displays a human readable summary of the voltage context"""
         error_message = create_string_buffer(ERROR_MESSAGE_LEN)
 
-        if mwalib_library.mwalib_voltage_context_display(self._voltage_context_object,
+        if mwalib_library.mwalib_voltage_context_display(self._get_voltage_context_object(),
                                                          error_message,
                                                          ERROR_MESSAGE_LEN) != 0:
             raise PymwalibCorrelatorContextDisplayError(f"Error calling mwalib_voltage_context_display(): "
                                                         f"{error_message.decode('utf-8').rstrip()}")
 
-    def read_file(self, timestep_index: int, coarse_chan_index: int):
-        """Retrieve one file of VCS data as a numpy array."""
-        error_message = " ".encode("utf-8") * ERROR_MESSAGE_LEN
-
+    def _get_file_buffer(self, out) -> np.ndarray:
+        """Returns out if it can be handed to mwalib as a buffer for read_file, otherwise a new buffer if out is
+           None"""
         byte_buffer_len = self.voltage_block_size_bytes * self.num_voltage_blocks_per_timestep
 
-        byte_buffer_type = ct.c_byte * byte_buffer_len
-        buffer = byte_buffer_type()
+        return self._get_byte_buffer(byte_buffer_len, out)
+
+    def _get_second_buffer(self, gps_second_count: int, out) -> np.ndarray:
+        """Returns out if it can be handed to mwalib as a buffer for read_second, otherwise a new buffer if out is
+           None"""
+        byte_buffer_len = self.voltage_block_size_bytes * self.num_voltage_blocks_per_second * gps_second_count
 
-        ret_val = mwalib_library.mwalib_voltage_context_read_file(self._voltage_context_object,
+        return self._get_byte_buffer(byte_buffer_len, out)
+
+    @staticmethod
+    def _get_byte_buffer(byte_buffer_len: int, out) -> np.ndarray:
+        if out is None:
+            return np.empty(byte_buffer_len, dtype=np.int8)
+
+        if not isinstance(out, np.ndarray) or out.dtype != np.int8 or out.size != byte_buffer_len or \
+                not out.flags.c_contiguous or not out.flags.writeable:
+            raise PymwalibOutputBufferError(f"out must be a writeable, C contiguous int8 array of "
+                                            f"{byte_buffer_len} elements")
+        return out
+
+    def _get_voltage_blocks(self, timestep_index: int, coarse_chan_index: int) -> np.ndarray:
+        """Returns the read-only (voltage block, byte) view of the file for the timestep and coarse channel.
+           Needs the "mmap" backend."""
+        blocks = self._voltage_file_reader.get_voltage_blocks(
+            int(self.timesteps.gps_time_ms[timestep_index]) // 1000,
+            int(self.coarse_channels.rec_chan_number[coarse_chan_index]))
+
+        if blocks is None:
+            raise PymwalibNoDataForTimestepAndCoarseChannelError(
+                f"No data exists for this timestep {timestep_index} and coarse channel {coarse_chan_index}")
+
+        return blocks
+
+    def _read_file_from_views(self, timestep_index: int, coarse_chan_index: int, out) -> np.ndarray:
+        """read_file for the "mmap" backend"""
+        data = self._get_voltage_blocks(timestep_index, coarse_chan_index).reshape(-1)
+
+        if out is None:
+            return data
+
+        buffer = self._get_file_buffer(out)
+        np.copyto(buffer, data)
+        return buffer
+
+    def _read_second_from_views(self, gps_second_start: int, gps_second_count: int, coarse_chan_index: int,
+                                out) -> np.ndarray:
+        """read_second for the "mmap" backend. Returns a view if all of the seconds are in one file (and out is
+           None), otherwise copies each file's part into one buffer."""
+        timestep_gps_times = self.timesteps.gps_time_ms // 1000
+        timestep_duration_s = self.timestep_duration_ms // 1000
+        gps_second_end = gps_second_start + gps_second_count
+        parts = []
+
+        gps_second = gps_second_start
+        while gps_second < gps_second_end:
+            timestep_index = int(np.searchsorted(timestep_gps_times, gps_second, side="right")) - 1
+            timestep_gps_time = int(timestep_gps_times[timestep_index]) if timestep_index >= 0 else None
+            if timestep_gps_time is None or gps_second >= timestep_gps_time + timestep_duration_s or \
+                    not self._voltage_file_reader.has_file(
+                        timestep_gps_time, int(self.coarse_channels.rec_chan_number[coarse_chan_index])):
+                raise PymwalibNoDataForTimestepAndCoarseChannelError(
+                    f"Not all data exists for {gps_second_start} (for {gps_second_count} sec) and coarse channel "
+                    f"{coarse_chan_index}")
+
+            part_seconds = min(gps_second_end, timestep_gps_time + timestep_duration_s) - gps_second
+            first_block = (gps_second - timestep_gps_time) * self.num_voltage_blocks_per_second
+            blocks = self._get_voltage_blocks(timestep_index, coarse_chan_index)
+            parts.append(blocks[first_block:first_block + part_seconds * self.num_voltage_blocks_per_second])
+            gps_second += part_seconds
+
+        if out is None and len(parts) == 1:
+            return parts[0].reshape(-1)
+
+        buffer = self._get_second_buffer(gps_second_count, out)
+        np.concatenate([part.reshape(-1) for part in parts], out=buffer)
+        return buffer
+
+    def get_legacy_second_view(self, gps_second: int, coarse_chan_index: int) -> np.ndarray:
+        """Returns a read-only (sample, fine_chan, input) view of one second of legacy recombined VCS data, without
+           copying it. Each byte is one 4 bit real / 4 bit imaginary sample. Inputs are in the order they are in
+           the file, i.e. rf_input i is at input rf_input_table["vcs_order"][i]. Needs the "mmap" backend."""
+        if self._voltage_file_reader is None or self.mwa_version != MWAVersion.VCSLegacyRecombined:
+            raise PymwalibInvalidArgumentError("get_legacy_second_view() needs a VCSLegacyRecombined VoltageContext "
+                                               "created with backend=\"mmap\"")
+
+        timestep_index = int(np.searchsorted(self.timesteps.gps_time_ms, gps_second * 1000))
+        if timestep_index == len(self.timesteps) or self.timesteps.gps_time_ms[timestep_index] != gps_second * 1000:
+            raise PymwalibNoDataForTimestepAndCoarseChannelError(
+                f"No data exists for gps second {gps_second} and coarse channel {coarse_chan_index}")
+
+        # Legacy samples are one byte each, and each second is a single voltage block
+        num_inputs = self.voltage_block_size_bytes // (self.num_samples_per_voltage_block *
+                                                       self.num_fine_chans_per_coarse)
+
+        return self._get_voltage_blocks(timestep_index, coarse_chan_index).reshape(
+            self.num_samples_per_voltage_block, self.num_fine_chans_per_coarse, num_inputs)
+
+    def read_legacy_seconds(self, gps_second_start: int, gps_second_count: int, coarse_chan_index: int,
+                            rf_input_order: bool = True, out=None) -> np.ndarray:
+        """Read gps_second_count seconds of legacy recombined VCS data into a (second, sample, fine_chan, input)
+           int8 array. If rf_input_order is True the inputs are reordered (using vcs_order) so input i is
+           rf_input i, otherwise they are left in file order. Needs the "mmap" backend.
+
+           Unlike the other "mmap" reads this always copies (reordering the inputs with np.take), even for one
+           second, so use get_legacy_second_view() for zero-copy access in file order. If out is provided (a
+           writeable, C contiguous int8 array of that shape, which can be reused from call to call) the data is
+           copied into it and out is returned, otherwise a new array is."""
+        if gps_second_count < 1:
+            raise PymwalibInvalidArgumentError(f"gps_second_count must be at least 1, not {gps_second_count}")
+
+        views = [self.get_legacy_second_view(gps_second, coarse_chan_index)
+                 for gps_second in range(gps_second_start, gps_second_start + gps_second_count)]
+        shape = (gps_second_count,) + views[0].shape
+
+        if out is None:
+            out = np.empty(shape, dtype=np.int8)
+        elif not isinstance(out, np.ndarray) or out.dtype != np.int8 or out.shape != shape or \
+                not out.flags.c_contiguous or not out.flags.writeable:
+            raise PymwalibOutputBufferError(f"out must be a writeable, C contiguous int8 array of shape {shape}")
+
+        vcs_order = self.metafits_context.rf_input_table["vcs_order"].astype(np.intp)
+
+        for second, view in enumerate(views):
+            if rf_input_order:
+                np.take(view, vcs_order, axis=2, out=out[second])
+            else:
+                out[second] = view
+
+        return out
+
+    def read_file(self, timestep_index: int, coarse_chan_index: int, out=None):
+        """Retrieve one file of VCS data as a numpy array.
+
+           If out is provided (an int8 numpy array or np.memmap of the right size), the data is written into it
+           and out is returned. With the "mmap" backend and no out, a read-only view of the file is returned.
+           With the file cache (see file_cache_bytes) and no out, the cached, read-only, array is returned."""
+        if self._voltage_file_reader is not None:
+            return self._read_file_from_views(timestep_index, coarse_chan_index, out)
+
+        if self._file_cache is not None:
+            return self._file_cache.read(("file", int(timestep_index), int(coarse_chan_index)),
+                                         lambda buffer: self._read_file(timestep_index, coarse_chan_index, buffer),
+                                         None if out is None else self._get_file_buffer(out))
+
+        return self._read_file(timestep_index, coarse_chan_index, out)
+
+    def _read_file(self, timestep_index: int, coarse_chan_index: int, out=None):
+        """read_file through mwalib, without the file cache"""
+        error_message = " ".encode("utf-8") * ERROR_MESSAGE_LEN
+
+        buffer = self._get_file_buffer(out)
+
+        ret_val = mwalib_library.mwalib_voltage_context_read_file(self._get_voltage_context_object(),
                                                                   ct.c_size_t(timestep_index),
                                                                   ct.c_size_t(coarse_chan_index),
-                                                                  buffer,
-                                                                  byte_buffer_len,
+                                                                  buffer.ctypes.data_as(ct.POINTER(ct.c_byte)),
+                                                                  buffer.size,
                                                                   error_message, ERROR_MESSAGE_LEN)
 
         if ret_val == MWALIB_SUCCESS:
-            return npct.as_array(buffer, shape=(byte_buffer_len,))
+            return buffer
         elif ret_val == MWALIB_NO_DATA_FOR_TIMESTEP_COARSECHAN:
             raise PymwalibNoDataForTimestepAndCoarseChannelError(
                 f"No data exists for this timestep {timestep_index} and coarse channel {coarse_chan_index}")
@@ -226,25 +486,34 @@ class VoltageContext:
             raise PymwalibVoltageContextReadFileError(f"Error reading data: "
                                                       f"{error_message.decode('utf-8').rstrip()}")
 
-    def read_second(self, gps_second_start: int, gps_second_count: int, coarse_chan_index: int):
-        """Retrieve multiple seconds of VCS data as a numpy array."""
-        error_message = " ".encode("utf-8") * ERROR_MESSAGE_LEN
+    @property
+    def file_cache(self) -> typing.Optional[HDUCache]:
+        """The read_file cache (with its hit, miss and eviction counters), or None if it is not used"""
+        return self._file_cache
 
-        byte_buffer_len = self.voltage_block_size_bytes * self.num_voltage_blocks_per_second * gps_second_count
+    def read_second(self, gps_second_start: int, gps_second_count: int, coarse_chan_index: int, out=None):
+        """Retrieve multiple seconds of VCS data as a numpy array.
 
-        byte_buffer_type = ct.c_byte * byte_buffer_len
-        buffer = byte_buffer_type()
+           If out is provided (an int8 numpy array or np.memmap of the right size), the data is written into it
+           and out is returned. With the "mmap" backend and no out, a read-only view of the file is returned when
+           all of the seconds are in one file."""
+        if self._voltage_file_reader is not None:
+            return self._read_second_from_views(gps_second_start, gps_second_count, coarse_chan_index, out)
 
-        ret_val = mwalib_library.mwalib_voltage_context_read_second(self._voltage_context_object,
+        error_message = " ".encode("utf-8") * ERROR_MESSAGE_LEN
+
+        buffer = self._get_second_buffer(gps_second_count, out)
+
+        ret_val = mwalib_library.mwalib_voltage_context_read_second(self._get_voltage_context_object(),
                                                                     ct.c_ulong(gps_second_start),
                                                                     ct.c_size_t(gps_second_count),
                                                                     ct.c_size_t(coarse_chan_index),
-                                                                    buffer,
-                                                                    byte_buffer_len,
+                                                                    buffer.ctypes.data_as(ct.POINTER(ct.c_byte)),
+                                                                    buffer.size,
                                                                     error_message, ERROR_MESSAGE_LEN)
 
         if ret_val == MWALIB_SUCCESS:
-            return npct.as_array(buffer, shape=(byte_buffer_len,))
+            return buffer
         elif ret_val == MWALIB_NO_DATA_FOR_TIMESTEP_COARSECHAN:
             raise PymwalibNoDataForTimestepAndCoarseChannelError(
                 f"Not all data exists for {gps_second_start} (for {gps_second_count} sec) and coarse channel "
@@ -253,6 +522,41 @@ class VoltageContext:
             raise PymwalibVoltageContextReadSecondError(f"Error reading data: "
                                                         f"{error_message.decode('utf-8').rstrip()}")
 
+    def get_second_chunks(self, gps_second_start: int, gps_second_end: int, coarse_chan_index: int,
+                          chunk_seconds: int = 1) -> typing.List[typing.Tuple[int, int, int]]:
+        """Returns the read_second() arguments (gps_second_start, gps_second_count, coarse_chan_index) of each
+           consecutive chunk of chunk_seconds from gps_second_start up to (not including) gps_second_end. The last
+           chunk is shorter if chunk_seconds does not divide the span."""
+        if chunk_seconds < 1:
+            raise PymwalibInvalidArgumentError(f"chunk_seconds must be at least 1, not {chunk_seconds}")
+
+        return [(gps_second, min(chunk_seconds, gps_second_end - gps_second), coarse_chan_index)
+                for gps_second in range(gps_second_start, gps_second_end, chunk_seconds)]
+
+    def iter_seconds(self, gps_second_start: int, gps_second_end: int, coarse_chan_index: int,
+                     chunk_seconds: int = 1, prefetch: int = 2) -> typing.Iterator[typing.Tuple[int, np.ndarray]]:
+        """Iterate over (gps_second, data) for each chunk of chunk_seconds from gps_second_start up to (not
+           including) gps_second_end (see get_second_chunks), skipping chunks with no data. Chunks are read with
+           read_second(), so they run across file boundaries (8 second MWAX .sub files or 1 second legacy .dat
+           files) as one continuous stream of samples.
+
+           Chunks are read on a background thread, up to prefetch ahead of the caller, into a ring of recycled
+           buffers, so no buffer is allocated per chunk. Each data array is only valid until the next chunk is
+           requested: copy it if you need to keep it."""
+        items = self.get_second_chunks(gps_second_start, gps_second_end, coarse_chan_index, chunk_seconds)
+        bytes_per_second = self.voltage_block_size_bytes * self.num_voltage_blocks_per_second
+
+        def read(item: tuple, buffer: np.ndarray) -> bool:
+            try:
+                self.read_second(*item, out=buffer[:item[1] * bytes_per_second])
+            except PymwalibNoDataForTimestepAndCoarseChannelError:
+                return False
+            return True
+
+        for (gps_second, gps_second_count, _), buffer in Prefetcher(
+                read, items, lambda: self._get_second_buffer(chunk_seconds, None), prefetch):
+            yield gps_second, buffer[:gps_second_count * bytes_per_second]
+
     def __repr__(self):
         """Returns a representation of the class"""
         return f"{self.__class__.__name__}(\n" \
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# voltage_mmap: memory mapped reader for MWAX VCS (.sub) and legacy recombined VCS (.dat) voltage files
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+import os
+import re
+import threading
+import typing
+
+import numpy as np
+
+from .errors import PymwalibInvalidArgumentError
+
+# e.g. 1101503312_1101503312_123.sub (obs id, gps time of the first sample, receiver channel number)
+MWAX_SUBFILE_FILENAME_RE = re.compile(r"^(?P<obs_id>\d{10})_(?P<gps_time>\d{10})_(?P<rec_chan_number>\d{1,3})\.sub$")
+
+# e.g. 1101503312_1101503312_ch123.dat (obs id, gps second, receiver channel number). Each file is one second of
+# (sample, fine channel, input) data with no header or delay block
+LEGACY_DAT_FILENAME_RE = re.compile(
+    r"^(?P<obs_id>\d{10})_(?P<gps_time>\d{10})_ch(?P<rec_chan_number>\d{1,3})\.dat$")
+
+
+class VoltageFileReader:
+    """
+    Memory mapped access to a set of voltage files, looked up by GPS time (in seconds, from the file name) and
+    receiver channel number. Each file is a header, then a delay block, then num_voltage_blocks_per_timestep
+    voltage blocks; the sizes are the VoltageContext attributes of the same names. Files are mapped on first use
+    and the views returned are read-only and backed by the page cache, so reading them costs no copy.
+
+    Nothing here uses mwalib, so it works where libmwalib.so is not available.
+
+    """
+
+    def __init__(self, voltage_filenames: list, data_file_header_size_bytes: int, delay_block_size_bytes: int,
+                 voltage_block_size_bytes: int, num_voltage_blocks_per_timestep: int,
+                 filename_re: typing.Pattern = MWAX_SUBFILE_FILENAME_RE):
+        """Initialise the reader with the files and their layout. filename_re must have gps_time and
+           rec_chan_number groups."""
+        self.data_file_header_size_bytes: int = data_file_header_size_bytes
+        self.delay_block_size_bytes: int = delay_block_size_bytes
+        self.voltage_block_size_bytes: int = voltage_block_size_bytes
+        self.num_voltage_blocks_per_timestep: int = num_voltage_blocks_per_timestep
+
+        self._filenames: typing.Dict[typing.Tuple[int, int], str] = {}
+        for filename in voltage_filenames:
+            match = filename_re.match(os.path.basename(filename))
+            if match is None:
+                raise PymwalibInvalidArgumentError(f"{filename} is not named like a voltage file of this type")
+            self._filenames[(int(match.group("gps_time")), int(match.group("rec_chan_number")))] = filename
+
+        self._memmaps: typing.Dict[typing.Tuple[int, int], np.memmap] = {}
+        self._lock = threading.Lock()
+
+    def has_file(self, gps_time: int, rec_chan_number: int) -> bool:
+        """Returns True if there is a file for the GPS time (in seconds) and receiver channel"""
+        return (gps_time, rec_chan_number) in self._filenames
+
+    def _get_memmap(self, gps_time: int, rec_chan_number: int) -> typing.Optional[np.memmap]:
+        key = (gps_time, rec_chan_number)
+
+        with self._lock:
+            memmap = self._memmaps.get(key)
+            if memmap is None and key in self._filenames:
+                memmap = np.memmap(self._filenames[key], dtype=np.int8, mode="r")
+                self._memmaps[key] = memmap
+
+        return memmap
+
+    def get_voltage_blocks(self, gps_time: int, rec_chan_number: int) -> typing.Optional[np.ndarray]:
+        """Returns a read-only int8 (voltage block, byte) view of all of the voltage blocks in the file for the GPS
+           time (in seconds) and receiver channel, or None if there is no such file"""
+        memmap = self._get_memmap(gps_time, rec_chan_number)
+        if memmap is None:
+            return None
+
+        start = self.data_file_header_size_bytes + self.delay_block_size_bytes
+        end = start + self.num_voltage_blocks_per_timestep * self.voltage_block_size_bytes
+
+        return memmap[start:end].reshape(self.num_voltage_blocks_per_timestep, self.voltage_block_size_bytes)
+
+    def get_delay_block(self, gps_time: int, rec_chan_number: int) -> typing.Optional[np.ndarray]:
+        """Returns a read-only int8 view of the delay block in the file for the GPS time (in seconds) and receiver
+           channel, or None if there is no such file"""
+        memmap = self._get_memmap(gps_time, rec_chan_number)
+        if memmap is None:
+            return None
+
+        start = self.data_file_header_size_bytes
+
+        return memmap[start:start + self.delay_block_size_bytes]
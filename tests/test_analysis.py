@@ -0,0 +1,39 @@
+import numpy as np
+
+from pymwalib.analysis import get_phase_deg, get_power, make_table, write_table
+
+
+def test_power_and_phase():
+    vis = np.array([3 + 4j, -1 + 0j, 0 - 2j], dtype=np.complex64)
+    np.testing.assert_array_equal(get_power(vis), [25.0, 1.0, 4.0])
+    np.testing.assert_array_equal(get_phase_deg(vis), [np.degrees(np.arctan2(4, 3)), 180.0, -90.0])
+    assert get_power(vis).dtype == np.float64
+
+
+def test_make_table():
+    power = np.arange(12, dtype=np.float64).reshape(2, 3, 2)
+    table = make_table({"time_index": np.arange(2)[:, np.newaxis, np.newaxis],
+                        "baseline": np.arange(3)[np.newaxis, :, np.newaxis],
+                        "fine_chan": np.arange(2)[np.newaxis, np.newaxis, :],
+                        "power": power})
+    assert table.dtype.names == ("time_index", "baseline", "fine_chan", "power")
+    assert len(table) == 12
+    np.testing.assert_array_equal(table["power"], power.ravel())
+    assert table[7].tolist() == (1, 0, 1, 7.0)
+
+
+def test_write_table(tmp_path):
+    table = make_table({"fine_chan": np.arange(3), "x": np.array([0.1, 2.5, -3.0], dtype=np.float32),
+                        "y": np.array([1 / 3, 0.0, 1e10])})
+
+    write_table(str(tmp_path / "table.npy"), table)
+    np.testing.assert_array_equal(np.load(tmp_path / "table.npy"), table)
+
+    write_table(str(tmp_path / "table.csv"), table)
+    lines = (tmp_path / "table.csv").read_text().splitlines()
+    assert lines[0] == "fine_chan, x, y"
+    assert len(lines) == 4
+    csv = np.loadtxt(tmp_path / "table.csv", delimiter=",", skiprows=1)
+    np.testing.assert_array_equal(csv[:, 0], table["fine_chan"])
+    np.testing.assert_array_equal(csv[:, 1].astype(np.float32), table["x"])
+    np.testing.assert_array_equal(csv[:, 2], table["y"])
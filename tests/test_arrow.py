@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from pymwalib.arrow import get_file_format, table_to_record_batch, write_record_batches
+from pymwalib.errors import PymwalibInvalidArgumentError
+
+pa = pytest.importorskip("pyarrow")
+
+
+def test_table_to_record_batch():
+    table = np.zeros(3, dtype=[("tile_name", "U8"), ("flagged", bool), ("north_m", ">f8"), ("delays", np.uint32, (4,))])
+    table["tile_name"] = ["Tile011", "Tile012", "Tile013"]
+    table["flagged"] = [False, True, False]
+    table["north_m"] = [1.5, -2.0, 3.25]
+    table["delays"] = np.arange(12).reshape(3, 4)
+
+    batch = table_to_record_batch(table, np.array([4, 5, 6]))
+    assert batch.schema.names == ["index", "tile_name", "flagged", "north_m", "delays"]
+    assert batch.schema.field("delays").type == pa.list_(pa.uint32(), 4)
+    assert batch.to_pylist()[1] == {"index": 5, "tile_name": "Tile012", "flagged": True, "north_m": -2.0,
+                                    "delays": [4, 5, 6, 7]}
+
+
+def test_write_record_batches(tmp_path):
+    batch = table_to_record_batch(np.array([(1, 2.0), (3, 4.0)], dtype=[("a", np.int32), ("b", np.float32)]))
+
+    write_record_batches(str(tmp_path / "table.arrow"), [batch, batch])
+    assert pa.ipc.open_file(str(tmp_path / "table.arrow")).read_all().column("a").to_pylist() == [1, 3, 1, 3]
+
+    assert get_file_format("table.parquet") == "parquet"
+    assert get_file_format("table.parquet", "ipc") == "ipc"
+    with pytest.raises(PymwalibInvalidArgumentError):
+        get_file_format("table.csv", "csv")
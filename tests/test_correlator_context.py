@@ -1,31 +1,47 @@
+import asyncio
+import os
 from os.path import join as path_join, dirname
 
 import numpy as np
 import pytest
 
-from pymwalib.common import MWAVersion
+from pymwalib.aio import AsyncCorrelatorContext
+from pymwalib.arrow import get_metadata_record_batches, write_visibilities
+from pymwalib.analysis import PRODUCTS, compute_products, get_raw_dump_table, select_baselines
+from pymwalib.baseline import Baseline
+from pymwalib.chunked_store import ChunkedStore, write_chunked_store
+from pymwalib.common import GeometricDelaysApplied, MWAVersion
+from pymwalib.constants import MWA_LATITUDE_RADIANS
 from pymwalib.metafits_context import MetafitsContext
 from pymwalib.correlator_context import CorrelatorContext
+from pymwalib.gpubox_mmap import read_fits_hdus
+from pymwalib.errors import PymwalibOutputBufferError, PymwalibNoDataForTimestepAndCoarseChannelError, \
+    PymwalibInvalidArgumentError
+from pymwalib.mwalib import mwalib_library
+from pymwalib.parallel_reader import ParallelReader, ProcessPoolReader
+from pymwalib.uvfits import SPEED_OF_LIGHT_M_PER_S, UVFITS_POL_ORDER, get_hour_angle_dec_rad, get_local_xyz, get_lst_rad, \
+    get_phasors, get_uvw, write_uvfits
 
 
 def prefix_test_data(path):
     return path_join(dirname(__file__), "data", path)
 
 
+MWAX_METAFITS = prefix_test_data("1297526432_mwax/1297526432.metafits")
+MWAX_GPUBOXES = list(map(
+    prefix_test_data,
+    [
+        "1297526432_mwax/1297526432_20210216160014_ch117_000.fits",
+        "1297526432_mwax/1297526432_20210216160014_ch117_001.fits",
+        "1297526432_mwax/1297526432_20210216160014_ch118_000.fits",
+        "1297526432_mwax/1297526432_20210216160014_ch118_001.fits"
+    ]
+))
+
+
 @pytest.fixture
 def mwax_corr_context() -> CorrelatorContext:
-    return CorrelatorContext(
-        prefix_test_data("1297526432_mwax/1297526432.metafits"),
-        list(map(
-            prefix_test_data,
-            [
-                "1297526432_mwax/1297526432_20210216160014_ch117_000.fits",
-                "1297526432_mwax/1297526432_20210216160014_ch117_001.fits",
-                "1297526432_mwax/1297526432_20210216160014_ch118_000.fits",
-                "1297526432_mwax/1297526432_20210216160014_ch118_001.fits"
-            ]
-        ))
-    )
+    return CorrelatorContext(MWAX_METAFITS, MWAX_GPUBOXES)
 
 
 def test_metafits_context():
@@ -48,6 +64,32 @@ def test_mwax_antennas(mwax_corr_context: CorrelatorContext):
     assert mwax_corr_context.metafits_context.antennas[1].tile_id == 52
 
 
+def test_lazy_metafits_collections(mwax_corr_context: CorrelatorContext):
+    metafits_context = mwax_corr_context.metafits_context
+    assert "rf_inputs" not in metafits_context.__dict__
+    assert "antennas" not in metafits_context.__dict__
+    rf_inputs = metafits_context.rf_inputs
+    assert metafits_context.rf_inputs is rf_inputs
+    assert metafits_context.antennas[1].rf_input_y is rf_inputs[metafits_context.antenna_table["rfinput_y"][1]]
+    assert len(metafits_context.rf_inputs[0].dipole_delays) == metafits_context.rf_inputs[0].num_dipole_delays
+
+
+def test_antenna_and_rf_input_tables(mwax_corr_context: CorrelatorContext):
+    metafits_context = mwax_corr_context.metafits_context
+    antenna_table = metafits_context.antenna_table
+    rf_input_table = metafits_context.rf_input_table
+    assert len(antenna_table) == 2
+    assert len(rf_input_table) == 4
+    assert antenna_table["tile_id"].tolist() == [51, 52]
+    assert rf_input_table["pol"].tolist() == [r.pol for r in metafits_context.rf_inputs]
+    assert rf_input_table["vcs_order"].tolist() == [r.vcs_order for r in metafits_context.rf_inputs]
+    assert antenna_table["flagged"].tolist() == [a.rf_input_x.flagged or a.rf_input_y.flagged
+                                                 for a in metafits_context.antennas]
+    assert antenna_table["rec_number"].tolist() == [a.rf_input_x.rec_number for a in metafits_context.antennas]
+    assert not antenna_table.flags.writeable
+    assert not rf_input_table.flags.writeable
+
+
 def test_baselines(mwax_corr_context: CorrelatorContext):
     assert len(mwax_corr_context.metafits_context.baselines) == 3
     assert mwax_corr_context.metafits_context.baselines[0].ant1_index == 0
@@ -58,6 +100,36 @@ def test_baselines(mwax_corr_context: CorrelatorContext):
     assert mwax_corr_context.metafits_context.baselines[2].ant2_index == 1
 
 
+def test_baseline_index(mwax_corr_context: CorrelatorContext):
+    metafits_context = mwax_corr_context.metafits_context
+    assert metafits_context.baseline_ant1_index.tolist() == [0, 0, 1]
+    assert metafits_context.baseline_ant2_index.tolist() == [0, 1, 1]
+    assert metafits_context.auto_baseline_mask.tolist() == [True, False, True]
+    assert metafits_context.cross_baseline_mask.tolist() == [False, True, False]
+
+    assert metafits_context.baseline_index(0, 1) == 1
+    assert metafits_context.baseline_index(1, 0) == 1
+    assert metafits_context.baseline_index([0, 0, 1], [0, 1, 1]).tolist() == [0, 1, 2]
+    with pytest.raises(PymwalibInvalidArgumentError):
+        metafits_context.baseline_index(0, 2)
+
+    assert metafits_context.baselines_for_tiles([52]).tolist() == [2]
+    assert metafits_context.baselines_for_tiles([51, 52]).tolist() == [0, 1, 2]
+    assert metafits_context.baselines_for_tile_names(["Tile051"]).tolist() == \
+        metafits_context.baselines_for_tiles([51]).tolist() == [0]
+    with pytest.raises(PymwalibInvalidArgumentError):
+        metafits_context.baselines_for_tiles([99])
+    with pytest.raises(PymwalibInvalidArgumentError):
+        metafits_context.baselines_for_tile_names(["LBA1"])
+
+
+def test_baseline_index_formula():
+    # 256 tiles: every upper triangle (ant1, ant2) pair maps to its position in mwalib's baseline order
+    ant1_index, ant2_index = np.triu_indices(256)
+    assert len(ant1_index) == 32896
+    np.testing.assert_array_equal(Baseline.get_baseline_index(ant1_index, ant2_index, 256), np.arange(32896))
+
+
 def test_mwax_rfinputs(mwax_corr_context: CorrelatorContext):
     assert len(mwax_corr_context.metafits_context.rf_inputs) == 4
     assert mwax_corr_context.metafits_context.rf_inputs[0].tile_id == 51
@@ -100,6 +172,26 @@ def test_mwax_timesteps(mwax_corr_context: CorrelatorContext):
     assert mwax_corr_context.timesteps[591].unix_time_ms == 1613491509500
 
 
+def test_record_lists(mwax_corr_context: CorrelatorContext):
+    timesteps = mwax_corr_context.timesteps
+    assert timesteps.unix_time_ms[591] == timesteps[591].unix_time_ms
+    assert timesteps[-1].index == 591
+    provided = timesteps[mwax_corr_context.provided_timestep_indices]
+    assert provided.index.tolist() == mwax_corr_context.provided_timestep_indices
+    assert provided[2].gps_time_ms == timesteps[160].gps_time_ms
+
+    baselines = mwax_corr_context.metafits_context.baselines
+    cross = baselines[baselines.ant1_index != baselines.ant2_index]
+    assert len(cross) == 1
+    assert (cross[0].index, cross[0].ant1_index, cross[0].ant2_index) == (1, 0, 1)
+
+    coarse_channels = mwax_corr_context.coarse_channels
+    assert coarse_channels.rec_chan_number.tolist() == [117, 118]
+    assert [c.rec_chan_number for c in coarse_channels[1:]] == [118]
+    with pytest.raises(ValueError):
+        coarse_channels.chan_centre_hz[0] = 0
+
+
 def test_read_by_baseline(mwax_corr_context: CorrelatorContext):
     ts = 0
     chan = 0
@@ -118,6 +210,489 @@ def test_read_by_baseline(mwax_corr_context: CorrelatorContext):
     print(f"Correlator Sum by frequency == {sum_f}")
 
 
+def test_mmap_backend(mwax_corr_context: CorrelatorContext):
+    mmap_context = CorrelatorContext(MWAX_METAFITS, MWAX_GPUBOXES, backend="mmap")
+
+    for t, c in mwax_corr_context.get_provided_hdu_indices():
+        np.testing.assert_array_equal(mmap_context.read_by_baseline(t, c), mwax_corr_context.read_by_baseline(t, c))
+        np.testing.assert_array_equal(mmap_context.read_by_frequency(t, c), mwax_corr_context.read_by_frequency(t, c))
+
+    view = mmap_context.get_hdu_view(0, 0)
+    assert view.shape == mmap_context.get_hdu_shape("baseline")
+    assert not view.flags.writeable
+    np.testing.assert_array_equal(view.ravel(), mwax_corr_context.read_by_baseline(0, 0))
+
+    with pytest.raises(PymwalibNoDataForTimestepAndCoarseChannelError):
+        mmap_context.read_by_baseline(2, 0)
+    with pytest.raises(PymwalibInvalidArgumentError):
+        mwax_corr_context.get_hdu_view(0, 0)
+
+
+def test_read_into_out_buffer(mwax_corr_context: CorrelatorContext):
+    out = np.zeros(mwax_corr_context.num_timestep_coarse_chan_floats, dtype=np.float32)
+
+    data_by_bl = mwax_corr_context.read_by_baseline(0, 0, out=out)
+    assert data_by_bl is out
+    assert np.array_equal(out, mwax_corr_context.read_by_baseline(0, 0))
+
+    # Reuse the same buffer for another read
+    data_by_f = mwax_corr_context.read_by_frequency(0, 0, out=out)
+    assert data_by_f is out
+    assert np.array_equal(out, mwax_corr_context.read_by_frequency(0, 0))
+
+    with pytest.raises(PymwalibOutputBufferError):
+        mwax_corr_context.read_by_baseline(0, 0, out=np.zeros(1, dtype=np.float32))
+
+    with pytest.raises(PymwalibOutputBufferError):
+        mwax_corr_context.read_by_baseline(0, 0, out=np.zeros_like(out, dtype=np.float64))
+
+
+def test_read_cube(mwax_corr_context: CorrelatorContext):
+    cube, missing = mwax_corr_context.read_cube([0, 2], [0, 1])
+
+    assert cube.shape == (2, 2) + mwax_corr_context.get_hdu_shape("baseline")
+    assert cube.shape[2:] == (3, 2, 4, 2)
+    assert np.array_equal(cube[0, 1].ravel(), mwax_corr_context.read_by_baseline(0, 1))
+
+    # Timestep 2 was not provided so is flagged as missing and zero filled
+    assert not missing[0].any()
+    assert missing[1].all()
+    assert not cube[1].any()
+
+    cube_by_f, _ = mwax_corr_context.read_cube([0], [0], order="frequency")
+    assert cube_by_f.shape[2:] == (2, 3, 4, 2)
+    assert np.array_equal(cube_by_f[0, 0].transpose(1, 0, 2, 3), cube[0, 0])
+
+    # out is filled in place, and must be a writeable, C contiguous float32 array of the cube's shape
+    out = np.ones(cube.shape, dtype=np.float32)
+    assert mwax_corr_context.read_cube([0, 2], [0, 1], out=out)[0] is out
+    assert np.array_equal(out, cube)
+    read_only_out = np.zeros(cube.shape, dtype=np.float32)
+    read_only_out.flags.writeable = False
+    for bad_out in (np.zeros(cube.shape, dtype=np.float64), np.zeros((1,) + cube.shape[1:], dtype=np.float32),
+                    np.zeros(cube.shape[:-1] + (4,), dtype=np.float32)[..., ::2], read_only_out):
+        with pytest.raises(PymwalibOutputBufferError):
+            mwax_corr_context.read_cube([0, 2], [0, 1], out=bad_out)
+
+
+def test_get_complex_view(mwax_corr_context: CorrelatorContext):
+    data = mwax_corr_context.read_by_baseline(0, 0)
+    vis = mwax_corr_context.get_complex_view(data)
+
+    assert vis.dtype == np.complex64
+    assert vis.shape == (3, 2, 4)
+    assert np.shares_memory(vis, data)
+    # baseline 1, fine chan 1, pol XY
+    assert vis[1, 1, 1] == complex(data[26], data[27])
+
+    data_by_f = mwax_corr_context.read_by_frequency(0, 0)
+    vis_by_f = mwax_corr_context.get_complex_view(data_by_f, order="frequency")
+    assert vis_by_f.shape == (2, 3, 4)
+    assert np.array_equal(vis_by_f.transpose(1, 0, 2), vis)
+
+    cube, _ = mwax_corr_context.read_cube([0, 1], [0])
+    assert mwax_corr_context.get_complex_view(cube).shape == (2, 1, 3, 2, 4)
+
+    # Only plain, C contiguous float32 data can be viewed as complex64
+    masked_cube, _ = mwax_corr_context.read_cube([0, 1], [0], masked=True)
+    for bad_data in (data.view(np.int32), data.astype(np.float64), cube[:, :, ::2], masked_cube):
+        with pytest.raises(PymwalibInvalidArgumentError):
+            mwax_corr_context.get_complex_view(bad_data)
+
+    # ... and only a whole HDU, or a cube of them
+    for bad_data in (data[:-2], cube.reshape(2, 1, 3, 8, 2)):
+        with pytest.raises(PymwalibInvalidArgumentError, match="neither one HDU"):
+            mwax_corr_context.get_complex_view(bad_data)
+
+
+def test_parallel_reader(mwax_corr_context: CorrelatorContext):
+    items = [(t, c) for t in [0, 1, 2, 160] for c in [0, 1]]
+
+    with ParallelReader(mwax_corr_context, max_workers=4) as reader:
+        sums = reader.map(lambda t, c, data: np.sum(data, dtype=np.float64), items)
+
+    for (t, c), parallel_sum in zip(items, sums):
+        if t == 2:
+            assert parallel_sum is None
+        else:
+            assert parallel_sum == np.sum(mwax_corr_context.read_by_baseline(t, c), dtype=np.float64)
+
+    cube, missing = mwax_corr_context.read_cube([0, 1, 2, 160], [0, 1], max_workers=4)
+    serial_cube, serial_missing = mwax_corr_context.read_cube([0, 1, 2, 160], [0, 1])
+    assert np.array_equal(cube, serial_cube)
+    assert np.array_equal(missing, serial_missing)
+
+
+def test_parallel_reader_concurrent_reads(mwax_corr_context: CorrelatorContext):
+    # Many threads reading the same HDUs from one context at once get the same data as serial reads
+    items = [(t, c) for t in [0, 1, 160, 161] for c in [0, 1]] * 8
+
+    for read in ("read_by_baseline", "read_by_frequency"):
+        with ParallelReader(mwax_corr_context, max_workers=8) as reader:
+            datas = reader.map(lambda t, c, data: data.copy(), items, read)
+        for (t, c), data in zip(items, datas):
+            np.testing.assert_array_equal(data, getattr(mwax_corr_context, read)(t, c))
+
+
+def test_parallel_reader_hdu_cache():
+    context = CorrelatorContext(MWAX_METAFITS, MWAX_GPUBOXES, backend="mmap", hdu_cache_bytes=1 << 20)
+    items = [(t, c) for t in [0, 1] for c in [0, 1]] * 8
+
+    # Each HDU is read once, however many threads miss on it at the same time
+    with ParallelReader(context, max_workers=8) as reader:
+        sums = reader.map(lambda t, c, data: np.sum(data, dtype=np.float64), items)
+    assert (context.hdu_cache.misses, context.hdu_cache.hits) == (4, len(items) - 4)
+    for (t, c), parallel_sum in zip(items, sums):
+        assert parallel_sum == np.sum(context.read_by_baseline(t, c), dtype=np.float64)
+
+
+def test_iter_hdus(mwax_corr_context: CorrelatorContext):
+    hdus = [(t, c, data.copy()) for t, c, data in mwax_corr_context.iter_hdus(prefetch=2)]
+
+    # Only provided pairs with data are yielded (timestep 2 is not provided)
+    expected = []
+    for t in mwax_corr_context.provided_timestep_indices:
+        for c in mwax_corr_context.provided_coarse_chan_indices:
+            try:
+                mwax_corr_context.read_by_baseline(t, c)
+                expected.append((t, c))
+            except PymwalibNoDataForTimestepAndCoarseChannelError:
+                pass
+    assert [(t, c) for t, c, _ in hdus] == expected
+    assert (0, 0) in expected
+    for t, c, data in hdus:
+        np.testing.assert_array_equal(data, mwax_corr_context.read_by_baseline(t, c))
+
+    freq_order = [(t, c) for t, c, _ in mwax_corr_context.iter_hdus(order="freq", data_order="frequency")]
+    assert freq_order == sorted(freq_order, key=lambda item: (item[1], item[0]))
+
+    # Stopping early is fine
+    for t, c, data in mwax_corr_context.iter_hdus():
+        break
+
+
+def test_compute_products(mwax_corr_context: CorrelatorContext):
+    baselines = select_baselines(mwax_corr_context.metafits_context, 0, 1)
+    assert baselines.tolist() == [0, 1, 2]
+    assert select_baselines(mwax_corr_context.metafits_context, 0, 1, autos_only=True).tolist() == [0, 2]
+
+    results = compute_products(mwax_corr_context, [0, 1, 2], 0, baselines, products=PRODUCTS, max_workers=2)
+    assert results["missing"].tolist() == [False, False, True]
+
+    vis = mwax_corr_context.get_complex_view(mwax_corr_context.read_by_baseline(1, 0))
+    power = vis.real.astype(np.float64) ** 2 + vis.imag.astype(np.float64) ** 2
+    np.testing.assert_array_equal(results["vis"][1], vis)
+    np.testing.assert_allclose(results["power"][1], power)
+    np.testing.assert_allclose(results["ppd"][1], power.sum(axis=0))
+    np.testing.assert_allclose(results["grid"][1, 1, 0], power[1].sum(axis=0))
+    np.testing.assert_allclose(results["phase"][1, ..., 0], np.degrees(np.angle(vis[..., 0].astype(np.complex128))))
+    assert not results["vis"][2].any()
+
+    table = get_raw_dump_table(mwax_corr_context, [0, 1, 2], baselines, 0, results["vis"])
+    assert len(table) == 3 * 3 * 2
+    assert table["unix_time"][0] == mwax_corr_context.timesteps[0].unix_time_ms / 1000.0
+    np.testing.assert_array_equal(table["xx_r"][6:12], vis[..., 0].real.ravel())
+
+
+def test_read_averaged(mwax_corr_context: CorrelatorContext):
+    hdu_shape = mwax_corr_context.get_hdu_shape()
+
+    def read(t: int, c: int) -> np.ndarray:
+        return mwax_corr_context.read_by_baseline(t, c).reshape(hdu_shape).astype(np.float64)
+
+    averaged = list(mwax_corr_context.read_averaged(time_avg=2, freq_avg=2, timestep_indices=[0, 1, 2, 3]))
+
+    # Timesteps 2 and 3 have no data, so their group is skipped
+    assert len(averaged) == 1
+    timestep_indices, data, weights = averaged[0]
+    assert timestep_indices == [0, 1]
+    assert data.shape == (2, hdu_shape[0], hdu_shape[1] // 2, hdu_shape[2], 2)
+    assert data.dtype == np.float32
+    assert (weights == 4).all()
+
+    expected = (read(0, 1) + read(1, 1)).reshape(hdu_shape[0], hdu_shape[1] // 2, 2, hdu_shape[2], 2).sum(axis=2) / 4
+    np.testing.assert_allclose(data[1], expected, rtol=1e-6)
+
+    # Flagged baselines and fine channels are not included
+    flagged_fine_chans = np.zeros(hdu_shape[1], dtype=bool)
+    flagged_fine_chans[0] = True
+    _, data, weights = next(mwax_corr_context.read_averaged(time_avg=2, freq_avg=2, timestep_indices=[0, 1],
+                                                            flagged_baselines=[True, False, False],
+                                                            flagged_fine_chans=flagged_fine_chans))
+    assert (weights[:, 0] == 0).all() and not data[:, 0].any()
+    assert weights[0, 1, 0] == 2
+    np.testing.assert_allclose(data[0, 1, 0], (read(0, 0) + read(1, 0))[1, 1] / 2, rtol=1e-6)
+
+    # By default the metafits baseline flags are used
+    mwax_corr_context.metafits_context.baseline_flags = np.array([True, False, False])
+    _, _, weights = next(mwax_corr_context.read_averaged(time_avg=2, timestep_indices=[0, 1]))
+    assert (weights[:, 0] == 0).all() and (weights[:, 1:] == 2).all()
+    _, _, weights = next(mwax_corr_context.read_averaged(time_avg=2, timestep_indices=[0, 1],
+                                                         flagged_baselines=np.zeros(3, dtype=bool)))
+    assert (weights == 2).all()
+
+    with pytest.raises(PymwalibInvalidArgumentError):
+        next(mwax_corr_context.read_averaged(freq_avg=3))
+
+
+def test_flags(mwax_corr_context: CorrelatorContext):
+    metafits_context = mwax_corr_context.metafits_context
+    antenna_flagged = [a.rf_input_x.flagged or a.rf_input_y.flagged for a in metafits_context.antennas]
+    assert metafits_context.baseline_flags.tolist() == [antenna_flagged[b.ant1_index] or antenna_flagged[b.ant2_index]
+                                                        for b in metafits_context.baselines]
+
+    quack = mwax_corr_context.get_quack_timestep_flags()
+    assert quack.tolist() == [t.unix_time_ms < metafits_context.good_time_unix_ms for t in mwax_corr_context.timesteps]
+
+    timestep_indices = [0, 1, 2]
+    cube, missing = mwax_corr_context.read_cube(timestep_indices, [0, 1], masked=True)
+    flags = mwax_corr_context.get_flag_cube(timestep_indices, [0, 1], missing)
+    assert flags.shape == (3, 2, metafits_context.num_baselines)
+    assert flags[2].all()
+    for t, timestep_index in enumerate(timestep_indices):
+        for c in range(2):
+            expected = metafits_context.baseline_flags | quack[timestep_index] | missing[t, c]
+            np.testing.assert_array_equal(flags[t, c], expected)
+
+    assert isinstance(cube, np.ma.MaskedArray)
+    np.testing.assert_array_equal(cube.mask.any(axis=(3, 4, 5)), flags)
+    np.testing.assert_array_equal(mwax_corr_context.get_flag_cube(timestep_indices, [0, 1]), flags)
+
+
+def test_chunked_store(mwax_corr_context: CorrelatorContext, tmp_path):
+    timestep_indices = [0, 1, 2, 160, 161]
+    store = write_chunked_store(mwax_corr_context, str(tmp_path), timestep_indices, chunk_timesteps=2,
+                                chunk_baselines=2, max_workers=2)
+    cube, missing = mwax_corr_context.read_cube(timestep_indices, [0, 1])
+
+    assert store.shape == cube.shape
+    assert store.chunks == (2, 1, 2)
+    np.testing.assert_array_equal(store.missing, missing)
+    np.testing.assert_array_equal(store.read(), cube)
+    np.testing.assert_array_equal(store.read(timesteps=[4, 0], coarse_chans=1, baselines=slice(1, 3)),
+                                  cube[[4, 0]][:, [1]][:, :, 1:3])
+    with pytest.raises(PymwalibInvalidArgumentError):
+        store.read(timesteps=5)
+
+    # Reopening the store needs nothing but the store
+    reopened = ChunkedStore(str(tmp_path))
+    assert reopened.timestep_indices == timestep_indices
+    assert reopened.coarse_chan_indices == [0, 1]
+    assert MWAVersion(reopened.metadata["mwa_version"]) == mwax_corr_context.mwa_version
+    assert reopened.timesteps == mwax_corr_context.timesteps
+    assert reopened.coarse_channels == mwax_corr_context.coarse_channels
+    assert reopened.metafits_context.obs_id == mwax_corr_context.metafits_context.obs_id
+    assert reopened.metafits_context.baselines == mwax_corr_context.metafits_context.baselines
+    np.testing.assert_array_equal(reopened.read(baselines=[0]), cube[:, :, [0]])
+
+
+def test_chunked_store_without_metadata(tmp_path):
+    # The "mmap" backend does not need mwalib, so neither does this
+    context = CorrelatorContext(MWAX_METAFITS, MWAX_GPUBOXES, backend="mmap")
+    write_chunked_store(context, str(tmp_path), [0, 1])
+    assert ChunkedStore(str(tmp_path)).metafits_context.obs_id == 1297526432
+
+    os.remove(tmp_path / "metadata.npz")
+    with pytest.raises(PymwalibInvalidArgumentError, match="metadata.npz"):
+        ChunkedStore(str(tmp_path))
+
+
+def test_write_uvfits(mwax_corr_context: CorrelatorContext, tmp_path):
+    metafits_context = mwax_corr_context.metafits_context
+    filename = str(tmp_path / "1297526432.uvfits")
+    timestep_indices = [0, 1, 2, 160, 161]
+    num_groups = write_uvfits(mwax_corr_context, filename, timestep_indices, [0, 1], baselines=[1, 2])
+    averages = list(mwax_corr_context.read_averaged(1, 1, timestep_indices, [0, 1]))
+    # Timestep 2 has no data so is not written
+    assert num_groups == 4 * 2
+
+    hdus = read_fits_hdus(filename)
+    assert len(hdus) == 2
+    header = hdus[0].header
+    assert header["GROUPS"] and header["GCOUNT"] == num_groups and header["PCOUNT"] == 5
+    assert header["NAXIS4"] == 4
+    np.testing.assert_array_equal(header["CRVAL4"] + header["CDELT4"] * np.arange(4),
+                                  mwax_corr_context.get_fine_chan_freqs_hz_array([0, 1]))
+    assert hdus[1].header["EXTNAME"] == "AIPS AN"
+    assert hdus[1].header["NAXIS2"] == metafits_context.num_ants
+
+    groups = np.fromfile(filename, dtype=">f4", count=num_groups * (5 + 4 * 4 * 3),
+                         offset=hdus[0].data_offset).reshape(num_groups, -1)
+    vis = groups[:, 5:].reshape(num_groups, 4, 4, 3)
+    antenna_table = metafits_context.antenna_table
+    local_xyz = get_local_xyz(antenna_table["north_m"], antenna_table["east_m"], antenna_table["height_m"])
+    freqs_hz = mwax_corr_context.get_fine_chan_freqs_hz_array([0, 1])
+    for group, (timestep_indices, data, weights) in enumerate(averages):
+        centre_unix_time_ms = mwax_corr_context.timesteps.unix_time_ms[timestep_indices[0]] + \
+            metafits_context.corr_int_time_ms / 2
+        uvw = get_uvw(local_xyz, get_lst_rad(centre_unix_time_ms) - np.radians(metafits_context.ra_phase_center_deg),
+                      np.radians(metafits_context.dec_phase_center_deg)) / SPEED_OF_LIGHT_M_PER_S
+        for row, baseline in enumerate([1, 2]):
+            index = group * 2 + row
+            ant1 = metafits_context.baseline_ant1_index[baseline]
+            ant2 = metafits_context.baseline_ant2_index[baseline]
+            assert groups[index, 3] == 256 * (ant1 + 1) + ant2 + 1
+            np.testing.assert_allclose(groups[index, :3], uvw[ant1] - uvw[ant2], rtol=1e-6)
+
+            # The correlator phases to the zenith, where w is the height difference
+            delta_w = uvw[ant1, 2] - uvw[ant2, 2] - (antenna_table["height_m"][ant1] -
+                                                     antenna_table["height_m"][ant2]) / SPEED_OF_LIGHT_M_PER_S
+            expected = data[:, baseline].reshape(4, 4, 2).view(np.complex64)[..., 0] * \
+                np.exp(-2j * np.pi * delta_w * freqs_hz)[:, None]
+            np.testing.assert_allclose(vis[index, :, :, 0], expected.real[:, UVFITS_POL_ORDER], rtol=1e-5, atol=1e-5)
+            np.testing.assert_allclose(vis[index, :, :, 1], expected.imag[:, UVFITS_POL_ORDER], rtol=1e-5, atol=1e-5)
+            np.testing.assert_array_equal(vis[index, :, :, 2], np.repeat(weights[:, baseline].reshape(4, 1), 4, 1))
+        assert groups[group * 2, 4] == groups[group * 2 + 1, 4]
+
+    # Times are the centre of each timestep
+    unix_times_ms = [mwax_corr_context.timesteps.unix_time_ms[t] for t in [0, 1, 160, 161]]
+    np.testing.assert_allclose((header["PZERO5"] + groups[::2, 4].astype(np.float64) - 2440587.5) * 86400000 -
+                               metafits_context.corr_int_time_ms / 2, unix_times_ms, atol=1)
+
+
+def test_write_uvfits_geometric_delays(tmp_path):
+    def read_vis(context: CorrelatorContext, geometric_delays_applied: GeometricDelaysApplied) -> np.ndarray:
+        context.metafits_context.geometric_delays_applied = geometric_delays_applied.value
+        filename = str(tmp_path / f"{geometric_delays_applied.name}.uvfits")
+        num_groups = write_uvfits(context, filename, [0, 1], [0, 1], baselines=[1])
+        groups = np.fromfile(filename, dtype=">f4", count=num_groups * (5 + 4 * 4 * 3),
+                             offset=read_fits_hdus(filename)[0].data_offset).reshape(num_groups, -1)
+        vis = groups[:, 5:].reshape(num_groups, 4, 4, 3)
+        return vis[..., 0] + 1j * vis[..., 1]
+
+    context = CorrelatorContext(MWAX_METAFITS, MWAX_GPUBOXES, backend="mmap")
+    metafits_context = context.metafits_context
+    zenith_vis = read_vis(context, GeometricDelaysApplied.No)
+    np.testing.assert_array_equal(read_vis(context, GeometricDelaysApplied.Zenith), zenith_vis)
+
+    # Data phased to the tile pointing is only rotated from there, so relative to zenith phased data it is rotated by
+    # the w towards the zenith less the w towards the tile pointing
+    antenna_table = metafits_context.antenna_table
+    local_xyz = get_local_xyz(antenna_table["north_m"], antenna_table["east_m"], antenna_table["height_m"])
+    pointing_w = get_uvw(local_xyz, *get_hour_angle_dec_rad(np.radians(metafits_context.az_deg),
+                                                            np.radians(metafits_context.alt_deg),
+                                                            MWA_LATITUDE_RADIANS))[:, 2] / SPEED_OF_LIGHT_M_PER_S
+    zenith_w = antenna_table["height_m"] / SPEED_OF_LIGHT_M_PER_S
+    ant1, ant2 = metafits_context.baseline_ant1_index[1], metafits_context.baseline_ant2_index[1]
+    phasors = get_phasors(np.array([zenith_w[ant1] - zenith_w[ant2] - pointing_w[ant1] + pointing_w[ant2]]),
+                          context.get_fine_chan_freqs_hz_array([0, 1]))
+    np.testing.assert_allclose(read_vis(context, GeometricDelaysApplied.TilePointing),
+                               zenith_vis * phasors[..., None], rtol=1e-4, atol=1e-4)
+
+    with pytest.raises(PymwalibInvalidArgumentError, match="AzElTracking"):
+        read_vis(context, GeometricDelaysApplied.AzElTracking)
+
+
+def test_arrow_export(mwax_corr_context: CorrelatorContext, tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    metafits_context = mwax_corr_context.metafits_context
+
+    batches = get_metadata_record_batches(metafits_context)
+    assert batches["antennas"].column("tile_name").to_pylist() == [a.tile_name for a in metafits_context.antennas]
+    assert batches["rf_inputs"].num_rows == metafits_context.num_rf_inputs
+    assert batches["baselines"].column("ant2_index").to_pylist() == [b.ant2_index for b in metafits_context.baselines]
+
+    num_batches = write_visibilities(mwax_corr_context, str(tmp_path / "vis.arrow"), [0, 1, 2], [0, 1])
+    assert num_batches == 4
+    table = pa.ipc.open_file(str(tmp_path / "vis.arrow")).read_all()
+    assert table.num_rows == 4 * metafits_context.num_baselines
+    vis = np.asarray(table.column("vis").combine_chunks().flatten()).reshape(4, metafits_context.num_baselines, -1)
+    for batch, (t, c) in enumerate([(0, 0), (0, 1), (1, 0), (1, 1)]):
+        np.testing.assert_array_equal(vis[batch].ravel(), mwax_corr_context.read_by_baseline(t, c))
+
+    write_visibilities(mwax_corr_context, str(tmp_path / "vis.parquet"), [160], [0], baselines=[1])
+    rows = pq.read_table(str(tmp_path / "vis.parquet")).to_pylist()
+    assert [(row["timestep_index"], row["baseline"], row["ant1"], row["ant2"]) for row in rows] == [(160, 1, 0, 1)]
+    np.testing.assert_array_equal(np.array(rows[0]["vis"], dtype=np.float32),
+                                  mwax_corr_context.read_by_baseline(160, 0).reshape(3, -1)[1])
+
+
+def test_hdu_cache(monkeypatch):
+    context = CorrelatorContext(MWAX_METAFITS, MWAX_GPUBOXES, hdu_cache_bytes=2 * 3 * 2 * 4 * 2 * 4)
+    data = context.read_by_baseline(0, 0)
+    assert not data.flags.writeable
+    by_frequency = context.read_by_frequency(0, 0)
+
+    def no_read(*args):
+        raise AssertionError("the HDU should have come from the cache")
+
+    monkeypatch.setattr(mwalib_library, "mwalib_correlator_context_read_by_baseline", no_read)
+    monkeypatch.setattr(mwalib_library, "mwalib_correlator_context_read_by_frequency", no_read)
+    assert context.read_by_baseline(0, 0) is data
+    out = np.zeros_like(by_frequency)
+    np.testing.assert_array_equal(context.read_by_frequency(0, 0, out=out), by_frequency)
+    assert (context.hdu_cache.hits, context.hdu_cache.misses, context.hdu_cache.evictions) == (2, 2, 0)
+    monkeypatch.undo()
+
+    # The cache holds two HDUs, so reading a third evicts the least recently used
+    context.read_by_baseline(1, 0)
+    assert context.hdu_cache.evictions == 1
+    assert ("baseline", 0, 0) not in context.hdu_cache
+    assert CorrelatorContext(MWAX_METAFITS, MWAX_GPUBOXES).hdu_cache is None
+
+
+def test_async_correlator_context(mwax_corr_context: CorrelatorContext):
+    async def read_all():
+        async with await AsyncCorrelatorContext.open(MWAX_METAFITS, MWAX_GPUBOXES, max_workers=2) as context:
+            data = await asyncio.gather(context.read_by_baseline(0, 0), context.read_by_frequency(1, 1))
+            hdus = [(t, c) async for t, c, _ in context.iter_hdus(prefetch=2)]
+        return data, hdus
+
+    data, hdus = asyncio.run(read_all())
+
+    np.testing.assert_array_equal(data[0], mwax_corr_context.read_by_baseline(0, 0))
+    np.testing.assert_array_equal(data[1], mwax_corr_context.read_by_frequency(1, 1))
+    assert hdus == [(t, c) for t, c, _ in mwax_corr_context.iter_hdus()]
+
+
+def sum_hdu(timestep_index: int, coarse_chan_index: int, data) -> float:
+    return np.sum(data, dtype=np.float64)
+
+
+@pytest.mark.parametrize("context_kwargs", [None, {"backend": "mmap", "hdu_cache_bytes": 1 << 20}])
+def test_process_pool_reader(mwax_corr_context: CorrelatorContext, context_kwargs):
+    items = [(t, c) for t in [0, 1, 2, 160] for c in [0, 1]]
+
+    with ProcessPoolReader(CorrelatorContext, MWAX_METAFITS, MWAX_GPUBOXES, max_workers=2,
+                           context_kwargs=context_kwargs) as reader:
+        sums = reader.map(sum_hdu, items, chunksize=2)
+
+    for (t, c), hdu_sum in zip(items, sums):
+        if t == 2:
+            assert hdu_sum is None
+        else:
+            assert hdu_sum == np.sum(mwax_corr_context.read_by_baseline(t, c), dtype=np.float64)
+
+
+def test_metadata_cache(tmp_path, monkeypatch):
+    context = CorrelatorContext(MWAX_METAFITS, MWAX_GPUBOXES, cache_dir=str(tmp_path))
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+
+    def no_metadata_get(*args):
+        raise AssertionError("metadata should have come from the cache")
+
+    monkeypatch.setattr(mwalib_library, "mwalib_correlator_metadata_get", no_metadata_get)
+    monkeypatch.setattr(mwalib_library, "mwalib_metafits_metadata_get", no_metadata_get)
+    cached_context = CorrelatorContext(MWAX_METAFITS, MWAX_GPUBOXES, cache_dir=str(tmp_path))
+
+    assert cached_context.mwa_version == context.mwa_version
+    assert cached_context.provided_timestep_indices == context.provided_timestep_indices
+    assert cached_context.timesteps == context.timesteps
+    assert cached_context.coarse_channels == context.coarse_channels
+    assert cached_context.metafits_context.obs_id == context.metafits_context.obs_id
+    assert cached_context.metafits_context.sched_start_utc == context.metafits_context.sched_start_utc
+    assert cached_context.metafits_context.baselines == context.metafits_context.baselines
+    assert [r.dipole_delays for r in cached_context.metafits_context.rf_inputs] == \
+        [r.dipole_delays for r in context.metafits_context.rf_inputs]
+    np.testing.assert_array_equal(cached_context.metafits_context.antenna_table, context.metafits_context.antenna_table)
+
+    # The mwalib context is only created once a read needs it
+    assert not cached_context._correlator_context_object
+    np.testing.assert_array_equal(cached_context.read_by_baseline(0, 0), context.read_by_baseline(0, 0))
+    assert cached_context._correlator_context_object
+
+
 def test_common_timestep_indices(mwax_corr_context: CorrelatorContext):
     assert len(mwax_corr_context.common_timestep_indices) == mwax_corr_context.num_common_timesteps
     assert len(mwax_corr_context.common_timestep_indices) == 2
@@ -176,3 +751,20 @@ def test_corr_get_fine_chan_freqs_hz_array(mwax_corr_context: CorrelatorContext)
     assert len(freq_list) == 2
     assert freq_list[0] == 149120000.0
     assert freq_list[1] == 149760000.0
+
+
+def test_corr_get_fine_chan_freqs_hz_array_memoized(mwax_corr_context: CorrelatorContext):
+    freqs = mwax_corr_context.get_fine_chan_freqs_hz_array([0, 1])
+    assert isinstance(freqs, np.ndarray)
+    assert freqs.dtype == np.float64
+    assert not freqs.flags.writeable
+    np.testing.assert_array_equal(freqs[:2], mwax_corr_context.get_fine_chan_freqs_hz_array([0]))
+
+    # The same indices, however they are passed, return the same array without calling mwalib again
+    assert mwax_corr_context.get_fine_chan_freqs_hz_array((0, 1)) is freqs
+    assert mwax_corr_context.get_fine_chan_freqs_hz_array(np.array([0, 1])) is freqs
+
+    metafits_freqs = mwax_corr_context.metafits_context.metafits_fine_chan_freqs_hz
+    assert isinstance(metafits_freqs, np.ndarray)
+    assert metafits_freqs.dtype == np.float64
+    assert not metafits_freqs.flags.writeable
@@ -0,0 +1,120 @@
+import csv
+from os.path import join as path_join, dirname
+
+import numpy as np
+import pytest
+
+from pymwalib.common import MWAVersion
+from pymwalib.correlator_context import CorrelatorContext
+from pymwalib.errors import PymwalibFitsError
+from pymwalib.gpubox_mmap import MWAXGpuboxFile, MWAXGpuboxReader, read_fits_hdus, read_fits_table
+
+
+def prefix_test_data(path):
+    return path_join(dirname(__file__), "data", path)
+
+
+MWAX_METAFITS = prefix_test_data("1297526432_mwax/1297526432.metafits")
+MWAX_GPUBOXES = list(map(
+    prefix_test_data,
+    [
+        "1297526432_mwax/1297526432_20210216160014_ch117_000.fits",
+        "1297526432_mwax/1297526432_20210216160014_ch117_001.fits",
+        "1297526432_mwax/1297526432_20210216160014_ch118_000.fits",
+        "1297526432_mwax/1297526432_20210216160014_ch118_001.fits"
+    ]
+))
+
+
+def test_read_fits_hdus():
+    hdus = read_fits_hdus(MWAX_GPUBOXES[0])
+    # Primary HDU, then a visibility and weights HDU per timestep
+    assert len(hdus) == 5
+    assert hdus[0].header["OBSID"] == 1297526432
+    assert hdus[0].header["PROJID"] == "C001"
+    assert hdus[0].header["INTTIME"] == 0.5
+    assert hdus[0].shape == ()
+    assert hdus[1].shape == (3, 16)
+    assert hdus[1].dtype == np.dtype(">i4")
+    assert hdus[2].shape == (3, 4)
+    assert hdus[2].dtype == np.dtype(">f4")
+    assert hdus[1].data_offset % 2880 == 0
+
+
+def test_mwax_gpubox_file():
+    gpubox_file = MWAXGpuboxFile(MWAX_GPUBOXES[3])
+    assert gpubox_file.rec_chan_number == 118
+    assert gpubox_file.batch_number == 1
+    assert gpubox_file.unix_times_ms == [1613491294000, 1613491294500]
+
+    with pytest.raises(PymwalibFitsError):
+        MWAXGpuboxFile(prefix_test_data("1297526432_mwax/1297526432.metafits"))
+
+
+def test_read_fits_table():
+    tile_data_hdu = read_fits_hdus(MWAX_METAFITS)[1]
+    assert tile_data_hdu.header["EXTNAME"] == "TILEDATA"
+
+    tile_data = read_fits_table(MWAX_METAFITS, tile_data_hdu)
+    assert len(tile_data) == 4
+    assert tile_data["Tile"].tolist() == [52, 52, 51, 51]
+    assert tile_data["TileName"].tolist() == [b"Tile052", b"Tile052", b"Tile051", b"Tile051"]
+    assert tile_data["Pol"].tolist() == [b"Y", b"X", b"Y", b"X"]
+    assert tile_data["Gains"].shape == (4, 24)
+    assert tile_data["Gains"][3, :2].tolist() == [60, 61]
+
+    with pytest.raises(PymwalibFitsError):
+        read_fits_table(MWAX_METAFITS, read_fits_hdus(MWAX_METAFITS)[0])
+
+
+def test_mmap_correlator_context_without_mwalib():
+    # The "mmap" backend reads the metadata from the metafits and gpubox headers, so this needs no libmwalib
+    context = CorrelatorContext(MWAX_METAFITS, MWAX_GPUBOXES, backend="mmap")
+    metafits_context = context.metafits_context
+
+    assert context.mwa_version == MWAVersion.CorrMWAXv2
+    assert metafits_context.obs_id == 1297526432
+    assert metafits_context.calibrator_source == "HydA"
+    assert metafits_context.antenna_table["tile_id"].tolist() == [51, 52]
+    assert [(r.tile_id, r.pol) for r in metafits_context.rf_inputs] == [(51, "X"), (51, "Y"), (52, "X"), (52, "Y")]
+    assert metafits_context.rf_inputs[0].digital_gains == [60. / 64., 61. / 64.]
+    assert metafits_context.baseline_ant2_index.tolist() == [0, 1, 1]
+    assert metafits_context.metafits_fine_chan_freqs_hz.tolist() == [149120000., 149760000., 150400000., 151040000.]
+
+    # The same as mwalib gives (see test_correlator_context)
+    assert len(context.timesteps) == 592
+    assert context.timesteps.unix_time_ms[[0, 1, 591]].tolist() == [1613491214000, 1613491214500, 1613491509500]
+    assert context.coarse_channels.rec_chan_number.tolist() == [117, 118]
+    assert context.provided_timestep_indices == [0, 1, 160, 161]
+    assert context.common_timestep_indices == [0, 1]
+    assert context.common_good_timestep_indices == [1]
+    assert context.common_coarse_chan_indices == [0, 1]
+    assert context.num_timestep_coarse_chan_floats == 3 * 2 * 4 * 2
+    assert context.get_fine_chan_freqs_hz_array([1]).tolist() == [150400000., 151040000.]
+
+    # Reads convert the int32 visibilities to float32
+    data = context.read_by_baseline(0, 0)
+    assert data.dtype == np.float32
+    np.testing.assert_array_equal(data, context.get_hdu_view(0, 0).ravel())
+
+
+def test_mwax_gpubox_reader():
+    reader = MWAXGpuboxReader(MWAX_GPUBOXES)
+
+    visibilities = reader.get_visibilities(1613491214000, 117)
+    assert visibilities.shape == (3, 16)
+    assert not visibilities.flags.writeable
+    assert reader.get_weights(1613491214000, 117).shape == (3, 4)
+    assert reader.has_hdu(1613491294500, 118)
+    assert not reader.has_hdu(1613491215000, 117)
+    assert reader.get_visibilities(1613491215000, 117) is None
+
+    # Compare with the values mwalib dumped for coarse channel 0 (rec chan 117), timestep 0
+    with open(prefix_test_data("1297526432_mwax/1297526432_dump.csv")) as dump_file:
+        rows = [row for row in csv.DictReader(dump_file) if row["coarse_chan"] == "0" and row["timestep"] == "0"]
+    assert len(rows) == 6
+    for row in rows:
+        baseline = int(row["baseline"])
+        fine_chan = int(row["fine_chan"])
+        values = [int(row[column]) for column in list(row.keys())[4:]]
+        np.testing.assert_array_equal(visibilities[baseline, fine_chan * 8:(fine_chan + 1) * 8], values)
@@ -0,0 +1,112 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from pymwalib.errors import PymwalibInvalidArgumentError
+from pymwalib.hdu_cache import HDUCache
+
+
+def test_hdu_cache_lru():
+    cache = HDUCache(3 * 400)
+    for key in range(3):
+        cache.put((key,), np.full(100, key, dtype=np.float32))
+    assert len(cache) == 3 and cache.num_bytes == 1200
+
+    # Using key 0 makes key 1 the least recently used, so it goes first
+    assert cache.get((0,))[0] == 0
+    assert cache.get((5,)) is None
+    cache.put((3,), np.zeros(100, dtype=np.float32))
+    assert (1,) not in cache and (0,) in cache
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+
+    # Arrays bigger than the whole cache are not stored, or made read-only
+    data = np.zeros(1000, dtype=np.float32)
+    assert cache.put((4,), data) is data
+    assert (4,) not in cache and len(cache) == 3
+    assert data.flags.writeable
+
+    cache.clear()
+    assert len(cache) == 0 and cache.num_bytes == 0
+
+    with pytest.raises(PymwalibInvalidArgumentError):
+        HDUCache(-1)
+
+
+def test_hdu_cache_read():
+    cache = HDUCache(1 << 20)
+    reads = []
+
+    def read(out):
+        reads.append(out)
+        data = np.arange(10, dtype=np.float32) if out is None else out
+        data[:] = np.arange(10)
+        return data
+
+    data = cache.read(("baseline", 0, 0), read)
+    assert not data.flags.writeable
+    assert cache.read(("baseline", 0, 0), read) is data
+    assert len(reads) == 1
+
+    out = np.zeros(10, dtype=np.float32)
+    assert cache.read(("baseline", 0, 0), read, out) is out
+    np.testing.assert_array_equal(out, data)
+
+    # On a miss with out, out is filled and stays writeable and a copy is cached
+    out = np.zeros(10, dtype=np.float32)
+    assert cache.read(("baseline", 1, 0), read, out) is out
+    assert out.flags.writeable
+    assert cache.get(("baseline", 1, 0)) is not out
+    assert len(reads) == 2
+
+
+def test_hdu_cache_read_too_big():
+    cache = HDUCache(10)
+
+    def read(out):
+        data = np.ones(10, dtype=np.float32) if out is None else out
+        data[:] = 1
+        return data
+
+    # Data too big to cache is returned writeable, and with out, only out is filled
+    data = cache.read(("baseline", 0, 0), read)
+    assert data.flags.writeable
+    out = np.zeros(10, dtype=np.float32)
+    assert cache.read(("baseline", 0, 0), read, out) is out
+    assert out.flags.writeable and (out == 1).all()
+    assert len(cache) == 0 and cache.num_bytes == 0
+    assert cache.misses == 2
+
+
+def test_hdu_cache_read_in_flight():
+    cache = HDUCache(1 << 20)
+    reads = []
+    reading = threading.Event()
+    release = threading.Event()
+
+    def read(out):
+        reads.append(out)
+        reading.set()
+        release.wait()
+        return np.arange(10, dtype=np.float32)
+
+    # Threads missing on a key which is being read wait for that read instead of reading it again
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first = executor.submit(cache.read, ("baseline", 0, 0), read)
+        reading.wait()
+        others = [executor.submit(cache.read, ("baseline", 0, 0), read) for _ in range(3)]
+        release.set()
+        results = [first.result()] + [other.result() for other in others]
+
+    assert len(reads) == 1
+    assert all(result is results[0] for result in results)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # A read which raises does not leave its key marked as being read
+    def failing_read(out):
+        raise OSError("read failed")
+
+    with pytest.raises(OSError):
+        cache.read(("baseline", 1, 0), failing_read)
+    assert cache.read(("baseline", 1, 0), read)[9] == 9
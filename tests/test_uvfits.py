@@ -0,0 +1,86 @@
+import math
+from datetime import datetime, timezone
+
+import numpy as np
+
+from pymwalib.constants import MWA_LATITUDE_RADIANS
+from pymwalib.gpubox_mmap import parse_fits_header
+from pymwalib.uvfits import encode_baseline, get_gmst_deg, get_hour_angle_dec_rad, get_local_xyz, get_lst_rad, get_phasors, \
+    get_uvw, make_card, make_header
+
+
+def test_make_header():
+    header = make_header([make_card("SIMPLE", True), make_card("NAXIS", 7), make_card("CRVAL4", 1.5e8),
+                          make_card("OBJECT", "O'Brien", "source")])
+    assert len(header) == 2880
+    assert parse_fits_header(header) == ({"SIMPLE": True, "NAXIS": 7, "CRVAL4": 1.5e8, "OBJECT": "O'Brien"}, True)
+
+
+def test_get_uvw():
+    # An east-west baseline, looking at the meridian on the equator, is all u
+    np.testing.assert_allclose(get_uvw(get_local_xyz([0.0], [10.0], [0.0]), 0.0, 0.0), [[10.0, 0.0, 0.0]])
+
+    # A north-south baseline, looking at the zenith, is all v
+    np.testing.assert_allclose(get_uvw(get_local_xyz([10.0], [0.0], [0.0]), 0.0, MWA_LATITUDE_RADIANS),
+                               [[0.0, 10.0, 0.0]], atol=1e-12)
+
+    # A vertical baseline, looking at the zenith, is all w
+    np.testing.assert_allclose(get_uvw(get_local_xyz([0.0], [0.0], [10.0]), 0.0, MWA_LATITUDE_RADIANS),
+                               [[0.0, 0.0, 10.0]], atol=1e-12)
+
+    # The length of a baseline does not change with direction
+    uvw = get_uvw(get_local_xyz([3.0], [4.0], [12.0]), 0.7, -0.3)
+    assert math.isclose(np.linalg.norm(uvw), 13.0)
+
+
+def test_get_gmst_deg():
+    # 2000-01-01, at 0h and later in the day
+    assert math.isclose(get_gmst_deg(2451544.5), 99.96779469, abs_tol=1e-6)
+    assert math.isclose(get_gmst_deg(2451544.9), 99.96779469, abs_tol=1e-6)
+
+
+def test_get_lst_rad():
+    # 1297526432 (tests/data/1297526432_mwax) starts at 2021-02-16T16:00:14 UTC and is 296s long; its metafits LST,
+    # 144.2086 degrees, is the LST at the midpoint
+    start_unix_time_ms = datetime(2021, 2, 16, 16, 0, 14, tzinfo=timezone.utc).timestamp() * 1000
+    assert math.isclose(math.degrees(get_lst_rad(start_unix_time_ms)), 143.595, abs_tol=1e-3)
+    midpoint_lst_deg = math.degrees(get_lst_rad(start_unix_time_ms + 148000))
+    assert math.isclose(midpoint_lst_deg, 144.213, abs_tol=1e-3)
+    assert math.isclose(midpoint_lst_deg, 144.20861853754, abs_tol=0.01)
+
+    # An east-west baseline towards the phase centre (RA 139.524, Dec -12.0956) at the midpoint
+    hour_angle_rad = math.radians(midpoint_lst_deg - 139.524)
+    dec_rad = math.radians(-12.0956)
+    np.testing.assert_allclose(get_uvw(get_local_xyz([0.0], [10.0], [0.0]), hour_angle_rad, dec_rad),
+                               [[10 * math.cos(hour_angle_rad), 10 * math.sin(dec_rad) * math.sin(hour_angle_rad),
+                                 -10 * math.cos(dec_rad) * math.sin(hour_angle_rad)]])
+
+
+def test_get_hour_angle_dec_rad():
+    # The zenith is on the meridian at the latitude's declination
+    np.testing.assert_allclose(get_hour_angle_dec_rad(0.0, math.pi / 2, MWA_LATITUDE_RADIANS), (0.0, MWA_LATITUDE_RADIANS),
+                               atol=1e-12)
+
+    # w towards a direction is the projection on to it, so a unit vector along the az/el direction is all w
+    az_rad, alt_rad = math.radians(30.0), math.radians(60.0)
+    local_xyz = get_local_xyz([math.cos(alt_rad) * math.cos(az_rad)], [math.cos(alt_rad) * math.sin(az_rad)],
+                              [math.sin(alt_rad)])
+    hour_angle_rad, dec_rad = get_hour_angle_dec_rad(az_rad, alt_rad, MWA_LATITUDE_RADIANS)
+    assert hour_angle_rad < 0
+    np.testing.assert_allclose(get_uvw(local_xyz, hour_angle_rad, dec_rad), [[0.0, 0.0, 1.0]], atol=1e-12)
+
+
+def test_get_phasors():
+    freqs_hz = np.array([100e6, 150e6])
+    np.testing.assert_allclose(get_phasors(np.zeros(2), freqs_hz), np.ones((2, 2)))
+
+    # A w change of a quarter cycle at 100 MHz is a quarter cycle back at 100 MHz and 3/8 of a cycle at 150 MHz
+    phasors = get_phasors(np.array([0.25 / 100e6]), freqs_hz)
+    assert phasors.dtype == np.complex64
+    np.testing.assert_allclose(phasors, [[-1j, np.exp(-0.75j * np.pi)]], atol=1e-6)
+
+
+def test_encode_baseline():
+    assert encode_baseline(1, 2, 128) == 258
+    np.testing.assert_array_equal(encode_baseline(np.array([1, 256]), np.array([2, 256]), 256),
+                                  [2048 + 2 + 65536, 2048 * 256 + 256 + 65536])
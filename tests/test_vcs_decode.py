@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pymwalib.common import MWAVersion
+from pymwalib.errors import PymwalibInvalidArgumentError, PymwalibOutputBufferError
+from pymwalib.vcs_decode import decode_legacy, decode_legacy_int8, decode_mwax, decode_voltages, \
+    get_mwax_int8_pairs, get_voltage_shape
+
+
+def test_decode_legacy():
+    samples = np.array([0x00, 0x12, 0xF7, 0x8F, 0x7F], dtype=np.uint8)
+    np.testing.assert_array_equal(decode_legacy(samples), [0, 1 + 2j, -1 + 7j, -8 - 1j, 7 - 1j])
+    np.testing.assert_array_equal(decode_legacy(samples.tobytes(), real_high_nibble=False),
+                                  [0, 2 + 1j, 7 - 1j, -1 - 8j, -1 + 7j])
+    assert decode_legacy_int8(samples.view(np.int8)).tolist() == [[0, 0], [1, 2], [-1, 7], [-8, -1], [7, -1]]
+
+    # Every byte value decodes to its two sign extended nibbles
+    codes = np.arange(256, dtype=np.uint8)
+    decoded = decode_legacy(codes, (16, 16))
+    assert decoded.dtype == np.complex64
+    np.testing.assert_array_equal(decoded.real.ravel(), ((codes.astype(np.int16) >> 4) + 8) % 16 - 8)
+    np.testing.assert_array_equal(decoded.imag.ravel(), ((codes.astype(np.int16) & 0xF) + 8) % 16 - 8)
+
+    out = np.empty((16, 16), dtype=np.complex64)
+    assert decode_legacy(codes, (16, 16), out) is out
+    with pytest.raises(PymwalibOutputBufferError):
+        decode_legacy(codes, (16, 16), np.empty((16, 16), dtype=np.complex128))
+    with pytest.raises(PymwalibInvalidArgumentError):
+        decode_legacy(codes, (16, 15))
+
+
+def test_decode_mwax():
+    samples = np.array([1, -2, 127, -128, 0, 5], dtype=np.int8)
+    np.testing.assert_array_equal(decode_mwax(samples), [1 - 2j, 127 - 128j, 5j])
+    pairs = get_mwax_int8_pairs(samples, (3,))
+    assert pairs.shape == (3, 2)
+    assert np.shares_memory(pairs, samples)
+
+    out = np.empty((1, 3), dtype=np.complex64)
+    assert decode_mwax(samples, (1, 3), out) is out
+    with pytest.raises(PymwalibInvalidArgumentError):
+        decode_mwax(samples[:5])
+
+
+def test_decode_voltages():
+    legacy = SimpleNamespace(mwa_version=MWAVersion.VCSLegacyRecombined, voltage_block_size_bytes=10 * 4 * 6,
+                             num_samples_per_voltage_block=10, num_fine_chans_per_coarse=4)
+    data = np.random.default_rng(0).integers(-128, 128, 2 * 10 * 4 * 6, dtype=np.int8)
+    assert get_voltage_shape(legacy, data.nbytes) == (2, 10, 4, 6)
+    np.testing.assert_array_equal(decode_voltages(legacy, data), decode_legacy(data).reshape(2, 10, 4, 6))
+
+    mwax = SimpleNamespace(mwa_version=MWAVersion.VCSMWAXv2, voltage_block_size_bytes=3 * 8 * 1 * 2,
+                           num_samples_per_voltage_block=8, num_fine_chans_per_coarse=1)
+    data = data[:4 * 3 * 8 * 2]
+    assert get_voltage_shape(mwax, data.nbytes) == (4, 3, 8, 1)
+    decoded = decode_voltages(mwax, data)
+    assert decoded[1, 2, 3, 0] == data[((1 * 3 + 2) * 8 + 3) * 2] + 1j * data[((1 * 3 + 2) * 8 + 3) * 2 + 1]
+
+    with pytest.raises(PymwalibInvalidArgumentError):
+        get_voltage_shape(mwax, data.nbytes - 1)
@@ -0,0 +1,309 @@
+import os
+import shutil
+from os.path import join as path_join, dirname
+
+import numpy as np
+import pytest
+
+from pymwalib.common import MWAVersion
+from pymwalib.errors import PymwalibInvalidArgumentError, PymwalibNoDataForTimestepAndCoarseChannelError, \
+    PymwalibOutputBufferError
+from pymwalib.gpubox_mmap import get_fits_table_dtype, read_fits_hdus
+from pymwalib.voltage_context import VoltageContext
+
+
+def prefix_test_data(path):
+    return path_join(dirname(__file__), "data", path)
+
+
+# Voltage files are generated for the observation of this metafits, which has 4 rf_inputs and receiver channels
+# 117 and 118
+MWAX_METAFITS = prefix_test_data("1297526432_mwax/1297526432.metafits")
+OBS_ID = 1297526432
+REC_CHAN_NUMBER = 117
+
+# MWAX VCS .sub files are 8 second timesteps of 160 voltage blocks of 64000 (2 byte) samples per rf_input, after a
+# 4096 byte header and a delay block the size of a voltage block
+HEADER_SIZE = 4096
+VOLTAGE_BLOCK_SIZE = 64000 * 4 * 2
+DELAY_BLOCK_SIZE = VOLTAGE_BLOCK_SIZE
+NUM_BLOCKS_PER_TIMESTEP = 160
+TIMESTEP_DURATION_S = 8
+BYTES_PER_SECOND = VOLTAGE_BLOCK_SIZE * NUM_BLOCKS_PER_TIMESTEP // TIMESTEP_DURATION_S
+
+# Legacy recombined VCS .dat files are 1 second of (sample, fine_chan, input) bytes. The metafits Input numbers are
+# replaced with LEGACY_INPUTS (in TILEDATA row order), which puts the rf_inputs at file inputs LEGACY_VCS_ORDER
+LEGACY_SHAPE = (10000, 128, 4)
+LEGACY_INPUTS = [32, 0, 48, 16]
+LEGACY_VCS_ORDER = [1, 3, 0, 2]
+
+
+def write_legacy_metafits(path) -> str:
+    """Writes a copy of the metafits with TILEDATA Input numbers of a 4 input legacy observation"""
+    filename = str(path / f"{OBS_ID}_legacy.metafits")
+    shutil.copyfile(MWAX_METAFITS, filename)
+    tile_data_hdu = read_fits_hdus(filename)[1]
+    tile_data = np.memmap(filename, dtype=get_fits_table_dtype(tile_data_hdu.header), mode="r+",
+                          offset=tile_data_hdu.data_offset, shape=(tile_data_hdu.header["NAXIS2"],))
+    tile_data["Input"] = LEGACY_INPUTS
+    tile_data.flush()
+    return filename
+
+
+def get_subfile_name(path, gps_time: int) -> str:
+    return str(path / f"{OBS_ID}_{gps_time}_{REC_CHAN_NUMBER}.sub")
+
+
+def write_subfile(path, gps_time: int) -> str:
+    """Writes a (sparse) full size subfile, in which each voltage block starts with its GPS time and block number"""
+    filename = get_subfile_name(path, gps_time)
+    with open(filename, "wb") as subfile:
+        subfile.write(b" " * HEADER_SIZE)
+        subfile.truncate(HEADER_SIZE + DELAY_BLOCK_SIZE + NUM_BLOCKS_PER_TIMESTEP * VOLTAGE_BLOCK_SIZE)
+        for block in range(NUM_BLOCKS_PER_TIMESTEP):
+            subfile.seek(HEADER_SIZE + DELAY_BLOCK_SIZE + block * VOLTAGE_BLOCK_SIZE)
+            subfile.write(np.array([gps_time, block], dtype=np.uint64).tobytes())
+    return filename
+
+
+def make_mwax_context(tmp_path, gps_times: list, **kwargs) -> VoltageContext:
+    """Returns an MWAX VCS VoltageContext with the "mmap" backend over subfiles written at each of gps_times"""
+    return VoltageContext(MWAX_METAFITS, [write_subfile(tmp_path, gps_time) for gps_time in gps_times],
+                          backend="mmap", **kwargs)
+
+
+def write_dat_file(path, gps_second: int) -> str:
+    """Writes a (sparse) full size .dat file, whose first sample has a different byte for each fine channel and
+       input"""
+    filename = str(path / f"{OBS_ID}_{gps_second}_ch{REC_CHAN_NUMBER}.dat")
+    with open(filename, "wb") as dat_file:
+        dat_file.write(((np.arange(np.prod(LEGACY_SHAPE[1:])) + gps_second) % 256 - 128).astype(np.int8).tobytes())
+        dat_file.truncate(int(np.prod(LEGACY_SHAPE)))
+    return filename
+
+
+def make_legacy_context(tmp_path, gps_seconds: list) -> VoltageContext:
+    """Returns a legacy recombined VCS VoltageContext with the "mmap" backend over .dat files written for each of
+       gps_seconds"""
+    return VoltageContext(write_legacy_metafits(tmp_path),
+                          [write_dat_file(tmp_path, gps_second) for gps_second in gps_seconds], backend="mmap")
+
+
+def get_expected_seconds(path, gps_second_start: int, gps_second_count: int) -> np.ndarray:
+    """Returns the bytes of gps_second_count seconds, read second by second from the subfiles in path"""
+    seconds = []
+    for gps_second in range(gps_second_start, gps_second_start + gps_second_count):
+        timestep_gps_time = gps_second - (gps_second - OBS_ID) % TIMESTEP_DURATION_S
+        seconds.append(np.fromfile(get_subfile_name(path, timestep_gps_time), dtype=np.int8, count=BYTES_PER_SECOND,
+                                   offset=HEADER_SIZE + DELAY_BLOCK_SIZE +
+                                   (gps_second - timestep_gps_time) * BYTES_PER_SECOND))
+    return np.concatenate(seconds)
+
+
+def test_mmap_voltage_context_without_mwalib(tmp_path):
+    # The "mmap" backend reads the metadata from the metafits and the subfile names, so this needs no libmwalib
+    context = make_mwax_context(tmp_path, [OBS_ID + 8, OBS_ID + 16])
+
+    assert context.mwa_version == MWAVersion.VCSMWAXv2
+    assert context.timestep_duration_ms == TIMESTEP_DURATION_S * 1000
+    assert context.num_timesteps == 37
+    assert context.timesteps.gps_time_ms[:3].tolist() == [OBS_ID * 1000, (OBS_ID + 8) * 1000, (OBS_ID + 16) * 1000]
+    assert context.provided_timestep_indices == [1, 2]
+    assert context.common_timestep_indices == [1, 2]
+    assert context.provided_coarse_chan_indices == [0]
+    assert context.common_coarse_chans == [0]
+    assert context.coarse_channels.rec_chan_number.tolist() == [117, 118]
+    assert context.voltage_block_size_bytes == VOLTAGE_BLOCK_SIZE
+    assert context.delay_block_size_bytes == DELAY_BLOCK_SIZE
+    assert context.num_voltage_blocks_per_second == NUM_BLOCKS_PER_TIMESTEP // TIMESTEP_DURATION_S
+    assert context.expected_voltage_data_file_size_bytes == os.path.getsize(get_subfile_name(tmp_path, OBS_ID + 8))
+    np.testing.assert_array_equal(context.get_fine_chan_freqs_hz_array([0, 1]), [117 * 1.28e6, 118 * 1.28e6])
+
+    # Its metadata is cached without the mwalib version, so a cache hit needs no libmwalib either
+    filenames = [get_subfile_name(tmp_path, OBS_ID + 8), get_subfile_name(tmp_path, OBS_ID + 16)]
+    cache_dir = str(tmp_path / "cache")
+    VoltageContext(MWAX_METAFITS, filenames, cache_dir=cache_dir, backend="mmap")
+    assert len(os.listdir(cache_dir)) == 1
+    cached_context = VoltageContext(MWAX_METAFITS, filenames, cache_dir=cache_dir, backend="mmap")
+    assert cached_context.timesteps.table.tolist() == context.timesteps.table.tolist()
+    assert cached_context.common_coarse_chans == [0]
+
+    with pytest.raises(PymwalibInvalidArgumentError):
+        VoltageContext(MWAX_METAFITS, [str(tmp_path / "not_a_subfile.dat")], backend="mmap")
+
+
+def test_mmap_read_file(tmp_path):
+    context = make_mwax_context(tmp_path, [OBS_ID, OBS_ID + 8])
+    blocks = context._voltage_file_reader.get_voltage_blocks(OBS_ID + 8, REC_CHAN_NUMBER)
+    expected = get_expected_seconds(tmp_path, OBS_ID + 8, TIMESTEP_DURATION_S)
+
+    # Without out, a read-only view of the subfile
+    data = context.read_file(1, 0)
+    assert data.shape == (NUM_BLOCKS_PER_TIMESTEP * VOLTAGE_BLOCK_SIZE,)
+    assert not data.flags.writeable
+    assert np.shares_memory(data, blocks)
+    np.testing.assert_array_equal(data, expected)
+
+    out = np.zeros(data.size, dtype=np.int8)
+    assert context.read_file(1, 0, out=out) is out
+    np.testing.assert_array_equal(out, expected)
+
+    with pytest.raises(PymwalibOutputBufferError):
+        context.read_file(1, 0, out=np.zeros(data.size - 1, dtype=np.int8))
+    # No subfile was written for the next timestep, or the other coarse channel
+    for timestep_index, coarse_chan_index in ((2, 0), (1, 1)):
+        with pytest.raises(PymwalibNoDataForTimestepAndCoarseChannelError):
+            context.read_file(timestep_index, coarse_chan_index)
+
+
+def test_mmap_read_second(tmp_path):
+    context = make_mwax_context(tmp_path, [OBS_ID, OBS_ID + 8])
+    blocks = context._voltage_file_reader.get_voltage_blocks(OBS_ID, REC_CHAN_NUMBER)
+
+    # Seconds within one subfile are a read-only view of it
+    data = context.read_second(OBS_ID + 2, 3, 0)
+    assert not data.flags.writeable
+    assert np.shares_memory(data, blocks)
+    np.testing.assert_array_equal(data, get_expected_seconds(tmp_path, OBS_ID + 2, 3))
+
+    # Seconds across subfiles are concatenated into one buffer, or out
+    data = context.read_second(OBS_ID + 6, 4, 0)
+    assert data.flags.writeable
+    np.testing.assert_array_equal(data, get_expected_seconds(tmp_path, OBS_ID + 6, 4))
+    out = np.zeros(4 * BYTES_PER_SECOND, dtype=np.int8)
+    assert context.read_second(OBS_ID + 6, 4, 0, out=out) is out
+    np.testing.assert_array_equal(out, data)
+
+    with pytest.raises(PymwalibOutputBufferError):
+        context.read_second(OBS_ID + 6, 4, 0, out=np.zeros(3 * BYTES_PER_SECOND, dtype=np.int8))
+    for gps_second_start, gps_second_count in ((OBS_ID - 1, 2), (OBS_ID + 14, 3)):
+        with pytest.raises(PymwalibNoDataForTimestepAndCoarseChannelError):
+            context.read_second(gps_second_start, gps_second_count, 0)
+
+
+def test_legacy_voltage_context(tmp_path):
+    context = make_legacy_context(tmp_path, [OBS_ID + 1, OBS_ID + 2])
+
+    assert context.mwa_version == MWAVersion.VCSLegacyRecombined
+    assert context.timestep_duration_ms == 1000
+    assert context.provided_timestep_indices == [1, 2]
+    assert (context.num_samples_per_voltage_block, context.num_fine_chans_per_coarse) == LEGACY_SHAPE[:2]
+    assert context.voltage_block_size_bytes == np.prod(LEGACY_SHAPE)
+    assert context.metafits_context.rf_input_table["vcs_order"].tolist() == LEGACY_VCS_ORDER
+    fine_chan_freqs_hz = context.get_fine_chan_freqs_hz_array([0])
+    assert len(fine_chan_freqs_hz) == LEGACY_SHAPE[1]
+    np.testing.assert_allclose(np.diff(fine_chan_freqs_hz), 10e3)
+
+
+def test_get_legacy_second_view(tmp_path):
+    context = make_legacy_context(tmp_path, [OBS_ID, OBS_ID + 1])
+    blocks = context._voltage_file_reader.get_voltage_blocks(OBS_ID + 1, REC_CHAN_NUMBER)
+
+    view = context.get_legacy_second_view(OBS_ID + 1, 0)
+    assert view.shape == LEGACY_SHAPE
+    assert not view.flags.writeable
+    assert np.shares_memory(view, blocks)
+    np.testing.assert_array_equal(view, np.fromfile(tmp_path / f"{OBS_ID}_{OBS_ID + 1}_ch{REC_CHAN_NUMBER}.dat",
+                                                    dtype=np.int8).reshape(LEGACY_SHAPE))
+
+    with pytest.raises(PymwalibNoDataForTimestepAndCoarseChannelError):
+        context.get_legacy_second_view(OBS_ID + 2, 0)
+    with pytest.raises(PymwalibInvalidArgumentError):
+        make_mwax_context(tmp_path, [OBS_ID]).get_legacy_second_view(OBS_ID, 0)
+
+
+def test_read_legacy_seconds(tmp_path):
+    context = make_legacy_context(tmp_path, [OBS_ID, OBS_ID + 1, OBS_ID + 2])
+    views = [context.get_legacy_second_view(gps_second, 0) for gps_second in (OBS_ID + 1, OBS_ID + 2)]
+
+    # Input i of the result is rf_input i, which is at input vcs_order[i] of the file
+    data = context.read_legacy_seconds(OBS_ID + 1, 2, 0)
+    assert data.shape == (2,) + LEGACY_SHAPE
+    assert not np.shares_memory(data, views[0])
+    for second, view in enumerate(views):
+        for rf_input, vcs_order in enumerate(LEGACY_VCS_ORDER):
+            np.testing.assert_array_equal(data[second, :, :, rf_input], view[:, :, vcs_order])
+
+    np.testing.assert_array_equal(context.read_legacy_seconds(OBS_ID + 1, 2, 0, rf_input_order=False), views)
+
+    # out can be reused for each read
+    out = np.empty((2,) + LEGACY_SHAPE, dtype=np.int8)
+    assert context.read_legacy_seconds(OBS_ID + 1, 2, 0, out=out) is out
+    np.testing.assert_array_equal(out, data)
+    assert context.read_legacy_seconds(OBS_ID, 2, 0, out=out) is out
+    np.testing.assert_array_equal(out[1], data[0])
+    read_only_out = np.empty_like(out)
+    read_only_out.flags.writeable = False
+    for bad_out in (np.empty((1,) + LEGACY_SHAPE, dtype=np.int8), np.empty_like(out, dtype=np.uint8),
+                    np.empty((2,) + LEGACY_SHAPE[:-1] + (8,), dtype=np.int8)[..., ::2], read_only_out):
+        with pytest.raises(PymwalibOutputBufferError):
+            context.read_legacy_seconds(OBS_ID + 1, 2, 0, out=bad_out)
+
+    # read_second() concatenates the 1 second files in file order
+    np.testing.assert_array_equal(context.read_second(OBS_ID + 1, 2, 0), np.concatenate(views, axis=None))
+
+    with pytest.raises(PymwalibInvalidArgumentError):
+        context.read_legacy_seconds(OBS_ID, 0, 0)
+    with pytest.raises(PymwalibNoDataForTimestepAndCoarseChannelError):
+        context.read_legacy_seconds(OBS_ID + 2, 2, 0)
+
+
+def test_get_second_chunks(tmp_path):
+    context = make_mwax_context(tmp_path, [OBS_ID])
+
+    assert context.get_second_chunks(OBS_ID, OBS_ID + 8, 0, 3) == \
+        [(OBS_ID, 3, 0), (OBS_ID + 3, 3, 0), (OBS_ID + 6, 2, 0)]
+    assert context.get_second_chunks(OBS_ID, OBS_ID + 2, 0) == [(OBS_ID, 1, 0), (OBS_ID + 1, 1, 0)]
+    assert context.get_second_chunks(OBS_ID, OBS_ID, 0) == []
+
+    for chunk_seconds in (0, -1):
+        with pytest.raises(PymwalibInvalidArgumentError):
+            context.get_second_chunks(OBS_ID, OBS_ID + 8, 0, chunk_seconds)
+
+
+def test_iter_seconds(tmp_path):
+    context = make_mwax_context(tmp_path, [OBS_ID, OBS_ID + 8])
+    prefetch = 2
+
+    chunks = []
+    buffer_addresses = set()
+    for gps_second, data in context.iter_seconds(OBS_ID, OBS_ID + 16, 0, chunk_seconds=3, prefetch=prefetch):
+        buffer_addresses.add(data.__array_interface__["data"][0])
+        chunks.append((gps_second, data.copy()))
+
+    # The chunk at OBS_ID + 6 runs across the two subfiles, and the last is the 1 second prefix of its buffer
+    assert [gps_second for gps_second, _ in chunks] == [OBS_ID + second for second in (0, 3, 6, 9, 12, 15)]
+    for gps_second, data in chunks:
+        gps_second_count = min(3, OBS_ID + 16 - gps_second)
+        assert data.size == gps_second_count * BYTES_PER_SECOND
+        np.testing.assert_array_equal(data, get_expected_seconds(tmp_path, gps_second, gps_second_count))
+
+    # Chunks are read into a ring of prefetch + 1 recycled buffers
+    assert len(buffer_addresses) == prefetch + 1
+
+
+def test_iter_seconds_legacy(tmp_path):
+    context = make_legacy_context(tmp_path, [OBS_ID, OBS_ID + 1, OBS_ID + 2])
+    seconds = [np.fromfile(tmp_path / f"{OBS_ID}_{gps_second}_ch{REC_CHAN_NUMBER}.dat", dtype=np.int8)
+               for gps_second in (OBS_ID, OBS_ID + 1, OBS_ID + 2)]
+
+    # Each chunk runs across the 1 second .dat files in file order
+    chunks = [(gps_second, data.copy()) for gps_second, data in context.iter_seconds(OBS_ID, OBS_ID + 3, 0, 2)]
+    assert [gps_second for gps_second, _ in chunks] == [OBS_ID, OBS_ID + 2]
+    np.testing.assert_array_equal(chunks[0][1], np.concatenate(seconds[:2]))
+    np.testing.assert_array_equal(chunks[1][1], seconds[2])
+
+
+def test_iter_seconds_skips_missing_data(tmp_path):
+    # There is no subfile for the timestep at OBS_ID + 8
+    context = make_mwax_context(tmp_path, [OBS_ID, OBS_ID + 16])
+
+    gps_seconds = [gps_second for gps_second, _ in context.iter_seconds(OBS_ID, OBS_ID + 24, 0, chunk_seconds=4)]
+    assert gps_seconds == [OBS_ID, OBS_ID + 4, OBS_ID + 16, OBS_ID + 20]
+
+    # A chunk which is only partly in a missing subfile is skipped too
+    gps_seconds = [gps_second for gps_second, _ in context.iter_seconds(OBS_ID, OBS_ID + 24, 0, chunk_seconds=6)]
+    assert gps_seconds == [OBS_ID, OBS_ID + 18]
+
+    with pytest.raises(PymwalibNoDataForTimestepAndCoarseChannelError):
+        context.read_second(OBS_ID + 6, 3, 0)
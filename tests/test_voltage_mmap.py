@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from pymwalib.errors import PymwalibInvalidArgumentError
+from pymwalib.voltage_mmap import VoltageFileReader, LEGACY_DAT_FILENAME_RE
+
+HEADER_SIZE = 4096
+DELAY_BLOCK_SIZE = 32
+VOLTAGE_BLOCK_SIZE = 32
+NUM_BLOCKS = 16
+
+LEGACY_NUM_SAMPLES = 10
+LEGACY_NUM_FINE_CHANS = 4
+LEGACY_NUM_INPUTS = 6
+
+
+def write_subfile(path, gps_time: int, rec_chan_number: int) -> np.ndarray:
+    voltages = (np.arange(NUM_BLOCKS * VOLTAGE_BLOCK_SIZE) % 251 - 125).astype(np.int8)
+    filename = path / f"1300000000_{gps_time}_{rec_chan_number}.sub"
+    np.concatenate([np.full(HEADER_SIZE, ord(" "), dtype=np.int8),
+                    np.full(DELAY_BLOCK_SIZE, 7, dtype=np.int8),
+                    voltages]).tofile(filename)
+    return str(filename), voltages
+
+
+def test_voltage_file_reader(tmp_path):
+    filename, voltages = write_subfile(tmp_path, 1300000008, 117)
+    reader = VoltageFileReader([filename], HEADER_SIZE, DELAY_BLOCK_SIZE, VOLTAGE_BLOCK_SIZE, NUM_BLOCKS)
+
+    assert reader.has_file(1300000008, 117)
+    assert not reader.has_file(1300000000, 117)
+    assert reader.get_voltage_blocks(1300000000, 117) is None
+
+    blocks = reader.get_voltage_blocks(1300000008, 117)
+    assert blocks.shape == (NUM_BLOCKS, VOLTAGE_BLOCK_SIZE)
+    assert not blocks.flags.writeable
+    np.testing.assert_array_equal(blocks.ravel(), voltages)
+    assert (reader.get_delay_block(1300000008, 117) == 7).all()
+
+    with pytest.raises(PymwalibInvalidArgumentError):
+        VoltageFileReader([str(tmp_path / "not_a_subfile.dat")], HEADER_SIZE, DELAY_BLOCK_SIZE, VOLTAGE_BLOCK_SIZE,
+                          NUM_BLOCKS)
+
+
+def test_legacy_voltage_file_reader(tmp_path):
+    shape = (LEGACY_NUM_SAMPLES, LEGACY_NUM_FINE_CHANS, LEGACY_NUM_INPUTS)
+    voltages = (np.arange(np.prod(shape)) % 256 - 128).astype(np.int8)
+    filename = tmp_path / "1101503312_1101503313_ch123.dat"
+    voltages.tofile(filename)
+
+    reader = VoltageFileReader([str(filename)], 0, 0, voltages.size, 1, LEGACY_DAT_FILENAME_RE)
+
+    assert reader.has_file(1101503313, 123)
+    blocks = reader.get_voltage_blocks(1101503313, 123)
+    assert blocks.shape == (1, voltages.size)
+    np.testing.assert_array_equal(blocks.ravel(), voltages)
+    assert reader.get_delay_block(1101503313, 123).size == 0
+
+    with pytest.raises(PymwalibInvalidArgumentError):
+        VoltageFileReader([str(tmp_path / "1101503312_1101503313_123.sub")], 0, 0, voltages.size, 1,
+                          LEGACY_DAT_FILENAME_RE)